@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import threading
+from multiprocessing.pool import ThreadPool
+
+from pagador_pagseguro_transparente import servicos
+
+CONSULTAS_SIMULTANEAS = 100
+
+ETAPAS = (
+    (servicos.RegistraNotificacao, 'obtem_informacoes_pagamento', 'monta_dados_pagamento'),
+    (servicos.RegistraResultado, 'obtem_informacoes_pagamento', 'monta_dados_pagamento'),
+    (servicos.AtualizaTransacoes, 'consulta_transacoes', 'analisa_resultado_transacoes'),
+)
+
+_pool = None
+_trava = threading.Lock()
+
+
+def pool_de_consultas():
+    global _pool
+    with _trava:
+        if _pool is None:
+            _pool = ThreadPool(CONSULTAS_SIMULTANEAS)
+        return _pool
+
+
+def _etapas_do_servico(servico):
+    for classe, consulta, analise in ETAPAS:
+        if isinstance(servico, classe):
+            return consulta, analise
+    raise TypeError(u'O serviço {} não tem consulta ao PagSeguro.'.format(servico.__class__.__name__))
+
+
+class ConsultaAssincrona(object):
+    """
+    Faz a chamada HTTP do serviço (RegistraResultado, RegistraNotificacao ou AtualizaTransacoes) no pool de consultas,
+    deixando quem chamou livre enquanto o PagSeguro responde. A análise da resposta continua sendo feita pelo próprio
+    serviço (monta_dados_pagamento ou analisa_resultado_transacoes), na thread de quem chama aguarda().
+    """
+    def __init__(self, servico, pool=None):
+        self.servico = servico
+        self._consulta, self._analise = _etapas_do_servico(servico)
+        self._analisada = False
+        self._execucao = (pool or pool_de_consultas()).apply_async(self._executa)
+
+    def _executa(self):
+        self.servico.define_credenciais()
+        getattr(self.servico, self._consulta)()
+
+    @property
+    def pronta(self):
+        return self._execucao.ready()
+
+    def aguarda(self, timeout=None):
+        """
+        Espera a resposta, roda a análise do serviço uma vez e retorna o serviço.
+        Exceções da consulta são disparadas aqui.
+        """
+        self._execucao.get(timeout)
+        if not self._analisada:
+            getattr(self.servico, self._analise)()
+            self._analisada = True
+        return self.servico
+
+
+def consulta(servico, pool=None):
+    return ConsultaAssincrona(servico, pool=pool)
+
+
+def consulta_todos(lista_servicos, timeout=None, pool=None):
+    consultas = [consulta(servico, pool=pool) for servico in lista_servicos]
+    return [consulta_em_andamento.aguarda(timeout) for consulta_em_andamento in consultas]
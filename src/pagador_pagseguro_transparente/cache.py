@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheTTL(object):
+    """
+    Cache em memória, seguro para threads, com tempo de vida por entrada e descarte do menos usado
+    quando passa de tamanho_maximo. Conta acertos e faltas para métricas.
+    """
+    _AUSENTE = object()
+
+    def __init__(self, tempo_vida, tamanho_maximo=None, relogio=time.time):
+        self.tempo_vida = tempo_vida
+        self.tamanho_maximo = tamanho_maximo
+        self.relogio = relogio
+        self.acertos = 0
+        self.faltas = 0
+        self._entradas = OrderedDict()
+        self._trava = threading.Lock()
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def consulta(self, chave, padrao=None):
+        with self._trava:
+            entrada = self._entradas.get(chave, self._AUSENTE)
+            if entrada is not self._AUSENTE and entrada[1] <= self.relogio():
+                del self._entradas[chave]
+                entrada = self._AUSENTE
+            if entrada is self._AUSENTE:
+                self.faltas += 1
+                return padrao
+            self.acertos += 1
+            del self._entradas[chave]
+            self._entradas[chave] = entrada
+            return entrada[0]
+
+    def define(self, chave, valor, tempo_vida=None):
+        if tempo_vida is None:
+            tempo_vida = self.tempo_vida
+        with self._trava:
+            self._entradas.pop(chave, None)
+            self._entradas[chave] = (valor, self.relogio() + tempo_vida)
+            if self.tamanho_maximo:
+                while len(self._entradas) > self.tamanho_maximo:
+                    self._entradas.popitem(last=False)
+        return valor
+
+    def obtem(self, chave, carregador):
+        """
+        Retorna o valor em cache para a chave ou chama carregador() e guarda o resultado.
+        """
+        valor = self.consulta(chave, self._AUSENTE)
+        if valor is self._AUSENTE:
+            valor = self.define(chave, carregador())
+        return valor
+
+    def invalida(self, chave):
+        with self._trava:
+            self._entradas.pop(chave, None)
+
+    def invalida_onde(self, condicao):
+        with self._trava:
+            for chave in [chave for chave in self._entradas if condicao(chave)]:
+                del self._entradas[chave]
+
+    def limpa(self):
+        with self._trava:
+            self._entradas.clear()
+            self.acertos = 0
+            self.faltas = 0
+
+    def estatisticas(self):
+        return {'acertos': self.acertos, 'faltas': self.faltas, 'itens': len(self._entradas)}
+
+
+class _Chamada(object):
+    __slots__ = ('evento', 'resultado', 'erro')
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.erro = None
+
+
+class ChamadaUnica(object):
+    """
+    Junta chamadas concorrentes para a mesma chave: só a primeira executa a função e as outras esperam e recebem o
+    mesmo resultado (ou a mesma exceção). Terminada a chamada, a próxima executa de novo.
+    """
+    def __init__(self):
+        self.compartilhadas = 0
+        self._em_andamento = {}
+        self._trava = threading.Lock()
+
+    def executa(self, chave, funcao):
+        with self._trava:
+            chamada = self._em_andamento.get(chave)
+            dona = chamada is None
+            if dona:
+                chamada = self._em_andamento[chave] = _Chamada()
+            else:
+                self.compartilhadas += 1
+        if not dona:
+            chamada.evento.wait()
+            if chamada.erro is not None:
+                raise chamada.erro
+            return chamada.resultado
+        try:
+            chamada.resultado = funcao()
+        except Exception as erro:
+            chamada.erro = erro
+            raise
+        finally:
+            with self._trava:
+                del self._em_andamento[chave]
+            chamada.evento.set()
+        return chamada.resultado
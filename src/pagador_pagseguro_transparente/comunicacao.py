@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+import cookielib
+import json
+import threading
+import time
+from contextlib import contextmanager
+from urlparse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from li_common.comunicacao import requisicao
+
+from pagador_pagseguro_transparente import resiliencia, respostas
+
+MAXIMO_SESSOES_POR_HOST = 10
+TEMPO_MAXIMO_OCIOSO = 60
+
+
+class _SemCookies(cookielib.DefaultCookiePolicy):
+    """
+    Política que recusa guardar e enviar cookies.
+    """
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+
+class PoolDeSessoes(object):
+    """
+    Mantém sessões HTTP keep-alive por host para reaproveitar as conexões TLS com o PagSeguro entre requisições.
+    Cada sessão é usada por uma thread de cada vez; sessões ociosas por mais de tempo_maximo_ocioso são fechadas e
+    no máximo maximo_por_host ficam guardadas por host.
+    As sessões são compartilhadas entre as lojas e não guardam cookies, para que um cookie recebido na requisição de
+    uma loja não seja enviado na de outra.
+    """
+    def __init__(self, maximo_por_host=MAXIMO_SESSOES_POR_HOST, tempo_maximo_ocioso=TEMPO_MAXIMO_OCIOSO, relogio=time.time):
+        self.maximo_por_host = maximo_por_host
+        self.tempo_maximo_ocioso = tempo_maximo_ocioso
+        self.relogio = relogio
+        self.criadas = 0
+        self.reaproveitadas = 0
+        self._ociosas = {}
+        self._trava = threading.Lock()
+
+    def cria_sessao(self):
+        sessao = requests.Session()
+        sessao.cookies.set_policy(_SemCookies())
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        sessao.mount('https://', adaptador)
+        sessao.mount('http://', adaptador)
+        return sessao
+
+    def _descarta_ociosas(self, agora):
+        limite = agora - self.tempo_maximo_ocioso
+        descartadas = []
+        for host, sessoes in self._ociosas.items():
+            while sessoes and sessoes[0][1] < limite:
+                descartadas.append(sessoes.pop(0)[0])
+            if not sessoes:
+                del self._ociosas[host]
+        return descartadas
+
+    def pega(self, host):
+        with self._trava:
+            descartadas = self._descarta_ociosas(self.relogio())
+            sessoes = self._ociosas.get(host)
+            sessao = sessoes.pop()[0] if sessoes else None
+            if sessao:
+                self.reaproveitadas += 1
+            else:
+                self.criadas += 1
+        for descartada in descartadas:
+            descartada.close()
+        return sessao or self.cria_sessao()
+
+    def devolve(self, host, sessao):
+        with self._trava:
+            sessoes = self._ociosas.setdefault(host, [])
+            if len(sessoes) >= self.maximo_por_host:
+                sessao_extra = sessao
+            else:
+                sessao_extra = None
+                sessoes.append((sessao, self.relogio()))
+        if sessao_extra:
+            sessao_extra.close()
+
+    @contextmanager
+    def sessao(self, url):
+        host = urlparse(url).netloc
+        sessao = self.pega(host)
+        try:
+            yield sessao
+        except Exception:
+            sessao.close()
+            raise
+        self.devolve(host, sessao)
+
+    def fecha(self):
+        with self._trava:
+            ociosas, self._ociosas = self._ociosas, {}
+        for sessoes in ociosas.values():
+            for sessao, _ in sessoes:
+                sessao.close()
+
+    def estatisticas(self):
+        with self._trava:
+            ociosas = sum(len(sessoes) for sessoes in self._ociosas.values())
+        return {'criadas': self.criadas, 'reaproveitadas': self.reaproveitadas, 'ociosas': ociosas}
+
+
+POOL = PoolDeSessoes()
+
+
+class Conexao(requisicao.Conexao):
+    """
+    Conexão HTTP usada pelos serviços do PagSeguro. As chamadas usam as sessões keep-alive do pool em vez de abrir
+    uma conexão nova a cada requisição.
+    Quando o formato de envio é form urlencode e os dados já vêm codificados (str ou iterável de pedaços, como o
+    gerado por Malote.codifica_formulario), o corpo é repassado como está, sem ser codificado de novo.
+    Respostas XML são lidas pelo respostas.xml_para_dict, que guarda em conteudo só os campos usados pelos serviços;
+    o corpo recebido fica inteiro em corpo, para as evidências.
+    Cada chamada passa pelo disjuntor do host: com ele aberto, o PagSeguro não é chamado e get/post retornam a
+    resiliencia.RespostaIndisponivel (erro do servidor, sucesso False), sem novas tentativas.
+    Com uma politica (resiliencia.PoliticaDeTentativas), ela substitui a repetição padrão do requisicao.Conexao e cada
+    tentativa da última requisição fica anotada em tentativas.
+    """
+    def __init__(self, formato_envio=requisicao.Formato.json, formato_resposta=requisicao.Formato.json, headers=None, credenciador=None, pool=POOL, disjuntores=resiliencia.DISJUNTORES, politica=None):
+        super(Conexao, self).__init__(formato_envio, formato_resposta, headers=headers, credenciador=credenciador)
+        self.pool = pool
+        self.disjuntores = disjuntores
+        self.politica = politica
+        self.primeira_tentativa = 1
+        self.tentativas = []
+
+    def _argumentos_envio(self):
+        if self.formato_envio == requisicao.Formato.querystring:
+            return {'params': self.dados_envio}
+        if self.formato_envio == requisicao.Formato.form_urlencode:
+            return {'data': self.dados_envio.get('dados', self.dados_envio)}
+        if self.formato_envio == requisicao.Formato.xml:
+            return {'data': self.dados_envio.get('dados', '')}
+        return {'data': json.dumps(self.dados_envio)}
+
+    def prepara_request(self, url, metodo=requisicao.TipoMetodo.get, dados=None):
+        try:
+            return super(Conexao, self).prepara_request(url, metodo, dados)
+        except resiliencia.CircuitoAberto as erro:
+            return erro.resposta
+
+    def faz_request(self, url, metodo=requisicao.TipoMetodo.get):
+        if self.politica is None:
+            return super(Conexao, self).faz_request(url, metodo)
+        self.tentativas = []
+        return self.politica.executa(lambda: self.faz_um_request(url, metodo), primeira_tentativa=self.primeira_tentativa, registro=self.tentativas)
+
+    def faz_um_request(self, url, metodo=requisicao.TipoMetodo.get):
+        if self.disjuntores is None:
+            return self._faz_um_request(url, metodo)
+        disjuntor = self.disjuntores.do_host(url)
+        if not disjuntor.permite():
+            raise resiliencia.CircuitoAberto(urlparse(url).netloc)
+        inicio = time.time()
+        try:
+            resposta = self._faz_um_request(url, metodo)
+        except Exception:
+            disjuntor.registra(False, time.time() - inicio)
+            raise
+        disjuntor.registra(resposta.status_code < 500 and not resposta.timeout, time.time() - inicio)
+        return resposta
+
+    def _faz_um_request(self, url, metodo):
+        if self.credenciador:
+            url = self.define_url_com_autenticacao(url)
+        argumentos = self._argumentos_envio()
+        if self.pool is None:
+            resposta = getattr(requests, metodo)(url, headers=self.headers, timeout=requisicao.REQUEST_BASE_TIMEOUT, **argumentos)
+        else:
+            with self.pool.sessao(url) as sessao:
+                resposta = getattr(sessao, metodo)(url, headers=self.headers, timeout=requisicao.REQUEST_BASE_TIMEOUT, **argumentos)
+        return self._monta_resposta(resposta)
+
+    def _monta_resposta(self, resposta):
+        if self.formato_resposta != requisicao.Formato.xml:
+            return requisicao.Resposta(resposta, formato_resposta=self.formato_resposta)
+        retorno = requisicao.Resposta(resposta, formato_resposta=None)
+        retorno.corpo = resposta.content
+        retorno.conteudo = respostas.xml_para_dict(resposta.content)
+        return retorno
+
+
+def obtem_conexao(formato_envio, formato_resposta, pool=POOL, disjuntores=resiliencia.DISJUNTORES, politica=None):
+    return Conexao(formato_envio=formato_envio, formato_resposta=formato_resposta, pool=pool, disjuntores=disjuntores, politica=politica)
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+from urlparse import urlparse
+
+from pagador_pagseguro_transparente import servicos
+
+CONCORRENCIA = 20
+MAXIMO_POR_HOST = 10
+REQUISICOES_POR_SEGUNDO = 5
+STATUS_LIMITE_EXCEDIDO = 429
+TENTATIVAS_LIMITE_EXCEDIDO = 3
+ESPERA_LIMITE_EXCEDIDO = 5
+
+
+def _descreve_erro(erro):
+    try:
+        mensagem = unicode(erro)
+    except UnicodeDecodeError:
+        mensagem = str(erro).decode('utf-8', 'replace')
+    return u'{}: {}'.format(erro.__class__.__name__, mensagem)
+
+
+class LimitadorDeTaxa(object):
+    """
+    Balde de fichas compartilhado entre as threads: libera até por_segundo requisições por segundo, com rajada de
+    até rajada fichas acumuladas. penaliza() segura todo mundo quando o PagSeguro responde que o limite foi excedido.
+    """
+    def __init__(self, por_segundo, rajada=None, relogio=time.time, dorme=time.sleep):
+        self.por_segundo = float(por_segundo)
+        self.rajada = float(rajada or por_segundo)
+        self.relogio = relogio
+        self.dorme = dorme
+        self._fichas = self.rajada
+        self._atualizado_em = relogio()
+        self._liberado_em = 0
+        self._trava = threading.Lock()
+
+    def _espera_necessaria(self):
+        agora = self.relogio()
+        if agora < self._liberado_em:
+            return self._liberado_em - agora
+        self._fichas = min(self.rajada, self._fichas + (agora - self._atualizado_em) * self.por_segundo)
+        self._atualizado_em = agora
+        if self._fichas >= 1:
+            self._fichas -= 1
+            return 0
+        return (1 - self._fichas) / self.por_segundo
+
+    def aguarda(self):
+        while True:
+            with self._trava:
+                espera = self._espera_necessaria()
+            if not espera:
+                return
+            self.dorme(espera)
+
+    def penaliza(self, segundos):
+        with self._trava:
+            self._liberado_em = max(self._liberado_em, self.relogio() + segundos)
+            self._fichas = 0
+
+
+class LimiteDeHosts(object):
+    """
+    Limita quantas requisições ficam abertas ao mesmo tempo para cada host.
+    """
+    def __init__(self, maximo_por_host):
+        self.maximo_por_host = maximo_por_host
+        self._semaforos = {}
+        self._trava = threading.Lock()
+
+    def _semaforo(self, host):
+        with self._trava:
+            if host not in self._semaforos:
+                self._semaforos[host] = threading.BoundedSemaphore(self.maximo_por_host)
+            return self._semaforos[host]
+
+    @contextmanager
+    def ocupa(self, url):
+        semaforo = self._semaforo(urlparse(url).netloc)
+        semaforo.acquire()
+        try:
+            yield
+        finally:
+            semaforo.release()
+
+
+class Checkpoint(object):
+    """
+    Arquivo JSON lines com uma linha por loja concluída, para retomar uma conciliação interrompida.
+    Lojas que terminaram com erro são refeitas. Use um arquivo por período conciliado.
+    """
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._lojas = self._carrega()
+        self._trava = threading.Lock()
+
+    def _carrega(self):
+        lojas = {}
+        if not os.path.exists(self.caminho):
+            return lojas
+        with open(self.caminho) as arquivo:
+            for linha in arquivo:
+                try:
+                    registro = json.loads(linha)
+                except ValueError:
+                    continue
+                lojas[registro['loja_id']] = registro
+        return lojas
+
+    def concluida(self, loja_id):
+        registro = self._lojas.get(loja_id)
+        return bool(registro) and not registro.get('erro')
+
+    def marca(self, loja_id, **registro):
+        registro['loja_id'] = loja_id
+        linha = json.dumps(registro)
+        with self._trava:
+            self._lojas[loja_id] = registro
+            with open(self.caminho, 'a') as arquivo:
+                arquivo.write(linha + '\n')
+
+
+class Estatisticas(object):
+    CONTADORES = ('lojas', 'lojas_com_erro', 'lojas_puladas', 'paginas', 'transacoes', 'limite_excedido')
+
+    def __init__(self, relogio=time.time):
+        self.relogio = relogio
+        self.inicio = relogio()
+        self._contadores = dict.fromkeys(self.CONTADORES, 0)
+        self._trava = threading.Lock()
+
+    def soma(self, **valores):
+        with self._trava:
+            for nome, valor in valores.items():
+                self._contadores[nome] += valor
+
+    def como_dict(self):
+        with self._trava:
+            resultado = dict(self._contadores)
+        segundos = max(self.relogio() - self.inicio, 0.000001)
+        resultado['segundos'] = segundos
+        resultado['lojas_por_segundo'] = resultado['lojas'] / segundos
+        resultado['paginas_por_segundo'] = resultado['paginas'] / segundos
+        resultado['transacoes_por_segundo'] = resultado['transacoes'] / segundos
+        return resultado
+
+
+class AtualizaTransacoesDaConciliacao(servicos.AtualizaTransacoes):
+    """
+    AtualizaTransacoes que passa cada página da busca pelos limites da conciliação.
+    """
+    def __init__(self, loja_id, dados, conciliacao):
+        super(AtualizaTransacoesDaConciliacao, self).__init__(loja_id, dados)
+        self.conciliacao = conciliacao
+
+    def _consulta_pagina(self, dados_envio, pagina):
+        consulta = super(AtualizaTransacoesDaConciliacao, self)._consulta_pagina
+        return self.conciliacao.consulta_pagina(self.url, lambda: consulta(dados_envio, pagina))
+
+
+class ConciliaTransacoes(object):
+    """
+    Roda a busca de transações do AtualizaTransacoes para várias lojas em paralelo, no mesmo período.
+    As páginas passam pelo limitador de taxa e pelo limite por host; uma resposta 429 do PagSeguro segura todas as
+    threads e a página é pedida de novo. Cada transação é entregue a ao_atualizar(loja_id, dados_pedido), no
+    formato do analisa_resultado_transacoes. Com checkpoint, as lojas já concluídas são puladas.
+    """
+    def __init__(self, data_inicial, data_final=None, concorrencia=CONCORRENCIA, maximo_por_host=MAXIMO_POR_HOST,
+                 requisicoes_por_segundo=REQUISICOES_POR_SEGUNDO, checkpoint=None, ao_atualizar=None, pre_carrega=False):
+        self.dados = {'data_inicial': data_inicial}
+        if data_final:
+            self.dados['data_final'] = data_final
+        self.concorrencia = concorrencia
+        self.limitador = LimitadorDeTaxa(requisicoes_por_segundo)
+        self.hosts = LimiteDeHosts(maximo_por_host)
+        self.checkpoint = checkpoint
+        self.ao_atualizar = ao_atualizar
+        self.pre_carrega = pre_carrega
+        self.estatisticas = Estatisticas()
+        self.erros = {}
+
+    def cria_servico(self, loja_id):
+        return AtualizaTransacoesDaConciliacao(loja_id, dict(self.dados), self)
+
+    def consulta_pagina(self, url, consulta):
+        for tentativa in range(1, TENTATIVAS_LIMITE_EXCEDIDO + 1):
+            self.limitador.aguarda()
+            with self.hosts.ocupa(url):
+                resposta = consulta()
+            self.estatisticas.soma(paginas=1)
+            if getattr(resposta, 'status_code', None) != STATUS_LIMITE_EXCEDIDO:
+                break
+            self.estatisticas.soma(limite_excedido=1)
+            self.limitador.penaliza(ESPERA_LIMITE_EXCEDIDO * tentativa)
+        return resposta
+
+    def _concilia_loja(self, loja_id):
+        if self.checkpoint and self.checkpoint.concluida(loja_id):
+            self.estatisticas.soma(lojas_puladas=1)
+            return
+        transacoes = 0
+        erro = None
+        try:
+            servico = self.cria_servico(loja_id)
+            servico.define_credenciais()
+            for dados_pedido in servico.itera_transacoes(pre_carrega=self.pre_carrega):
+                if self.ao_atualizar:
+                    self.ao_atualizar(loja_id, dados_pedido)
+                transacoes += 1
+            erro = servico.erros
+        except Exception as excecao:
+            erro = _descreve_erro(excecao)
+        self.estatisticas.soma(lojas=1, transacoes=transacoes, lojas_com_erro=1 if erro else 0)
+        if erro:
+            self.erros[loja_id] = erro
+        if self.checkpoint:
+            self.checkpoint.marca(loja_id, transacoes=transacoes, erro=erro)
+
+    def executa(self, lojas):
+        """
+        Concilia todas as lojas e retorna as estatísticas da execução. Os erros de cada loja ficam em self.erros.
+        """
+        pool = ThreadPool(self.concorrencia)
+        try:
+            for _ in pool.imap_unordered(self._concilia_loja, lojas):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+        return self.estatisticas.como_dict()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import time
+
+from pagador_pagseguro_transparente import cache
+
+TEMPO_CACHE = 5
+TAMANHO_MAXIMO = 10000
+
+
+class ConsultasCompartilhadas(object):
+    """
+    Junta as consultas de transação e de notificação ao PagSeguro: chamadas simultâneas para a mesma chave esperam
+    uma única requisição e recebem a mesma resposta, e as respostas com sucesso ficam tempo_vida segundos em cache
+    para as chamadas logo depois (retorno do checkout, notificação e recargas da página de resultado).
+    """
+    def __init__(self, tempo_vida=TEMPO_CACHE, tamanho_maximo=TAMANHO_MAXIMO, relogio=time.time):
+        self.cache = cache.CacheTTL(tempo_vida, tamanho_maximo=tamanho_maximo, relogio=relogio)
+        self.chamadas = cache.ChamadaUnica()
+        self.consultas = 0
+
+    def consulta(self, chave, funcao):
+        """
+        Retorna a resposta em cache para a chave ou a de funcao(), executada uma vez só entre as chamadas simultâneas.
+        """
+        resposta = self.cache.consulta(chave)
+        if resposta is None:
+            resposta = self.chamadas.executa(chave, lambda: self._carrega(chave, funcao))
+        return resposta
+
+    def _carrega(self, chave, funcao):
+        resposta = self.cache.consulta(chave)
+        if resposta is None:
+            self.consultas += 1
+            resposta = self.guarda(chave, funcao())
+        return resposta
+
+    def guarda(self, chave, resposta):
+        if getattr(resposta, 'sucesso', False):
+            self.cache.define(chave, resposta)
+        return resposta
+
+    def limpa(self):
+        self.cache.limpa()
+        self.consultas = 0
+
+    def estatisticas(self):
+        estatisticas = self.cache.estatisticas()
+        estatisticas['consultas'] = self.consultas
+        estatisticas['compartilhadas'] = self.chamadas.compartilhadas
+        return estatisticas
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import time
+from decimal import Decimal
+from multiprocessing.pool import ThreadPool
+
+from li_common.comunicacao import requisicao
+from requests.exceptions import RequestException
+
+from pagador import configuracoes
+from pagador_pagseguro_transparente import cache, comunicacao, entidades, parcelamento, resiliencia, servicos
+
+TEMPO_CACHE_COTACOES = 60 * 60
+TAMANHO_MAXIMO_COTACOES = 20000
+CONCORRENCIA_AQUECIMENTO = 4
+BANDEIRAS = tuple(entidades.ConfiguracaoMeioPagamento.modos_pagamento_aceitos['cartoes'])
+VALORES_AQUECIMENTO = tuple(Decimal(valor) for valor in ('19.90', '29.90', '39.90', '49.90', '59.90', '79.90', '99.90', '149.90', '199.90', '299.90'))
+
+
+def url_parcelamento():
+    sandbox = 'sandbox.' if configuracoes.ENVIRONMENT in ('local', 'development') else ''
+    return 'https://ws.{}pagseguro.uol.com.br/v2/installments'.format(sandbox)
+
+
+class CotacaoIndisponivel(Exception):
+    def __init__(self, mensagem, status_code=None):
+        super(CotacaoIndisponivel, self).__init__(mensagem)
+        self.status_code = status_code
+
+
+class CotacoesDeParcelamento(object):
+    """
+    Cotações de parcelamento do PagSeguro (com os juros de cada bandeira) em cache por
+    (aplicação, bandeira, valor, parcelas sem juros), com tempo de vida e descarte do menos usado.
+    Consultas simultâneas da mesma cotação fazem uma única chamada ao PagSeguro. Falhas não ficam em cache.
+    """
+    def __init__(self, tempo_vida=TEMPO_CACHE_COTACOES, tamanho_maximo=TAMANHO_MAXIMO_COTACOES, url=None, relogio=time.time):
+        self.cache = cache.CacheTTL(tempo_vida, tamanho_maximo=tamanho_maximo, relogio=relogio)
+        self.chamadas = cache.ChamadaUnica()
+        self.url = url
+        self.consultas = 0
+
+    @staticmethod
+    def _parcelas_sem_juros(configuracao, parcelas_sem_juros):
+        if parcelas_sem_juros is None:
+            parcelas_sem_juros = getattr(configuracao, 'parcelas_sem_juros', None)
+        return max(parcelamento._inteiro(parcelas_sem_juros, 1), 1)
+
+    def chave(self, configuracao, bandeira, valor, parcelas_sem_juros=None):
+        return (
+            servicos.aplicacao_do_contrato(configuracao), bandeira, parcelamento._centavos(valor),
+            self._parcelas_sem_juros(configuracao, parcelas_sem_juros)
+        )
+
+    def cotacao(self, configuracao, parametros_contrato, bandeira, valor, parcelas_sem_juros=None):
+        """
+        Retorna as parcelas (parcelamento.Parcela) que o PagSeguro oferece para o valor na bandeira.
+        parametros_contrato é o dicionário com app_id e app_secret da aplicação (servicos.obtem_parametros_contrato).
+        Dispara CotacaoIndisponivel se o PagSeguro não responder com as parcelas.
+        """
+        chave = self.chave(configuracao, bandeira, valor, parcelas_sem_juros)
+        parcelas = self.cache.consulta(chave)
+        if parcelas is None:
+            parcelas = self.chamadas.executa(chave, lambda: self._carrega(chave, configuracao, parametros_contrato))
+        return parcelas
+
+    def _carrega(self, chave, configuracao, parametros_contrato):
+        parcelas = self.cache.consulta(chave)
+        if parcelas is None:
+            parcelas = self.cache.define(chave, self._consulta(chave, configuracao, parametros_contrato))
+        return parcelas
+
+    def _consulta(self, chave, configuracao, parametros_contrato):
+        _, bandeira, centavos, parcelas_sem_juros = chave
+        dados = {
+            'appKey': parametros_contrato['app_secret'],
+            'appId': parametros_contrato['app_id'],
+            'amount': str(parcelamento._reais(centavos)),
+            'cardBrand': bandeira,
+        }
+        if parcelas_sem_juros > 1:
+            dados['maxInstallmentNoInterest'] = parcelas_sem_juros
+        conexao = comunicacao.obtem_conexao(requisicao.Formato.querystring, requisicao.Formato.xml, politica=resiliencia.PoliticaDeTentativas())
+        conexao.credenciador = servicos.Credenciador(configuracao=configuracao)
+        self.consultas += 1
+        resposta = conexao.get(self.url or url_parcelamento(), dados=dados)
+        if not resposta.sucesso or 'installments' not in resposta.conteudo:
+            raise CotacaoIndisponivel(u'O PagSeguro não retornou o parcelamento. Código: {}'.format(resposta.status_code), resposta.status_code)
+        return self._parcelas(resposta.conteudo['installments'])
+
+    @staticmethod
+    def _parcelas(parcelas):
+        if type(parcelas) is dict:
+            parcelas = [parcelas]
+        resultado = []
+        for parcela in parcelas or []:
+            parcela = parcela['installment']
+            resultado.append(parcelamento.Parcela(
+                int(parcela['quantity']), Decimal(parcela['amount']), Decimal(parcela['totalAmount']), parcela.get('interestFree') == 'true'
+            ))
+        return sorted(resultado, key=lambda parcela: parcela.quantidade)
+
+    def aquece(self, configuracao, parametros_contrato, valores=VALORES_AQUECIMENTO, bandeiras=BANDEIRAS, parcelas_sem_juros=None, concorrencia=CONCORRENCIA_AQUECIMENTO):
+        """
+        Carrega no cache as cotações dos valores em todas as bandeiras. Retorna as chaves que falharam.
+        """
+        def carrega(argumentos):
+            bandeira, valor = argumentos
+            try:
+                self.cotacao(configuracao, parametros_contrato, bandeira, valor, parcelas_sem_juros)
+            except (CotacaoIndisponivel, RequestException) as erro:
+                return self.chave(configuracao, bandeira, valor, parcelas_sem_juros), erro
+            return None
+
+        pool = ThreadPool(concorrencia)
+        try:
+            falhas = pool.map(carrega, [(bandeira, valor) for valor in valores for bandeira in bandeiras])
+        finally:
+            pool.close()
+            pool.join()
+        return dict(falha for falha in falhas if falha)
+
+    def limpa(self):
+        self.cache.limpa()
+        self.consultas = 0
+
+    def estatisticas(self):
+        estatisticas = self.cache.estatisticas()
+        estatisticas['consultas'] = self.consultas
+        estatisticas['compartilhadas'] = self.chamadas.compartilhadas
+        return estatisticas
+
+
+COTACOES = CotacoesDeParcelamento()
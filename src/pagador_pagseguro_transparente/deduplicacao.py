@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import json
+import sqlite3
+import threading
+import time
+
+from pagador_pagseguro_transparente import cache
+
+RETENCAO = 7 * 24 * 60 * 60
+TAMANHO_MAXIMO = 100000
+GRAVACOES_ENTRE_LIMPEZAS = 1000
+
+
+class BackendSQLite(object):
+    """
+    Guarda as notificações processadas num arquivo SQLite, compartilhado entre os processos da máquina.
+    Registros mais velhos que a retenção são ignorados na consulta e apagados de tempos em tempos.
+    """
+    def __init__(self, caminho, retencao=RETENCAO, relogio=time.time):
+        self.caminho = caminho
+        self.retencao = retencao
+        self.relogio = relogio
+        self._gravacoes = 0
+        self._trava = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, timeout=5, check_same_thread=False)
+        with self._conexao:
+            self._conexao.execute(
+                'CREATE TABLE IF NOT EXISTS notificacoes_processadas '
+                '(chave TEXT PRIMARY KEY, resultado TEXT NOT NULL, registrado_em REAL NOT NULL)'
+            )
+
+    def consulta(self, chave):
+        with self._trava:
+            linha = self._conexao.execute(
+                'SELECT resultado FROM notificacoes_processadas WHERE chave = ? AND registrado_em > ?',
+                (chave, self.relogio() - self.retencao)
+            ).fetchone()
+        return json.loads(linha[0]) if linha else None
+
+    def registra(self, chave, resultado):
+        with self._trava, self._conexao:
+            self._conexao.execute(
+                'INSERT OR REPLACE INTO notificacoes_processadas (chave, resultado, registrado_em) VALUES (?, ?, ?)',
+                (chave, json.dumps(resultado), self.relogio())
+            )
+            self._gravacoes += 1
+            if self._gravacoes % GRAVACOES_ENTRE_LIMPEZAS == 0:
+                self._apaga_expiradas()
+
+    def _apaga_expiradas(self):
+        self._conexao.execute('DELETE FROM notificacoes_processadas WHERE registrado_em <= ?', (self.relogio() - self.retencao,))
+
+    def apaga_expiradas(self):
+        with self._trava, self._conexao:
+            self._apaga_expiradas()
+
+    def limpa(self):
+        with self._trava, self._conexao:
+            self._conexao.execute('DELETE FROM notificacoes_processadas')
+
+    def fecha(self):
+        self._conexao.close()
+
+
+class NotificacoesProcessadas(object):
+    """
+    Lembra o resultado ({'resultado', 'detalhes'}) das notificações já processadas por (loja_id, notificationCode),
+    para que o RegistraNotificacao responda às repetições do PagSeguro sem consultar a transação nem o pedido de novo.
+    Fica em memória com descarte do menos usado; com backend (BackendSQLite), é compartilhado entre processos.
+    """
+    def __init__(self, retencao=RETENCAO, tamanho_maximo=TAMANHO_MAXIMO, backend=None, relogio=time.time):
+        self.memoria = cache.CacheTTL(retencao, tamanho_maximo=tamanho_maximo, relogio=relogio)
+        self.backend = backend
+        self.acertos_backend = 0
+
+    @staticmethod
+    def _chave(loja_id, codigo):
+        return u'{}:{}'.format(loja_id, codigo)
+
+    def consulta(self, loja_id, codigo):
+        chave = self._chave(loja_id, codigo)
+        resultado = self.memoria.consulta(chave)
+        if resultado is None and self.backend is not None:
+            resultado = self.backend.consulta(chave)
+            if resultado is not None:
+                self.acertos_backend += 1
+                self.memoria.define(chave, resultado)
+        return resultado
+
+    def registra(self, loja_id, codigo, resultado):
+        chave = self._chave(loja_id, codigo)
+        self.memoria.define(chave, resultado)
+        if self.backend is not None:
+            self.backend.registra(chave, resultado)
+
+    def limpa(self):
+        self.memoria.limpa()
+        self.acertos_backend = 0
+        if self.backend is not None:
+            self.backend.limpa()
+
+    def estatisticas(self):
+        estatisticas = self.memoria.estatisticas()
+        estatisticas['acertos'] += self.acertos_backend
+        estatisticas['faltas'] -= self.acertos_backend
+        estatisticas['acertos_backend'] = self.acertos_backend
+        return estatisticas
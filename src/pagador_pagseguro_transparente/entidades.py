@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
+from urllib import quote_plus
+
 from pagador import configuracoes, entidades
-from pagador_pagseguro_transparente import cadastro
+from pagador_pagseguro_transparente import cadastro, metricas, textos
 
 CODIGO_GATEWAY = 16
 GATEWAY = 'pstransparente'
@@ -33,7 +35,7 @@ class Malote(entidades.Malote):
         'app_id': 'appId',
         'app_key': 'appKey',
         'payment_mode': 'paymentMode',
-        'payment_method ': 'paymentMethod',
+        'payment_method': 'paymentMethod',
         'currency': 'currency',
         'credit_card_token': 'creditCardToken',
         'installment_quantity': 'installmentQuantity',
@@ -120,26 +122,59 @@ class Malote(entidades.Malote):
         self.extra_amount = None
         self.redirect_url = None
         self.notification_url = None
+        self._itens = []
 
-    def _cria_item(self, indice, item_pedido):
-        indice += 1
-        item_id = 'item_id{}'.format(indice)
-        sku = self.formatador.trata_unicode_com_limite(item_pedido.sku, 100, ascii=True)
-        setattr(self, item_id.format(indice), sku)
-        self._chaves_alternativas_para_serializacao[item_id] = 'itemId{}'.format(indice)
-        item_description = 'item_description{}'.format(indice)
-        descricao = self.formatador.trata_unicode_com_limite(item_pedido.nome, 100, ascii=True)
+    def _cria_item(self, item_pedido):
+        sku = textos.para_ascii(item_pedido.sku, 100)
+        descricao = textos.para_ascii(item_pedido.nome, 100)
         if not descricao:
             descricao = sku
-        setattr(self, item_description, descricao)
-        self._chaves_alternativas_para_serializacao[item_description] = 'itemDescription{}'.format(indice)
-        item_amount = 'item_amount{}'.format(indice)
-        setattr(self, item_amount, self.formatador.formata_decimal(item_pedido.preco_venda))
-        self._chaves_alternativas_para_serializacao[item_amount] = 'itemAmount{}'.format(indice)
-        item_quantity = 'item_quantity{}'.format(indice)
-        setattr(self, item_quantity, self.formatador.formata_decimal(item_pedido.quantidade, como_int=True))
-        self._chaves_alternativas_para_serializacao[item_quantity] = 'itemQuantity{}'.format(indice)
+        self._itens.append((
+            sku,
+            descricao,
+            self.formatador.formata_decimal(item_pedido.preco_venda),
+            self.formatador.formata_decimal(item_pedido.quantidade, como_int=True)
+        ))
+
+    def itens_serializados(self):
+        """
+        Gera os pares (chave, valor) dos itens já com o índice do PagSeguro (itemId1, itemDescription1...)
+        sem registrar nada no estado da classe.
+        """
+        for indice, item in enumerate(self._itens, 1):
+            for chave, valor in zip(CHAVES_ITEM, item):
+                yield chave.format(indice), valor
+
+    def to_dict(self):
+        dados = {}
+        for atributo, chave in ESQUEMA_MALOTE:
+            dados[chave] = getattr(self, atributo)
+        for chave, valor in self.itens_serializados():
+            dados[chave] = valor
+        return dados
+
+    def codifica_formulario(self):
+        """
+        Gera o corpo application/x-www-form-urlencoded em pedaços, direto dos atributos do malote,
+        sem montar o dicionário intermediário. Campos com valor None não são enviados.
+        """
+        separador = ''
+        for atributo, chave in ESQUEMA_MALOTE:
+            valor = getattr(self, atributo)
+            if valor is None:
+                continue
+            yield '{}{}={}'.format(separador, chave, _codifica_valor(valor))
+            separador = '&'
+        for chave, valor in self.itens_serializados():
+            if valor is None:
+                continue
+            yield '{}{}={}'.format(separador, chave, _codifica_valor(valor))
+            separador = '&'
+
+    def to_form_urlencoded(self):
+        return ''.join(self.codifica_formulario())
 
+    @metricas.medido('malote.monta_conteudo')
     def monta_conteudo(self, pedido, parametros_contrato=None, dados=None):
         notification_url = configuracoes.NOTIFICACAO_URL.format(GATEWAY, self.configuracao.loja_id)
         numero_telefone = pedido.cliente_telefone
@@ -155,17 +190,28 @@ class Malote(entidades.Malote):
         self.shipping_type = TipoEnvio(pedido.forma_envio).valor
         self.shipping_cost = self.formatador.formata_decimal(pedido.valor_envio)
         self.extra_amount = self.formatador.formata_decimal((pedido.valor_desconto * -1))
-        self.shipping_address_street = self.formatador.trata_unicode_com_limite(pedido.endereco_entrega['endereco'], 80, ascii=True)
+        self.shipping_address_street = textos.para_ascii(pedido.endereco_entrega['endereco'], 80)
         self.shipping_address_number = pedido.endereco_entrega['numero']
-        self.shipping_address_complement = self.formatador.trata_unicode_com_limite(pedido.endereco_entrega['complemento'], 40, ascii=True)
-        self.shipping_address_district = self.formatador.trata_unicode_com_limite(pedido.endereco_entrega['bairro'], 60, ascii=True)
+        self.shipping_address_complement = textos.para_ascii(pedido.endereco_entrega['complemento'], 40)
+        self.shipping_address_district = textos.para_ascii(pedido.endereco_entrega['bairro'], 60)
         self.shipping_address_postal_code = pedido.endereco_entrega['cep']
-        self.shipping_address_city = self.formatador.trata_unicode_com_limite(pedido.endereco_entrega['cidade'], 60, ascii=True)
+        self.shipping_address_city = textos.para_ascii(pedido.endereco_entrega['cidade'], 60)
         self.shipping_address_state = pedido.endereco_entrega['estado']
         self.shipping_address_country = 'BRA'
 
-        for indice, item in enumerate(pedido.itens):
-            self._cria_item(indice, item)
+        self._itens = []
+        for item in pedido.itens:
+            self._cria_item(item)
+
+
+ESQUEMA_MALOTE = tuple(sorted(Malote._chaves_alternativas_para_serializacao.items()))
+CHAVES_ITEM = ('itemId{}', 'itemDescription{}', 'itemAmount{}', 'itemQuantity{}')
+
+
+def _codifica_valor(valor):
+    if isinstance(valor, unicode):
+        valor = valor.encode('utf-8')
+    return quote_plus(str(valor))
 
 
 class ConfiguracaoMeioPagamento(entidades.ConfiguracaoMeioPagamento):
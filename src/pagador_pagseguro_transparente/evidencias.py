@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+import atexit
+import gzip
+import json
+import logging
+import os
+import Queue
+import re
+import tempfile
+import threading
+import time
+import uuid
+from cStringIO import StringIO
+
+import requests
+
+from li_common.padroes import serializacao
+
+TAMANHO_FILA = 10000
+TAMANHO_LOTE = 200
+INTERVALO_ENVIO = 2
+TIMEOUT_ENVIO = (3, 5)
+PAUSA_APOS_FALHA = 30
+TEMPO_FECHAMENTO = 10
+DIRETORIO_RESERVA = os.path.join(tempfile.gettempdir(), 'pagseguro-transparente-evidencias')
+EXTENSAO_RESERVA = '.json.gz'
+
+_FIM = object()
+_logger = logging.getLogger('pagador_pagseguro_transparente.evidencias')
+_APP_KEY_FORMULARIO = re.compile(r'(^|&)appKey=[^&]*')
+
+
+def url_padrao():
+    return os.environ.get('API_URL', '') + os.environ.get('PAGADOR_EVIDENCIA_URL', '')
+
+
+def cabecalhos_padrao():
+    cabecalhos = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+    if os.environ.get('PAGADOR_EVIDENCIA_USA_AUTENTICACAO_HEADER') == 'True':
+        cabecalhos['Authorization'] = os.environ.get('PAGADOR_EVIDENCIA_AUTENTICACAO', '')
+    return cabecalhos
+
+
+def sem_credenciais(dados):
+    if isinstance(dados, dict):
+        return dict((chave, valor) for chave, valor in dados.items() if chave != 'appKey')
+    if isinstance(dados, basestring):
+        return _APP_KEY_FORMULARIO.sub(r'\1appKey=***', dados)
+    return dados
+
+
+def _para_envio(evidencia):
+    evidencia = dict(evidencia, dados_enviados=sem_credenciais(evidencia.get('dados_enviados')))
+    corpo = evidencia.pop('corpo_recebido', None)
+    if corpo:
+        evidencia['dados_recebidos'] = serializacao.Formatador.xml_para_dict(corpo) or corpo
+    return evidencia
+
+
+def compacta(evidencias):
+    """
+    Corpo do envio de um lote: {"evidencias": [...]} em JSON com gzip, sem a appKey dos dados enviados.
+    Quando a evidência tem o corpo XML recebido do PagSeguro, dados_recebidos é a leitura completa dele (feita aqui,
+    fora da thread do serviço), e não o conteúdo resumido da resposta.
+    """
+    evidencias = [_para_envio(evidencia) for evidencia in evidencias]
+    buffer = StringIO()
+    arquivo = gzip.GzipFile(fileobj=buffer, mode='wb')
+    arquivo.write(json.dumps({'evidencias': evidencias}, default=unicode))
+    arquivo.close()
+    return buffer.getvalue()
+
+
+class GravadorDeEvidencias(object):
+    """
+    Grava as evidências em segundo plano (write-behind): registra() só põe a evidência numa fila limitada, e uma
+    thread junta lotes de até tamanho_lote evidências (ou o que chegar em intervalo segundos), compacta com gzip e
+    envia num único POST.
+    Se o serviço de evidências falhar ou passar do timeout, o lote vai para um arquivo em diretorio_reserva e os
+    envios ficam pausados por pausa_apos_falha segundos; os arquivos são reenviados quando a thread fica ociosa.
+    Com a fila cheia, a evidência é descartada e contada em descartadas: registra() nunca faz I/O nem dispara exceção
+    na thread do serviço. fecha() envia o que estiver na fila antes de terminar.
+    Os arquivos de reserva têm dados do comprador e são criados só para o dono do processo (diretório 0700, arquivos
+    0600).
+    """
+    def __init__(self, url=None, cabecalhos=None, tamanho_fila=TAMANHO_FILA, tamanho_lote=TAMANHO_LOTE, intervalo=INTERVALO_ENVIO,
+                 timeout=TIMEOUT_ENVIO, pausa_apos_falha=PAUSA_APOS_FALHA, diretorio_reserva=DIRETORIO_RESERVA, envia=None, relogio=time.time):
+        self.url = url or url_padrao()
+        self.cabecalhos = cabecalhos or cabecalhos_padrao()
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self.timeout = timeout
+        self.pausa_apos_falha = pausa_apos_falha
+        self.diretorio_reserva = diretorio_reserva
+        self.envia = envia or self._envia_http
+        self.relogio = relogio
+        self.fila = Queue.Queue(tamanho_fila)
+        self._indisponivel_ate = 0
+        self._sessao = None
+        self._thread = None
+        self._trava = threading.Lock()
+        self._contadores = {'registradas': 0, 'enviadas': 0, 'lotes': 0, 'gravadas_em_disco': 0, 'reenviadas': 0, 'falhas_envio': 0, 'descartadas': 0}
+
+    def _conta(self, **quantidades):
+        with self._trava:
+            for nome, quantidade in quantidades.items():
+                self._contadores[nome] += quantidade
+
+    def estatisticas(self):
+        with self._trava:
+            estatisticas = dict(self._contadores)
+        estatisticas['na_fila'] = self.fila.qsize()
+        estatisticas['arquivos_em_disco'] = len(self._arquivos_reserva())
+        return estatisticas
+
+    def inicia(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._executa, name='evidencias-pagseguro')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def registra(self, evidencia):
+        try:
+            self._conta(registradas=1)
+            self.fila.put_nowait(evidencia)
+        except Queue.Full:
+            self._conta(descartadas=1)
+        except Exception:
+            _logger.exception(u'Erro ao registrar evidência do PagSeguro')
+
+    def fecha(self, timeout=TEMPO_FECHAMENTO):
+        """
+        Para a thread depois de enviar o que estiver na fila. O que não couber no timeout vai para o disco.
+        """
+        if self._thread is not None:
+            try:
+                self.fila.put(_FIM, timeout=timeout)
+            except Queue.Full:
+                pass
+            self._thread.join(timeout)
+            self._thread = None
+        restantes = self._esvazia_fila()
+        if restantes:
+            try:
+                self._grava_em_disco(compacta(restantes), len(restantes))
+            except Exception:
+                _logger.exception(u'Erro ao gravar %s evidências do PagSeguro em disco', len(restantes))
+
+    def _esvazia_fila(self):
+        restantes = []
+        while True:
+            try:
+                evidencia = self.fila.get_nowait()
+            except Queue.Empty:
+                return restantes
+            if evidencia is not _FIM:
+                restantes.append(evidencia)
+
+    def _proximo_lote(self):
+        try:
+            evidencia = self.fila.get(timeout=self.intervalo)
+        except Queue.Empty:
+            return [], False
+        if evidencia is _FIM:
+            return [], True
+        lote = [evidencia]
+        limite = time.time() + self.intervalo
+        while len(lote) < self.tamanho_lote:
+            espera = limite - time.time()
+            if espera <= 0:
+                break
+            try:
+                evidencia = self.fila.get(timeout=espera)
+            except Queue.Empty:
+                break
+            if evidencia is _FIM:
+                return lote, True
+            lote.append(evidencia)
+        return lote, False
+
+    def _executa(self):
+        terminar = False
+        while not terminar:
+            lote, terminar = self._proximo_lote()
+            try:
+                if lote:
+                    self.envia_lote(lote)
+                elif not terminar:
+                    self.reenvia_do_disco()
+            except Exception:
+                _logger.exception(u'Erro ao gravar %s evidências do PagSeguro', len(lote))
+
+    def envia_lote(self, lote):
+        corpo = compacta(lote)
+        if self.relogio() < self._indisponivel_ate or not self._envia(corpo):
+            self._grava_em_disco(corpo, len(lote))
+            return False
+        self._conta(enviadas=len(lote), lotes=1)
+        return True
+
+    def _envia(self, corpo):
+        try:
+            sucesso = self.envia(corpo)
+        except requests.RequestException:
+            sucesso = False
+        if not sucesso:
+            self._indisponivel_ate = self.relogio() + self.pausa_apos_falha
+            self._conta(falhas_envio=1)
+        return sucesso
+
+    def _envia_http(self, corpo):
+        if self._sessao is None:
+            self._sessao = requests.Session()
+        resposta = self._sessao.post(self.url, data=corpo, headers=self.cabecalhos, timeout=self.timeout)
+        return resposta.status_code < 300
+
+    def _arquivos_reserva(self):
+        if not os.path.isdir(self.diretorio_reserva):
+            return []
+        return sorted(nome for nome in os.listdir(self.diretorio_reserva) if nome.endswith(EXTENSAO_RESERVA))
+
+    def _grava_em_disco(self, corpo, quantidade):
+        if not os.path.isdir(self.diretorio_reserva):
+            try:
+                os.makedirs(self.diretorio_reserva, 0700)
+            except OSError:
+                if not os.path.isdir(self.diretorio_reserva):
+                    raise
+        nome = '{:017.6f}-{}{}'.format(time.time(), uuid.uuid4().hex, EXTENSAO_RESERVA)
+        temporario = os.path.join(self.diretorio_reserva, nome + '.tmp')
+        with os.fdopen(os.open(temporario, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600), 'wb') as arquivo:
+            arquivo.write(corpo)
+        os.rename(temporario, os.path.join(self.diretorio_reserva, nome))
+        self._conta(gravadas_em_disco=quantidade)
+
+    def reenvia_do_disco(self):
+        """
+        Reenvia os lotes gravados em disco, do mais antigo para o mais novo, até o primeiro que falhar.
+        """
+        if self.relogio() < self._indisponivel_ate:
+            return 0
+        reenviados = 0
+        for nome in self._arquivos_reserva():
+            caminho = os.path.join(self.diretorio_reserva, nome)
+            with open(caminho, 'rb') as arquivo:
+                corpo = arquivo.read()
+            if not self._envia(corpo):
+                break
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+            reenviados += 1
+        self._conta(reenviadas=reenviados)
+        return reenviados
+
+
+GRAVADOR = None
+
+
+def inicia(**parametros):
+    """
+    Liga a gravação de evidências em segundo plano para os serviços deste meio de pagamento. Sem chamar inicia(),
+    registra() não faz nada. Os parâmetros são os do GravadorDeEvidencias.
+    """
+    global GRAVADOR
+    if GRAVADOR is not None:
+        GRAVADOR.fecha()
+    GRAVADOR = GravadorDeEvidencias(**parametros).inicia()
+    return GRAVADOR
+
+
+def para():
+    global GRAVADOR
+    gravador, GRAVADOR = GRAVADOR, None
+    if gravador is not None:
+        gravador.fecha()
+
+
+@atexit.register
+def _fecha_ao_sair():
+    para()
+
+
+def registra(tipo, loja_id, dados_enviados=None, resposta=None, referencia=None):
+    gravador = GRAVADOR
+    if gravador is None:
+        return
+    gravador.registra({
+        'meio_pagamento': 'pstransparente',
+        'tipo': tipo,
+        'loja_id': loja_id,
+        'referencia': referencia,
+        'dados_enviados': dados_enviados,
+        'status_code': getattr(resposta, 'status_code', None),
+        'dados_recebidos': getattr(resposta, 'conteudo', None),
+        'corpo_recebido': getattr(resposta, 'corpo', None),
+        'registrada_em': time.time(),
+    })
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from pagador_pagseguro_transparente import notificacoes, servicos
+
+TEMPO_VISIBILIDADE = 120
+MAXIMO_TENTATIVAS = 8
+ATRASO_NOVA_TENTATIVA = 30
+ATRASO_MAXIMO = 60 * 60
+TRABALHADORES = 4
+TAMANHO_RESERVA = 50
+ESPERA_FILA_VAZIA = 1
+
+_logger = logging.getLogger('pagador_pagseguro_transparente.fila')
+
+Mensagem = namedtuple('Mensagem', 'id loja_id codigo tentativas')
+
+
+class FilaDeNotificacoes(object):
+    """
+    Fila durável de notificações ({loja_id, notificationCode}) num arquivo SQLite em modo WAL, compartilhada entre os
+    processos da máquina: quem recebe a notificação só grava e responde, e os trabalhadores consomem depois.
+    A entrega é pelo menos uma vez: reserva() esconde as mensagens por tempo_visibilidade segundos, e as que não forem
+    confirmadas nesse tempo voltam para a fila. Depois de maximo_tentativas, a mensagem vai para notificacoes_mortas.
+    Com espera_agrupamento, a notificação só fica visível depois desse tempo, para que a rajada de notificações de um
+    pedido caia no mesmo lote e só a situação mais recente seja registrada.
+    """
+    def __init__(self, caminho, tempo_visibilidade=TEMPO_VISIBILIDADE, maximo_tentativas=MAXIMO_TENTATIVAS,
+                 atraso_nova_tentativa=ATRASO_NOVA_TENTATIVA, espera_agrupamento=0, relogio=time.time):
+        self.caminho = caminho
+        self.espera_agrupamento = espera_agrupamento
+        self.tempo_visibilidade = tempo_visibilidade
+        self.maximo_tentativas = maximo_tentativas
+        self.atraso_nova_tentativa = atraso_nova_tentativa
+        self.relogio = relogio
+        self._trava = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conexao.execute('PRAGMA journal_mode=WAL')
+        self._conexao.execute('PRAGMA synchronous=NORMAL')
+        self._conexao.execute(
+            'CREATE TABLE IF NOT EXISTS notificacoes_pendentes '
+            '(id INTEGER PRIMARY KEY AUTOINCREMENT, loja_id INTEGER NOT NULL, codigo TEXT NOT NULL, '
+            'tentativas INTEGER NOT NULL DEFAULT 0, visivel_em REAL NOT NULL, recebida_em REAL NOT NULL, ultimo_erro TEXT, '
+            'UNIQUE (loja_id, codigo))'
+        )
+        self._conexao.execute('CREATE INDEX IF NOT EXISTS notificacoes_pendentes_visivel_em ON notificacoes_pendentes (visivel_em)')
+        self._conexao.execute(
+            'CREATE TABLE IF NOT EXISTS notificacoes_mortas '
+            '(id INTEGER PRIMARY KEY, loja_id INTEGER NOT NULL, codigo TEXT NOT NULL, tentativas INTEGER NOT NULL, '
+            'recebida_em REAL NOT NULL, morta_em REAL NOT NULL, ultimo_erro TEXT)'
+        )
+
+    def _transacao(self, funcao, *args):
+        with self._trava:
+            self._conexao.execute('BEGIN IMMEDIATE')
+            try:
+                resultado = funcao(*args)
+            except Exception:
+                self._conexao.execute('ROLLBACK')
+                raise
+            self._conexao.execute('COMMIT')
+            return resultado
+
+    def enfileira(self, loja_id, codigo):
+        """
+        Retorna False se o código já estava pendente para a loja (reenvio do PagSeguro).
+        """
+        agora = self.relogio()
+        with self._trava:
+            cursor = self._conexao.execute(
+                'INSERT OR IGNORE INTO notificacoes_pendentes (loja_id, codigo, visivel_em, recebida_em) VALUES (?, ?, ?, ?)',
+                (loja_id, codigo, agora + self.espera_agrupamento, agora)
+            )
+        return cursor.rowcount == 1
+
+    def _mata(self, condicao, parametros, agora):
+        self._conexao.execute(
+            'INSERT INTO notificacoes_mortas (id, loja_id, codigo, tentativas, recebida_em, morta_em, ultimo_erro) '
+            'SELECT id, loja_id, codigo, tentativas, recebida_em, ?, ultimo_erro FROM notificacoes_pendentes WHERE ' + condicao,
+            (agora,) + parametros
+        )
+        self._conexao.execute('DELETE FROM notificacoes_pendentes WHERE ' + condicao, parametros)
+
+    def _reserva(self, quantidade):
+        agora = self.relogio()
+        self._mata(u'visivel_em <= ? AND tentativas >= ?', (agora, self.maximo_tentativas), agora)
+        linhas = self._conexao.execute(
+            'SELECT id, loja_id, codigo, tentativas + 1 FROM notificacoes_pendentes WHERE visivel_em <= ? ORDER BY id LIMIT ?',
+            (agora, quantidade)
+        ).fetchall()
+        self._conexao.executemany(
+            'UPDATE notificacoes_pendentes SET tentativas = ?, visivel_em = ? WHERE id = ?',
+            [(tentativas, agora + self.tempo_visibilidade, id_) for id_, _, _, tentativas in linhas]
+        )
+        return [Mensagem(*linha) for linha in linhas]
+
+    def reserva(self, quantidade=1):
+        """
+        Reserva até quantidade mensagens visíveis, das mais antigas para as mais novas. Cada uma deve ser confirmada
+        com confirma() ou devolvida com falha().
+        """
+        return self._transacao(self._reserva, quantidade)
+
+    def confirma(self, mensagem):
+        """
+        Tira a mensagem da fila. Não faz nada se a reserva expirou e outro trabalhador já pegou a mensagem.
+        """
+        with self._trava:
+            self._conexao.execute('DELETE FROM notificacoes_pendentes WHERE id = ? AND tentativas = ?', (mensagem.id, mensagem.tentativas))
+
+    def _falha(self, mensagem, erro):
+        agora = self.relogio()
+        condicao, parametros = u'id = ? AND tentativas = ?', (mensagem.id, mensagem.tentativas)
+        self._conexao.execute('UPDATE notificacoes_pendentes SET ultimo_erro = ? WHERE ' + condicao, (erro,) + parametros)
+        if mensagem.tentativas >= self.maximo_tentativas:
+            self._mata(condicao, parametros, agora)
+            return
+        atraso = min(self.atraso_nova_tentativa * 2 ** (mensagem.tentativas - 1), ATRASO_MAXIMO)
+        self._conexao.execute('UPDATE notificacoes_pendentes SET visivel_em = ? WHERE ' + condicao, (agora + atraso,) + parametros)
+
+    def falha(self, mensagem, erro=None):
+        """
+        Devolve a mensagem para a fila com atraso exponencial, ou manda para notificacoes_mortas se acabaram as tentativas.
+        """
+        self._transacao(self._falha, mensagem, erro)
+
+    def mortas(self, loja_id=None):
+        consulta = 'SELECT id, loja_id, codigo, tentativas, ultimo_erro FROM notificacoes_mortas'
+        parametros = ()
+        if loja_id is not None:
+            consulta, parametros = consulta + ' WHERE loja_id = ?', (loja_id,)
+        with self._trava:
+            linhas = self._conexao.execute(consulta + ' ORDER BY id', parametros).fetchall()
+        return [{'id': id_, 'loja_id': loja, 'codigo': codigo, 'tentativas': tentativas, 'ultimo_erro': erro} for id_, loja, codigo, tentativas, erro in linhas]
+
+    def _reenfileira_mortas(self, ids):
+        agora = self.relogio()
+        marcadores = u', '.join('?' * len(ids))
+        self._conexao.execute(
+            'INSERT OR IGNORE INTO notificacoes_pendentes (loja_id, codigo, visivel_em, recebida_em) '
+            'SELECT loja_id, codigo, 0, ? FROM notificacoes_mortas WHERE id IN (' + marcadores + ')',
+            (agora,) + tuple(ids)
+        )
+        self._conexao.execute('DELETE FROM notificacoes_mortas WHERE id IN (' + marcadores + ')', tuple(ids))
+        return len(ids)
+
+    def reenfileira_mortas(self, ids=None):
+        """
+        Devolve para a fila as mensagens mortas indicadas (ou todas), com as tentativas zeradas.
+        """
+        if ids is None:
+            ids = [morta['id'] for morta in self.mortas()]
+        if not ids:
+            return 0
+        return self._transacao(self._reenfileira_mortas, list(ids))
+
+    def estatisticas(self):
+        agora = self.relogio()
+        with self._trava:
+            pendentes, em_processamento = self._conexao.execute(
+                'SELECT COUNT(*), COALESCE(SUM(tentativas > 0 AND visivel_em > ?), 0) FROM notificacoes_pendentes', (agora,)
+            ).fetchone()
+            mortas = self._conexao.execute('SELECT COUNT(*) FROM notificacoes_mortas').fetchone()[0]
+        return {'pendentes': pendentes, 'em_processamento': em_processamento, 'mortas': mortas}
+
+    def limpa(self):
+        with self._trava:
+            self._conexao.execute('DELETE FROM notificacoes_pendentes')
+            self._conexao.execute('DELETE FROM notificacoes_mortas')
+
+    def fecha(self):
+        self._conexao.close()
+
+
+class _RegistraDaFila(notificacoes.RegistraNotificacoesEmLote):
+    def cria_registrador(self, codigo):
+        registrador = super(_RegistraDaFila, self).cria_registrador(codigo)
+        registrador.usa_fila = False
+        return registrador
+
+
+class TrabalhadoresDaFila(object):
+    """
+    Consome a FilaDeNotificacoes com trabalhadores threads, usando o RegistraNotificacoesEmLote: cada trabalhador
+    reserva até tamanho_reserva mensagens e processa as de cada loja num lote só. Resultado 'OK' confirma a mensagem;
+    'ERRO' ou exceção devolve para a fila. ao_registrar é obrigatório e grava os dados de pagamento (o mesmo do
+    RegistraNotificacoesEmLote): a mensagem só sai da fila depois dele.
+    """
+    def __init__(self, fila, ao_registrar, trabalhadores=TRABALHADORES, tamanho_reserva=TAMANHO_RESERVA,
+                 espera=ESPERA_FILA_VAZIA, concorrencia=notificacoes.CONCORRENCIA):
+        if ao_registrar is None:
+            raise ValueError(u'TrabalhadoresDaFila precisa de ao_registrar para gravar os dados de pagamento.')
+        self.fila = fila
+        self.ao_registrar = ao_registrar
+        self.trabalhadores = trabalhadores
+        self.tamanho_reserva = tamanho_reserva
+        self.espera = espera
+        self.concorrencia = concorrencia
+        self._parar = threading.Event()
+        self._threads = []
+
+    def cria_lote(self, loja_id):
+        return _RegistraDaFila(loja_id, self.ao_registrar, concorrencia=self.concorrencia)
+
+    def _processa_loja(self, loja_id, mensagens):
+        try:
+            resultados = self.cria_lote(loja_id).processa([mensagem.codigo for mensagem in mensagens])
+        except Exception as erro:
+            resultados = dict.fromkeys([mensagem.codigo for mensagem in mensagens], notificacoes._resultado_de_erro(erro))
+        for mensagem in mensagens:
+            resultado = resultados.get(mensagem.codigo) or {'resultado': 'ERRO', 'detalhes': []}
+            if resultado['resultado'] == 'OK':
+                self.fila.confirma(mensagem)
+            else:
+                self.fila.falha(mensagem, u'; '.join(resultado['detalhes']))
+
+    def processa_reservadas(self):
+        """
+        Reserva e processa um lote de mensagens. Retorna quantas foram processadas.
+        """
+        mensagens = self.fila.reserva(self.tamanho_reserva)
+        por_loja = OrderedDict()
+        for mensagem in mensagens:
+            por_loja.setdefault(mensagem.loja_id, []).append(mensagem)
+        for loja_id, mensagens_da_loja in por_loja.items():
+            self._processa_loja(loja_id, mensagens_da_loja)
+        return len(mensagens)
+
+    def processa_pendentes(self):
+        """
+        Processa a fila na thread de quem chama até não haver mais mensagens visíveis.
+        """
+        total = 0
+        while True:
+            processadas = self.processa_reservadas()
+            if not processadas:
+                return total
+            total += processadas
+
+    def _executa(self):
+        while not self._parar.is_set():
+            try:
+                processadas = self.processa_reservadas()
+            except Exception:
+                _logger.exception(u'Erro ao consumir a fila de notificações do PagSeguro')
+                processadas = 0
+            if not processadas:
+                self._parar.wait(self.espera)
+
+    def inicia(self):
+        if not self._threads:
+            self._parar.clear()
+            for indice in range(self.trabalhadores):
+                thread = threading.Thread(target=self._executa, name='fila-notificacoes-{}'.format(indice))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def para(self, timeout=None):
+        self._parar.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+
+def liga_recebimento(fila):
+    """
+    Faz o RegistraNotificacao só enfileirar a notificação e responder na hora. Os TrabalhadoresDaFila, em qualquer
+    processo que abra o mesmo arquivo, fazem a consulta ao PagSeguro e o registro; sem eles consumindo a fila, nenhuma
+    notificação é gravada.
+    """
+    servicos.FILA_NOTIFICACOES = fila
+    return fila
+
+
+def desliga_recebimento():
+    servicos.FILA_NOTIFICACOES = None
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import logging
+import socket
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+LIMITES_HISTOGRAMA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+NOME_PROMETHEUS = 'pagseguro_fase_duracao_segundos'
+
+_sinks = []
+_trava = threading.Lock()
+
+
+def adiciona_sink(sink):
+    """
+    Liga a medição das fases: cada duração medida passa a ser enviada para sink.registra(nome, duracao).
+    Sem nenhum sink, as medições não fazem nada.
+    """
+    global _sinks
+    with _trava:
+        _sinks = _sinks + [sink]
+
+
+def remove_sink(sink):
+    global _sinks
+    with _trava:
+        _sinks = [atual for atual in _sinks if atual is not sink]
+
+
+def limpa_sinks():
+    global _sinks
+    with _trava:
+        _sinks = []
+
+
+def ativa():
+    return bool(_sinks)
+
+
+def registra(nome, duracao):
+    for sink in _sinks:
+        sink.registra(nome, duracao)
+
+
+class _Fase(object):
+    __slots__ = ('nome', 'inicio')
+
+    def __init__(self, nome):
+        self.nome = nome
+
+    def __enter__(self):
+        self.inicio = time.time()
+        return self
+
+    def __exit__(self, *excecao):
+        registra(self.nome, time.time() - self.inicio)
+
+
+class _FaseDesligada(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excecao):
+        pass
+
+
+_DESLIGADA = _FaseDesligada()
+
+
+def fase(nome):
+    """
+    Context manager que mede o bloco com o nome passado, inclusive quando ele dispara exceção.
+    """
+    return _Fase(nome) if _sinks else _DESLIGADA
+
+
+def medido(nome):
+    """
+    Decorator que mede cada chamada do método como uma fase.
+    """
+    def decorator(funcao):
+        @wraps(funcao)
+        def funcao_medida(*args, **kwargs):
+            if not _sinks:
+                return funcao(*args, **kwargs)
+            inicio = time.time()
+            try:
+                return funcao(*args, **kwargs)
+            finally:
+                registra(nome, time.time() - inicio)
+        return funcao_medida
+    return decorator
+
+
+class SinkDeLog(object):
+    def __init__(self, logger=None, nivel=logging.INFO):
+        self.logger = logger or logging.getLogger('pagador_pagseguro_transparente.metricas')
+        self.nivel = nivel
+
+    def registra(self, nome, duracao):
+        self.logger.log(self.nivel, 'fase=%s duracao_ms=%.2f', nome, duracao * 1000)
+
+
+class Histogramas(object):
+    """
+    Histogramas em memória por fase, com os limites (em segundos) de LIMITES_HISTOGRAMA.
+    """
+    def __init__(self, limites=LIMITES_HISTOGRAMA):
+        self.limites = tuple(limites)
+        self._fases = {}
+        self._trava = threading.Lock()
+
+    def registra(self, nome, duracao):
+        with self._trava:
+            if nome not in self._fases:
+                self._fases[nome] = {'contagem': 0, 'total': 0.0, 'baldes': [0] * (len(self.limites) + 1)}
+            histograma = self._fases[nome]
+            histograma['contagem'] += 1
+            histograma['total'] += duracao
+            histograma['baldes'][bisect_left(self.limites, duracao)] += 1
+
+    def resumo(self):
+        with self._trava:
+            return dict((nome, {'contagem': histograma['contagem'], 'total': histograma['total'], 'baldes': list(histograma['baldes'])})
+                        for nome, histograma in self._fases.items())
+
+    def limpa(self):
+        with self._trava:
+            self._fases.clear()
+
+    def exporta_prometheus(self, nome_metrica=NOME_PROMETHEUS):
+        """
+        Retorna os histogramas no formato texto de exposição do Prometheus.
+        """
+        linhas = ['# TYPE {} histogram'.format(nome_metrica)]
+        for nome, histograma in sorted(self.resumo().items()):
+            acumulado = 0
+            for limite, quantidade in zip(self.limites + ('+Inf',), histograma['baldes']):
+                acumulado += quantidade
+                linhas.append('{}_bucket{{fase="{}",le="{}"}} {}'.format(nome_metrica, nome, limite, acumulado))
+            linhas.append('{}_sum{{fase="{}"}} {}'.format(nome_metrica, nome, repr(histograma['total'])))
+            linhas.append('{}_count{{fase="{}"}} {}'.format(nome_metrica, nome, histograma['contagem']))
+        return '\n'.join(linhas) + '\n'
+
+
+class SinkStatsd(object):
+    """
+    Envia cada duração como um timer do statsd (nome:ms|ms) por UDP, sem esperar resposta.
+    """
+    def __init__(self, host='localhost', porta=8125, prefixo='pagseguro'):
+        self.endereco = (host, porta)
+        self.prefixo = prefixo
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def registra(self, nome, duracao):
+        try:
+            self._socket.sendto('{}.{}:{:.3f}|ms'.format(self.prefixo, nome, duracao * 1000), self.endereco)
+        except socket.error:
+            pass
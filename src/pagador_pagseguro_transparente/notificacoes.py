@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+from pagador_pagseguro_transparente import servicos
+
+CONCORRENCIA = 10
+TAMANHO_BLOCO = 500
+
+
+def _pedido_numero_da_resposta(registrador):
+    resposta = registrador.resposta
+    if resposta is None or not resposta.sucesso:
+        return None
+    try:
+        return int(resposta.conteudo['transaction']['reference'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _ordem_da_resposta(registrador):
+    resposta = registrador.resposta
+    if resposta is None or not resposta.sucesso:
+        return -1
+    try:
+        return servicos.SituacoesDePagamento.ordem(resposta.conteudo['transaction']['status'])
+    except (KeyError, TypeError):
+        return -1
+
+
+def _resultado_de_erro(erro):
+    try:
+        mensagem = unicode(erro)
+    except UnicodeDecodeError:
+        mensagem = str(erro).decode('utf-8', 'replace')
+    return {'resultado': 'ERRO', 'detalhes': [u'{}: {}'.format(erro.__class__.__name__, mensagem)]}
+
+
+class RegistraNotificacoesEmLote(object):
+    """
+    Processa um lote de notificationCode de uma loja usando o RegistraNotificacao.
+    As consultas ao PagSeguro são feitas em paralelo, limitadas por concorrencia, e cada pedido do bloco é
+    carregado do banco uma vez só, compartilhado entre as notificações que apontam para ele.
+    O resultado de cada código segue o formato {'resultado', 'detalhes'} do RegistraNotificacao. ao_registrar é
+    obrigatório e grava os dados de pagamento: recebe cada registrador depois de montar os dados, e a notificação só é
+    marcada como processada (RegistraNotificacao.confirma_registro) depois que ele terminar sem erro. Sem ele, cada
+    código retorna 'ERRO'.
+    """
+    def __init__(self, loja_id, ao_registrar, concorrencia=CONCORRENCIA, tamanho_bloco=TAMANHO_BLOCO):
+        self.loja_id = loja_id
+        self.concorrencia = concorrencia
+        self.tamanho_bloco = tamanho_bloco
+        self.ao_registrar = ao_registrar
+
+    def cria_registrador(self, codigo):
+        return servicos.RegistraNotificacao(self.loja_id, dados={'notificationCode': codigo})
+
+    def _consulta(self, registrador):
+        try:
+            registrador.define_credenciais()
+            registrador.obtem_informacoes_pagamento()
+        except Exception as erro:
+            return _resultado_de_erro(erro)
+        return None
+
+    def _carrega_pedidos_pagamento(self, registradores):
+        pedidos_pagamento = {}
+        for registrador in registradores:
+            pedido_numero = _pedido_numero_da_resposta(registrador)
+            if pedido_numero is None or pedido_numero in pedidos_pagamento:
+                continue
+            try:
+                pedidos_pagamento[pedido_numero] = registrador.cria_pedido_pagamento(pedido_numero)
+            except Exception:
+                continue
+        return pedidos_pagamento
+
+    def _registra(self, registrador, pedidos_pagamento):
+        if self.ao_registrar is None:
+            return {'resultado': 'ERRO', 'detalhes': [u'Nenhum ao_registrar para gravar os dados de pagamento']}
+        registrador.pedidos_pagamento = pedidos_pagamento
+        try:
+            registrador.monta_dados_pagamento()
+            self.ao_registrar(registrador)
+            registrador.confirma_registro()
+        except Exception as erro:
+            return _resultado_de_erro(erro)
+        return registrador.resultado
+
+    def _mais_adiantados(self, consultados):
+        """
+        Tira os registradores cuja situação é superada por outro do mesmo pedido no bloco, que não precisam do pedido.
+        """
+        ordens = {}
+        for registrador in consultados:
+            pedido_numero = _pedido_numero_da_resposta(registrador)
+            ordens[pedido_numero] = max(ordens.get(pedido_numero, -1), _ordem_da_resposta(registrador))
+        return [
+            registrador for registrador in consultados
+            if _ordem_da_resposta(registrador) >= ordens[_pedido_numero_da_resposta(registrador)]
+        ]
+
+    def _processa_bloco(self, codigos, pool):
+        registradores = [self.cria_registrador(codigo) for codigo in codigos]
+        erros = pool.map(self._consulta, registradores)
+        consultados = [registrador for registrador, erro in zip(registradores, erros) if erro is None]
+        pedidos_pagamento = self._carrega_pedidos_pagamento(self._mais_adiantados(consultados))
+        # A situação mais adiantada de cada pedido é registrada primeiro, e as notificações superadas por ela no
+        # mesmo bloco são descartadas pelo RegistraNotificacao (servicos.SITUACOES_DOS_PEDIDOS).
+        indices = sorted(range(len(codigos)), key=lambda indice: -_ordem_da_resposta(registradores[indice]) if erros[indice] is None else 0)
+        por_indice = {}
+        for indice in indices:
+            por_indice[indice] = erros[indice] or self._registra(registradores[indice], pedidos_pagamento)
+        return OrderedDict((codigo, por_indice[indice]) for indice, codigo in enumerate(codigos))
+
+    def processa(self, codigos):
+        """
+        Retorna um OrderedDict com o resultado de cada código, na ordem recebida. Códigos repetidos são processados uma vez.
+        """
+        codigos = list(OrderedDict.fromkeys(codigos))
+        resultados = OrderedDict()
+        pool = ThreadPool(self.concorrencia)
+        try:
+            for inicio in range(0, len(codigos), self.tamanho_bloco):
+                resultados.update(self._processa_bloco(codigos[inicio:inicio + self.tamanho_bloco], pool))
+        finally:
+            pool.close()
+            pool.join()
+        return resultados
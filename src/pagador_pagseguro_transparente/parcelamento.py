@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal, ROUND_HALF_UP, localcontext
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAXIMO_PARCELAS = 18
+TAXA_JUROS = Decimal('0.0199')
+PARCELA_MINIMA = Decimal('5.00')
+CASAS_COEFICIENTE = 10
+ESCALA_COEFICIENTE = 10 ** CASAS_COEFICIENTE
+CENTAVO = Decimal('0.01')
+
+
+def _inteiro(valor, padrao):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return padrao
+
+
+def _centavos(valor):
+    if isinstance(valor, (int, long)):
+        return valor * 100
+    if isinstance(valor, basestring):
+        reais, _, centavos = valor.strip().partition('.')
+        if reais.lstrip('-').isdigit() and len(centavos) <= 2 and (not centavos or centavos.isdigit()):
+            sinal = -1 if reais.startswith('-') else 1
+            return sinal * (abs(int(reais)) * 100 + int(centavos.ljust(2, '0')))
+    elif isinstance(valor, Decimal) and valor.is_finite() and valor.as_tuple().exponent >= -2:
+        return int(valor.scaleb(2))
+    return int((Decimal(str(valor)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def _reais(centavos):
+    return (Decimal(centavos) / 100).quantize(CENTAVO)
+
+
+def coeficiente(parcelas, taxa_juros=TAXA_JUROS):
+    """
+    Coeficiente da tabela Price para a quantidade de parcelas, em inteiro com CASAS_COEFICIENTE casas decimais.
+    """
+    with localcontext() as contexto:
+        contexto.prec = 28
+        fator = (1 + taxa_juros) ** parcelas
+        valor = taxa_juros * fator / (fator - 1)
+        return int((valor * ESCALA_COEFICIENTE).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+class Parcela(object):
+    __slots__ = ('quantidade', 'valor', 'total', 'sem_juros')
+
+    def __init__(self, quantidade, valor, total, sem_juros):
+        self.quantidade = quantidade
+        self.valor = valor
+        self.total = total
+        self.sem_juros = sem_juros
+
+    def __repr__(self):
+        return 'Parcela(quantidade={!r}, valor={!r}, sem_juros={!r})'.format(self.quantidade, self.valor, self.sem_juros)
+
+    def to_dict(self):
+        return {'quantidade': self.quantidade, 'valor': self.valor, 'total': self.total, 'sem_juros': self.sem_juros}
+
+
+class TabelaDeParcelas(object):
+    """
+    Parcelamento de uma lista de preços: valores[i][n - 1] é o valor em centavos de n parcelas do preço i e
+    validas[i][n - 1] diz se essa quantidade de parcelas pode ser oferecida. Com NumPy, são matrizes.
+    """
+    def __init__(self, precos, valores, validas, parcelas_sem_juros):
+        self.precos = precos
+        self.valores = valores
+        self.validas = validas
+        self.parcelas_sem_juros = parcelas_sem_juros
+
+    def __len__(self):
+        return len(self.precos)
+
+    def parcelas(self, indice):
+        preco = int(self.precos[indice])
+        parcelas = []
+        for coluna, (valor, valida) in enumerate(zip(self.valores[indice], self.validas[indice])):
+            if not valida:
+                continue
+            quantidade = coluna + 1
+            sem_juros = quantidade <= self.parcelas_sem_juros
+            total = preco if sem_juros else int(valor) * quantidade
+            parcelas.append(Parcela(quantidade, _reais(int(valor)), _reais(total), sem_juros))
+        return parcelas
+
+    def maior_parcelamento(self, indice):
+        parcelas = self.parcelas(indice)
+        return parcelas[-1] if parcelas else None
+
+    def maior_sem_juros(self, indice):
+        parcelas = [parcela for parcela in self.parcelas(indice) if parcela.sem_juros]
+        return parcelas[-1] if parcelas else None
+
+
+class Parcelamento(object):
+    """
+    Calcula o parcelamento de vários preços de uma vez, seguindo a configuração da loja: até maximo_parcelas
+    parcelas, as primeiras parcelas_sem_juros sem juros e as demais com a taxa mensal do PagSeguro (tabela Price),
+    e só as quantidades cuja parcela não fica abaixo do valor mínimo (uma parcela é sempre válida).
+    As contas são feitas em centavos inteiros com arredondamento para o centavo mais próximo (meio centavo para
+    cima), então o resultado é o mesmo com ou sem NumPy. Preços altos demais para as contas em int64 (acima de
+    maximo_centavos_numpy) são calculados sem NumPy.
+    """
+    def __init__(self, maximo_parcelas=MAXIMO_PARCELAS, parcelas_sem_juros=1, valor_minimo_parcela=None, taxa_juros=TAXA_JUROS):
+        self.maximo_parcelas = min(max(_inteiro(maximo_parcelas, MAXIMO_PARCELAS), 1), MAXIMO_PARCELAS)
+        self.parcelas_sem_juros = min(max(_inteiro(parcelas_sem_juros, 1), 1), self.maximo_parcelas)
+        self.valor_minimo_parcela = max(Decimal(str(valor_minimo_parcela or 0)), PARCELA_MINIMA)
+        self.taxa_juros = taxa_juros
+        self.minimo_centavos = _centavos(self.valor_minimo_parcela)
+        self.coeficientes = [0] * self.parcelas_sem_juros + [
+            coeficiente(quantidade, taxa_juros) for quantidade in range(self.parcelas_sem_juros + 1, self.maximo_parcelas + 1)
+        ]
+
+    @classmethod
+    def da_configuracao(cls, configuracao, taxa_juros=TAXA_JUROS):
+        return cls(
+            maximo_parcelas=getattr(configuracao, 'maximo_parcelas', None),
+            parcelas_sem_juros=getattr(configuracao, 'parcelas_sem_juros', None),
+            valor_minimo_parcela=getattr(configuracao, 'valor_minimo_parcela', None),
+            taxa_juros=taxa_juros
+        )
+
+    def tabela(self, precos):
+        if np is not None:
+            return self._tabela_numpy(precos)
+        return self._tabela_python(precos)
+
+    def parcelas(self, preco):
+        return self.tabela([preco]).parcelas(0)
+
+    def _tabela_python(self, precos):
+        precos = [_centavos(preco) for preco in precos]
+        metade = ESCALA_COEFICIENTE // 2
+        valores = []
+        validas = []
+        for preco in precos:
+            linha = [(2 * preco + quantidade) // (2 * quantidade) for quantidade in range(1, self.parcelas_sem_juros + 1)]
+            linha.extend((preco * fator + metade) // ESCALA_COEFICIENTE for fator in self.coeficientes[self.parcelas_sem_juros:])
+            valores.append(linha)
+            validas.append([coluna == 0 or valor >= self.minimo_centavos for coluna, valor in enumerate(linha)])
+        return TabelaDeParcelas(precos, valores, validas, self.parcelas_sem_juros)
+
+    @property
+    def maximo_centavos_numpy(self):
+        return (np.iinfo(np.int64).max - ESCALA_COEFICIENTE // 2) // max(max(self.coeficientes), 1)
+
+    def _tabela_numpy(self, precos):
+        if isinstance(precos, np.ndarray):
+            precos = precos.tolist()
+        centavos = [_centavos(preco) for preco in precos]
+        if centavos and max(abs(valor) for valor in centavos) > self.maximo_centavos_numpy:
+            return self._tabela_python(precos)
+        centavos = np.array(centavos, dtype=np.int64)
+        quantidades = np.arange(1, self.maximo_parcelas + 1, dtype=np.int64)
+        coluna_preco = centavos[:, np.newaxis]
+        sem_juros = (2 * coluna_preco + quantidades) // (2 * quantidades)
+        com_juros = (coluna_preco * np.array(self.coeficientes, dtype=np.int64) + ESCALA_COEFICIENTE // 2) // ESCALA_COEFICIENTE
+        valores = np.where(quantidades <= self.parcelas_sem_juros, sem_juros, com_juros)
+        validas = (valores >= self.minimo_centavos) | (quantidades == 1)
+        return TabelaDeParcelas(centavos, valores, validas, self.parcelas_sem_juros)
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+import random
+import threading
+import time
+from collections import deque
+from urlparse import urlparse
+
+from requests.exceptions import ConnectionError, ConnectTimeout, Timeout
+from requests.packages.urllib3.exceptions import NewConnectionError
+
+JANELA = 50
+MINIMO_CHAMADAS = 10
+TAXA_ERROS = 0.5
+LATENCIA_LENTA = 10
+TAXA_LENTAS = 0.8
+TEMPO_ABERTO = 30
+CHAMADAS_TESTE = 1
+
+TENTATIVAS = 3
+ESPERA_INICIAL = 0.5
+MULTIPLICADOR_ESPERA = 2
+ESPERA_MAXIMA = 4
+ORCAMENTO = 20
+STATUS_REPETIVEIS = (408, 500, 502, 503, 504)
+
+
+class CircuitoAberto(Exception):
+    """
+    Disparada quando o disjuntor do host está aberto e a chamada nem é feita.
+    """
+    def __init__(self, host):
+        super(CircuitoAberto, self).__init__(u'O disjuntor do host {} está aberto.'.format(host))
+        self.host = host
+        self.resposta = RespostaIndisponivel()
+
+
+class RespostaIndisponivel(object):
+    """
+    Resposta usada no lugar da do PagSeguro quando o disjuntor está aberto. É tratada como erro do servidor.
+    """
+    sucesso = False
+    requisicao_invalida = False
+    nao_autorizado = False
+    nao_autenticado = False
+    nao_encontrado = False
+    timeout = False
+    erro_servidor = True
+    status_code = 503
+
+    def __init__(self):
+        self.conteudo = {}
+
+
+class Disjuntor(object):
+    """
+    Disjuntor de um host: abre quando, nas últimas chamadas, a taxa de erros ou de chamadas lentas passa do limite.
+    Aberto, recusa as chamadas por tempo_aberto segundos; depois fica meio aberto e deixa passar chamadas_teste
+    chamadas. Se a chamada de teste der certo, fecha; se falhar, abre de novo.
+    """
+    FECHADO = 'fechado'
+    ABERTO = 'aberto'
+    MEIO_ABERTO = 'meio_aberto'
+
+    def __init__(self, janela=JANELA, minimo_chamadas=MINIMO_CHAMADAS, taxa_erros=TAXA_ERROS, latencia_lenta=LATENCIA_LENTA,
+                 taxa_lentas=TAXA_LENTAS, tempo_aberto=TEMPO_ABERTO, chamadas_teste=CHAMADAS_TESTE, relogio=time.time):
+        self.minimo_chamadas = minimo_chamadas
+        self.taxa_erros = taxa_erros
+        self.latencia_lenta = latencia_lenta
+        self.taxa_lentas = taxa_lentas
+        self.tempo_aberto = tempo_aberto
+        self.chamadas_teste = chamadas_teste
+        self.relogio = relogio
+        self._estado = self.FECHADO
+        self._chamadas = deque(maxlen=janela)
+        self._aberto_ate = 0
+        self._testes_em_andamento = 0
+        self._contadores = {'chamadas': 0, 'erros': 0, 'lentas': 0, 'recusadas': 0, 'aberturas': 0}
+        self._trava = threading.Lock()
+
+    @property
+    def estado(self):
+        with self._trava:
+            self._atualiza_estado()
+            return self._estado
+
+    def _atualiza_estado(self):
+        if self._estado == self.ABERTO and self.relogio() >= self._aberto_ate:
+            self._estado = self.MEIO_ABERTO
+            self._testes_em_andamento = 0
+
+    def _abre(self):
+        self._estado = self.ABERTO
+        self._aberto_ate = self.relogio() + self.tempo_aberto
+        self._chamadas.clear()
+        self._contadores['aberturas'] += 1
+
+    def permite(self):
+        with self._trava:
+            self._atualiza_estado()
+            if self._estado == self.FECHADO:
+                return True
+            if self._estado == self.MEIO_ABERTO and self._testes_em_andamento < self.chamadas_teste:
+                self._testes_em_andamento += 1
+                return True
+            self._contadores['recusadas'] += 1
+            return False
+
+    def registra(self, sucesso, duracao):
+        lenta = duracao >= self.latencia_lenta
+        with self._trava:
+            self._contadores['chamadas'] += 1
+            self._contadores['erros'] += 0 if sucesso else 1
+            self._contadores['lentas'] += 1 if lenta else 0
+            if self._estado == self.MEIO_ABERTO:
+                self._testes_em_andamento = max(self._testes_em_andamento - 1, 0)
+                if sucesso and not lenta:
+                    self._estado = self.FECHADO
+                else:
+                    self._abre()
+                return
+            if self._estado == self.ABERTO:
+                return
+            self._chamadas.append((sucesso, lenta))
+            total = len(self._chamadas)
+            if total < self.minimo_chamadas:
+                return
+            erros = sum(1 for chamada_sucesso, _ in self._chamadas if not chamada_sucesso)
+            lentas = sum(1 for _, chamada_lenta in self._chamadas if chamada_lenta)
+            if float(erros) / total >= self.taxa_erros or float(lentas) / total >= self.taxa_lentas:
+                self._abre()
+
+    def estatisticas(self):
+        with self._trava:
+            self._atualiza_estado()
+            estatisticas = dict(self._contadores)
+            estatisticas['estado'] = self._estado
+        return estatisticas
+
+
+class Disjuntores(object):
+    """
+    Um Disjuntor por host, criado na primeira chamada. Os parâmetros são repassados para cada Disjuntor.
+    """
+    def __init__(self, **parametros):
+        self.parametros = parametros
+        self._disjuntores = {}
+        self._trava = threading.Lock()
+
+    def do_host(self, url):
+        host = urlparse(url).netloc
+        with self._trava:
+            if host not in self._disjuntores:
+                self._disjuntores[host] = Disjuntor(**self.parametros)
+            return self._disjuntores[host]
+
+    def limpa(self):
+        with self._trava:
+            self._disjuntores.clear()
+
+    def estatisticas(self):
+        with self._trava:
+            disjuntores = dict(self._disjuntores)
+        return dict((host, disjuntor.estatisticas()) for host, disjuntor in disjuntores.items())
+
+
+def erro_antes_do_envio(erro):
+    """
+    Diz se a exceção aconteceu antes de a requisição ser enviada (timeout ou recusa ao abrir a conexão), quando o
+    servidor com certeza não a recebeu. Conexão abortada ou reiniciada depois do envio não conta.
+    """
+    if isinstance(erro, ConnectTimeout):
+        return True
+    motivo = getattr(erro.args[0], 'reason', None) if isinstance(erro, ConnectionError) and erro.args else None
+    return isinstance(motivo, NewConnectionError)
+
+
+class PoliticaDeTentativas(object):
+    """
+    Refaz uma chamada HTTP que falhou por um erro passageiro: as exceções em excecoes ou uma resposta com status em
+    status_repetiveis. Entre as tentativas espera um tempo exponencial com jitter (entre zero e a espera da vez),
+    e não começa uma nova tentativa se ela passar do orçamento total em segundos. Erros de validação (4xx) nunca são
+    repetidos. Com so_antes_do_envio, as exceções só são repetidas se erro_antes_do_envio, para chamadas que não podem
+    ser feitas duas vezes.
+    """
+    def __init__(self, tentativas=TENTATIVAS, espera_inicial=ESPERA_INICIAL, multiplicador=MULTIPLICADOR_ESPERA,
+                 espera_maxima=ESPERA_MAXIMA, orcamento=ORCAMENTO, status_repetiveis=STATUS_REPETIVEIS,
+                 excecoes=(ConnectionError, Timeout), so_antes_do_envio=False, relogio=time.time, dorme=time.sleep,
+                 aleatorio=random.random):
+        self.tentativas = tentativas
+        self.espera_inicial = espera_inicial
+        self.multiplicador = multiplicador
+        self.espera_maxima = espera_maxima
+        self.orcamento = orcamento
+        self.status_repetiveis = frozenset(status_repetiveis)
+        self.excecoes = excecoes
+        self.so_antes_do_envio = so_antes_do_envio
+        self.relogio = relogio
+        self.dorme = dorme
+        self.aleatorio = aleatorio
+
+    def espera(self, tentativa):
+        limite = min(self.espera_maxima, self.espera_inicial * self.multiplicador ** (tentativa - 1))
+        return limite * self.aleatorio()
+
+    def deve_repetir(self, resposta):
+        return resposta.status_code in self.status_repetiveis
+
+    def deve_repetir_erro(self, erro):
+        return not self.so_antes_do_envio or erro_antes_do_envio(erro)
+
+    def executa(self, chamada, primeira_tentativa=1, registro=None):
+        """
+        Chama chamada() até conseguir uma resposta que não precise ser repetida, começando a contar de
+        primeira_tentativa. Cada tentativa é anotada em registro, se passado, como
+        {'tentativa', 'duracao', 'status_code' ou 'erro'}. Retorna a última resposta ou dispara a última exceção.
+        """
+        inicio = self.relogio()
+        tentativa = primeira_tentativa
+        while True:
+            comeco = self.relogio()
+            try:
+                resposta = chamada()
+            except self.excecoes as erro:
+                if registro is not None:
+                    registro.append({'tentativa': tentativa, 'duracao': self.relogio() - comeco, 'erro': erro.__class__.__name__})
+                espera = self.espera(tentativa)
+                if not self.deve_repetir_erro(erro) or not self._pode_repetir(tentativa, inicio, espera):
+                    raise
+            else:
+                if registro is not None:
+                    registro.append({'tentativa': tentativa, 'duracao': self.relogio() - comeco, 'status_code': resposta.status_code})
+                if not self.deve_repetir(resposta):
+                    return resposta
+                espera = self.espera(tentativa)
+                if not self._pode_repetir(tentativa, inicio, espera):
+                    return resposta
+            self.dorme(espera)
+            tentativa += 1
+
+    def _pode_repetir(self, tentativa, inicio, espera):
+        return tentativa < self.tentativas and self.relogio() - inicio + espera <= self.orcamento
+
+
+DISJUNTORES = Disjuntores()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+from cStringIO import StringIO
+from xml.etree.cElementTree import ParseError, iterparse
+
+from li_common.padroes import serializacao
+
+
+class Transacao(object):
+    """
+    Registro compacto com os campos da transação do PagSeguro usados pelos serviços.
+    """
+    __slots__ = ('codigo', 'referencia', 'situacao', 'valor', 'data')
+    _chaves_no_xml = (('codigo', 'code'), ('referencia', 'reference'), ('situacao', 'status'), ('valor', 'grossAmount'), ('data', 'date'))
+
+    def __init__(self, codigo=None, referencia=None, situacao=None, valor=None, data=None):
+        self.codigo = codigo
+        self.referencia = referencia
+        self.situacao = situacao
+        self.valor = valor
+        self.data = data
+
+    def __repr__(self):
+        return 'Transacao(codigo={!r}, referencia={!r}, situacao={!r})'.format(self.codigo, self.referencia, self.situacao)
+
+    @classmethod
+    def do_xml(cls, transacao):
+        return cls(*[transacao.get(chave) for _, chave in cls._chaves_no_xml])
+
+    def to_dict(self):
+        return dict((chave, getattr(self, atributo)) for atributo, chave in self._chaves_no_xml if getattr(self, atributo) is not None)
+
+
+class PaginaDeBusca(object):
+    """
+    Uma página do transactionSearchResult, com as transações como registros Transacao.
+    """
+    __slots__ = ('pagina', 'total_paginas', 'resultados', 'transacoes')
+
+    def __init__(self, pagina=1, total_paginas=1, resultados=0, transacoes=()):
+        self.pagina = pagina
+        self.total_paginas = total_paginas
+        self.resultados = resultados
+        self.transacoes = transacoes
+
+    @classmethod
+    def do_xml(cls, resultado):
+        resultado = resultado or {}
+        transacoes = resultado.get('transactions') or []
+        if type(transacoes) is dict:
+            transacoes = [transacoes]
+        transacoes = [Transacao.do_xml(transacao['transaction']) for transacao in transacoes]
+        return cls(
+            pagina=int(resultado.get('currentPage') or 1),
+            total_paginas=int(resultado.get('totalPages') or 1),
+            resultados=int(resultado.get('resultsInThisPage') or len(transacoes)),
+            transacoes=transacoes
+        )
+
+
+CAMPOS_TRANSACAO = frozenset(chave for _, chave in Transacao._chaves_no_xml)
+CAMPOS_BUSCA = frozenset(['date', 'currentPage', 'resultsInThisPage', 'totalPages'])
+CAMPOS_CHECKOUT = frozenset(['code', 'date'])
+CAMPOS_ERRO = frozenset(['code', 'message'])
+CAMPOS_PARCELA = frozenset(['cardBrand', 'quantity', 'amount', 'totalAmount', 'interestFree'])
+
+# raiz do documento: (campos da raiz, (recipiente da lista, tag do item, campos do item))
+DOCUMENTOS = {
+    'transaction': (CAMPOS_TRANSACAO, None),
+    'transactionSearchResult': (CAMPOS_BUSCA, ('transactions', 'transaction', CAMPOS_TRANSACAO)),
+    'checkout': (CAMPOS_CHECKOUT, None),
+    'errors': (frozenset(), (None, 'error', CAMPOS_ERRO)),
+    'installments': (frozenset(), (None, 'installment', CAMPOS_PARCELA)),
+}
+
+
+def _agrupa(itens):
+    if not itens:
+        return None
+    return itens[0] if len(itens) == 1 else itens
+
+
+def _le_documento(eventos, raiz, campos, lista):
+    recipiente, tag_item, campos_item = lista or (None, None, frozenset())
+    profundidade_item = 2 if recipiente else 1
+    registro = {}
+    itens = []
+    item = None
+    tem_recipiente = False
+    abertos = [raiz]
+    for evento, elemento in eventos:
+        if evento == 'start':
+            abertos.append(elemento)
+            profundidade = len(abertos) - 1
+            if profundidade == 1 and elemento.tag == recipiente:
+                tem_recipiente = True
+            if profundidade == profundidade_item and elemento.tag == tag_item and (tem_recipiente or not recipiente):
+                item = {}
+            continue
+        abertos.pop()
+        profundidade = len(abertos)
+        if profundidade == 1 and elemento.tag in campos:
+            registro[elemento.tag] = elemento.text
+        elif item is not None:
+            if profundidade == profundidade_item + 1 and elemento.tag in campos_item:
+                item[elemento.tag] = elemento.text
+            elif profundidade == profundidade_item and elemento.tag == tag_item:
+                itens.append({tag_item: item})
+                item = None
+        if abertos:
+            abertos[-1].clear()
+    if not recipiente:
+        return _agrupa(itens) if lista else registro
+    if tem_recipiente:
+        registro[recipiente] = _agrupa(itens)
+    return registro
+
+
+def xml_para_dict(conteudo):
+    """
+    Lê as respostas XML do PagSeguro (transaction, transactionSearchResult, checkout, errors e installments) de forma incremental,
+    guardando só os campos usados pelos serviços, no mesmo formato do Formatador.xml_para_dict.
+    Os outros documentos passam pelo Formatador.xml_para_dict. Se não for possível ler o XML, retorna um dicionário vazio.
+    """
+    if not conteudo:
+        return {}
+    try:
+        eventos = iterparse(StringIO(conteudo), events=('start', 'end'))
+        _, raiz = next(eventos)
+        if raiz.tag not in DOCUMENTOS:
+            return serializacao.Formatador.xml_para_dict(conteudo)
+        campos, lista = DOCUMENTOS[raiz.tag]
+        return {raiz.tag: _le_documento(eventos, raiz, campos, lista)}
+    except (ParseError, TypeError, StopIteration):
+        return {}
@@ -1,22 +1,118 @@
 # -*- coding: utf-8 -*-
 import json
+import threading
+from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
 from urllib import urlencode
+from xml.sax.saxutils import escape
 
 from li_common.comunicacao import requisicao
+from requests.exceptions import ConnectionError
 
 from pagador import configuracoes, servicos
+from pagador_pagseguro_transparente import cache, comunicacao, consultas, deduplicacao, evidencias, metricas, resiliencia, respostas, situacoes
 
 GATEWAY = 'pstransparente'
+TEMPO_CACHE_PARAMETROS = 300
+JANELA_MAXIMA_DIAS = 30
+RESULTADOS_POR_PAGINA = 1000
+FORMATO_DATA = '%Y-%m-%dT%H:%M'
+FORMATO_DATA_SEM_HORA = '%Y-%m-%d'
+CONCORRENCIA_AUTORIZACOES = 10
+PERMISSOES_AUTORIZACAO = ('CREATE_CHECKOUTS', 'SEARCH_TRANSACTIONS', 'RECEIVE_TRANSACTION_NOTIFICATIONS')
+
+PARAMETROS_CONTRATO = cache.CacheTTL(TEMPO_CACHE_PARAMETROS, tamanho_maximo=50000)
+NOTIFICACOES_PROCESSADAS = deduplicacao.NotificacoesProcessadas()
+FILA_NOTIFICACOES = None
+CONSULTAS_TRANSACOES = consultas.ConsultasCompartilhadas()
+SITUACOES_TRANSACOES = situacoes.SituacoesDeTransacoes()
+
+# O checkout só é repetido quando o PagSeguro com certeza não processou o pedido, para não criar transação duplicada:
+# erro ao abrir a conexão, antes de enviar o corpo, ou 503. Um 502/504 ou conexão abortada pode vir depois da cobrança.
+POLITICAS_DE_TENTATIVAS = {
+    'checkout': resiliencia.PoliticaDeTentativas(status_repetiveis=(503,), excecoes=(ConnectionError,), so_antes_do_envio=True),
+    'retorno': resiliencia.PoliticaDeTentativas(),
+    'notificacao': resiliencia.PoliticaDeTentativas(),
+    'busca': resiliencia.PoliticaDeTentativas(orcamento=60),
+}
+
+
+def aplicacao_do_contrato(configuracao):
+    return 'pagseguro-alternativo' if configuracao.aplicacao == 'pagseguro-alternativo' else 'pagseguro'
+
+
+@metricas.medido('parametros_contrato.obtem')
+def obtem_parametros_contrato(servico, aplicacao):
+    """
+    Retorna app_id e app_secret da aplicação usando o cache de processo, por (loja_id, aplicacao).
+    """
+    def carrega():
+        with metricas.fase('parametros_contrato.carrega'):
+            return servico.cria_entidade_pagador('ParametrosDeContrato', loja_id=servico.loja_id).obter_para(aplicacao)
+    return PARAMETROS_CONTRATO.obtem((servico.loja_id, aplicacao), carrega)
+
+
+def invalida_parametros_contrato(loja_id, aplicacao=None):
+    if aplicacao:
+        PARAMETROS_CONTRATO.invalida((loja_id, aplicacao))
+    else:
+        PARAMETROS_CONTRATO.invalida_onde(lambda chave: chave[0] == loja_id)
+
+
+def _descarta_credenciais_recusadas(servico, resposta):
+    """
+    Tira do cache os parâmetros de contrato da loja quando o PagSeguro recusa a chamada (401 ou 403), para a próxima
+    ler o app_id e o app_secret do banco em vez de repetir credenciais trocadas até o fim do TTL.
+    """
+    if getattr(resposta, 'status_code', None) in (401, 403):
+        invalida_parametros_contrato(servico.loja_id, aplicacao_do_contrato(servico.configuracao))
+
+
+def url_transacao(sandbox, codigo):
+    return 'https://ws.{}pagseguro.uol.com.br/v3/transactions/{}'.format(sandbox, codigo)
+
 
+# Partes fixas do XML do authorizationRequest, na ordem em que o Formatador.dict_para_xml gerava.
+_INICIO_AUTORIZACAO = u'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><authorizationRequest><redirectURL><![CDATA['
+_MEIO_AUTORIZACAO = u']]></redirectURL><reference>'
+_FIM_AUTORIZACAO = u'</reference><permissions>{}</permissions></authorizationRequest>'.format(
+    u''.join(u'<code>{}</code>'.format(permissao) for permissao in PERMISSOES_AUTORIZACAO)
+)
 
-class InstalaMeioDePagamento(servicos.InstalaMeioDePagamento):
+
+def xml_autorizacao(referencia, redirect_url):
+    """
+    Monta o XML do authorizationRequest preenchendo só a referência e a URL de retorno no modelo pré-montado.
+    A referência é escapada e a URL vai num CDATA que não pode ser fechado por ela.
+    """
+    return u''.join((
+        _INICIO_AUTORIZACAO, unicode(redirect_url).replace(u']]>', u']]]]><![CDATA[>'),
+        _MEIO_AUTORIZACAO, escape(unicode(referencia)), _FIM_AUTORIZACAO
+    ))
+
+
+class ConexaoPersistente(object):
+    """
+    Faz os serviços usarem a conexão do PagSeguro com sessões keep-alive compartilhadas por host e a política de
+    tentativas do endpoint em POLITICAS_DE_TENTATIVAS.
+    """
+    endpoint = None
+
+    def obter_conexao(self, formato_envio=requisicao.Formato.json, formato_resposta=requisicao.Formato.json):
+        return comunicacao.obtem_conexao(formato_envio, formato_resposta, politica=POLITICAS_DE_TENTATIVAS.get(self.endpoint))
+
+
+class InstalaMeioDePagamento(ConexaoPersistente, servicos.InstalaMeioDePagamento):
     campos = ['codigo_autorizacao', 'aplicacao']
 
     def __init__(self, loja_id, dados):
         super(InstalaMeioDePagamento, self).__init__(loja_id, dados)
         self.usa_alt = 'ua' in self.dados
         self.aplicacao = 'pagseguro-alternativo' if self.usa_alt else self.dados.get('aplicacao', None) or 'pagseguro'
-        parametros = self.cria_entidade_pagador('ParametrosDeContrato', loja_id=loja_id).obter_para(self.aplicacao)
+        # A instalação é o que se refaz depois de uma troca de credenciais da aplicação, então lê os parâmetros do
+        # banco em vez do cache (e já deixa o cache atualizado para os outros serviços).
+        invalida_parametros_contrato(self.loja_id, self.aplicacao)
+        parametros = obtem_parametros_contrato(self, self.aplicacao)
         self.app_key = parametros['app_secret']
         self.app_id = parametros['app_id']
         self.conexao = self.obter_conexao(formato_envio=requisicao.Formato.xml, formato_resposta=requisicao.Formato.xml)
@@ -32,24 +128,13 @@ class InstalaMeioDePagamento(servicos.InstalaMeioDePagamento):
                 parametros_redirect['ua'] = 1
         except KeyError:
             raise self.InstalacaoNaoFinalizada(u'Você precisa informar a url de redirecionamento na volta do PagSeguro na chave next_url do parâmetro dados.')
-        dados = {
-            'authorizationRequest': {
-                'reference': self.loja_id,
-                'permissions': [
-                    {'code': 'CREATE_CHECKOUTS'},
-                    {'code': 'SEARCH_TRANSACTIONS'},
-                    {'code': 'RECEIVE_TRANSACTION_NOTIFICATIONS'},
-                ],
-                'redirectURL': '<![CDATA[{}?{}]]>'.format(configuracoes.INSTALAR_REDIRECT_URL.format(self.loja_id, GATEWAY), urlencode(parametros_redirect)),
-            }
-        }
+        redirect_url = '{}?{}'.format(configuracoes.INSTALAR_REDIRECT_URL.format(self.loja_id, GATEWAY), urlencode(parametros_redirect))
         dados_autorizacao = {
             'appKey': self.app_key,
             'appId': self.app_id,
         }
         url_autorizacao = 'https://ws.{}pagseguro.uol.com.br/v2/authorizations/request?{}'.format(self.sandbox, urlencode(dados_autorizacao))
-        dados = self.formatador.dict_para_xml(dados)
-        resposta = self.conexao.post(url_autorizacao, dados=dados)
+        resposta = self.conexao.post(url_autorizacao, dados=xml_autorizacao(self.loja_id, redirect_url))
         if not resposta.sucesso:
             raise self.InstalacaoNaoFinalizada(u'Erro ao entrar em contato com o PagSeguro. Código: {} - Resposta: {}'.format(resposta.status_code, resposta.conteudo))
         code = resposta.conteudo['authorizationRequest']['code']
@@ -76,6 +161,33 @@ class InstalaMeioDePagamento(servicos.InstalaMeioDePagamento):
         return {'url': 'https://{}pagseguro.uol.com.br/aplicacao/listarAutorizacoes.jhtml'.format(self.sandbox)}
 
 
+def monta_urls_autorizacao(lojas, dados, concorrencia=CONCORRENCIA_AUTORIZACOES):
+    """
+    Gera as URLs de autorização de várias lojas em paralelo, com os mesmos dados (next_url e, se for o caso, ua), por
+    exemplo para reautorizar as lojas depois de uma troca de credenciais da aplicação.
+    Retorna ({loja_id: url}, {loja_id: mensagem de erro}).
+    """
+    def monta(loja_id):
+        try:
+            return loja_id, InstalaMeioDePagamento(loja_id, dict(dados)).montar_url_autorizacao(), None
+        except Exception as erro:
+            return loja_id, None, u'{}: {}'.format(erro.__class__.__name__, erro)
+
+    urls = {}
+    erros = {}
+    pool = ThreadPool(concorrencia)
+    try:
+        for loja_id, url, erro in pool.imap_unordered(monta, lojas):
+            if erro is None:
+                urls[loja_id] = url
+            else:
+                erros[loja_id] = erro
+    finally:
+        pool.close()
+        pool.join()
+    return urls, erros
+
+
 class Credenciador(servicos.Credenciador):
     def __init__(self, tipo=None, configuracao=None):
         super(Credenciador, self).__init__(tipo, configuracao)
@@ -92,7 +204,9 @@ MENSAGENS_ERRO = {
 }
 
 
-class EntregaPagamento(servicos.EntregaPagamento):
+class EntregaPagamento(ConexaoPersistente, servicos.EntregaPagamento):
+    endpoint = 'checkout'
+
     def __init__(self, loja_id, plano_indice=1, dados=None):
         super(EntregaPagamento, self).__init__(loja_id, plano_indice, dados=dados)
         self.tem_malote = True
@@ -104,16 +218,23 @@ class EntregaPagamento(servicos.EntregaPagamento):
     def define_credenciais(self):
         self.conexao.credenciador = Credenciador(configuracao=self.configuracao)
 
+    @metricas.medido('entrega.montar_malote')
     def montar_malote(self):
         self.malote = self.cria_entidade_extensao('Malote', configuracao=self.configuracao)
-        aplicacao = 'pagseguro-alternativo' if self.configuracao.aplicacao == 'pagseguro-alternativo' else 'pagseguro'
-        parametros = self.cria_entidade_pagador('ParametrosDeContrato', loja_id=self.loja_id).obter_para(aplicacao)
+        parametros = obtem_parametros_contrato(self, aplicacao_do_contrato(self.configuracao))
         self.malote.monta_conteudo(pedido=self.pedido, parametros_contrato=parametros, dados=self.dados)
 
+    @metricas.medido('entrega.envia_pagamento')
     def envia_pagamento(self, tentativa=1):
-        self.dados_enviados = self.malote.to_dict()
+        # O corpo vai montado (str) e não como o iterável do Malote.codifica_formulario: a política do checkout pode
+        # reenviá-lo numa nova tentativa e ele também vai para as evidências, e um gerador só pode ser lido uma vez.
+        self.dados_enviados = self.malote.to_form_urlencoded()
+        self.conexao.primeira_tentativa = tentativa
         self.resposta = self.conexao.post(self.url, self.dados_enviados)
+        _descarta_credenciais_recusadas(self, self.resposta)
+        evidencias.registra('checkout', self.loja_id, self.dados_enviados, self.resposta, referencia=self.malote.reference)
 
+    @metricas.medido('entrega.processa_dados_pagamento')
     def processa_dados_pagamento(self):
         self.resultado = self._processa_resposta()
 
@@ -170,43 +291,82 @@ class SituacoesDePagamento(servicos.SituacoesDePagamento):
         '8': servicos.SituacaoPedido.SITUACAO_PAGTO_CHARGEBACK
     }
 
+    # Precedência dos status no ciclo da transação. Status com a mesma precedência podem vir em qualquer ordem: a
+    # disputa (5) pode voltar para paga (3) ou disponível (4), e a transação encerrada pode passar de um final a outro.
+    PRECEDENCIA = {
+        '1': 0,
+        '2': 1,
+        '3': 2,
+        '4': 2,
+        '5': 2,
+        '6': 3,
+        '7': 3,
+        '8': 3,
+    }
+
+    @classmethod
+    def ordem(cls, situacao):
+        """
+        Posição do status no ciclo da transação, pela PRECEDENCIA. Status desconhecidos ficam antes de todos.
+        """
+        return cls.PRECEDENCIA.get(situacao, -1)
+
+
+SITUACOES_DOS_PEDIDOS = situacoes.SituacoesRecentesDosPedidos(SituacoesDePagamento.ordem)
+
+
+class RegistraResultado(ConexaoPersistente, servicos.RegistraResultado):
+    endpoint = 'retorno'
 
-class RegistraResultado(servicos.RegistraResultado):
     def __init__(self, loja_id, dados=None):
         super(RegistraResultado, self).__init__(loja_id, dados)
         self.conexao = self.obter_conexao(formato_envio=requisicao.Formato.querystring, formato_resposta=requisicao.Formato.xml)
         self.redirect_para = dados.get('next_url', None)
         self.faz_http = True
+        self.transacao_local = None
 
     def define_credenciais(self):
         self.conexao.credenciador = Credenciador(configuracao=self.configuracao)
 
+    @metricas.medido('resultado.monta_dados_pagamento')
     def monta_dados_pagamento(self):
-        if self.deve_obter_informacoes_pagseguro and self.resposta.sucesso:
+        if self.deve_obter_informacoes_pagseguro and (self.transacao_local is not None or self.resposta.sucesso):
             self.dados_pagamento['identificador_id'] = self.dados['transacao']
             self.pedido_numero = self.dados["referencia"]
-            transacao = self.resposta.conteudo['transaction']
-            if 'code' in transacao:
-                self.dados_pagamento['transacao_id'] = transacao['code']
-            if 'grossAmount' in transacao:
-                self.dados_pagamento['valor_pago'] = transacao['grossAmount']
-            self.situacao_pedido = SituacoesDePagamento.do_tipo(transacao['status'])
+            transacao = self.transacao_local
+            if transacao is None:
+                transacao = respostas.Transacao.do_xml(self.resposta.conteudo['transaction'])
+                SITUACOES_TRANSACOES.registra(self.loja_id, transacao)
+            if transacao.codigo is not None:
+                self.dados_pagamento['transacao_id'] = transacao.codigo
+            if transacao.valor is not None:
+                self.dados_pagamento['valor_pago'] = transacao.valor
+            self.situacao_pedido = SituacoesDePagamento.do_tipo(transacao.situacao)
             self.resultado = 'sucesso'
         else:
             self.resultado = 'pendente'
 
     def _gera_dados_envio(self):
-        aplicacao = 'pagseguro-alternativo' if self.configuracao.aplicacao == 'pagseguro-alternativo' else 'pagseguro'
-        parametros = self.cria_entidade_pagador('ParametrosDeContrato', loja_id=self.loja_id).obter_para(aplicacao)
+        parametros = obtem_parametros_contrato(self, aplicacao_do_contrato(self.configuracao))
         return {
             'appKey': parametros['app_secret'],
             'appId': parametros['app_id'],
         }
 
+    @metricas.medido('resultado.obtem_informacoes_pagamento')
     def obtem_informacoes_pagamento(self):
         if self.deve_obter_informacoes_pagseguro:
+            self.transacao_local = SITUACOES_TRANSACOES.consulta(self.loja_id, self.dados['transacao'])
+            if self.transacao_local is not None:
+                return
             self.dados_enviados = self._gera_dados_envio()
-            self.resposta = self.conexao.get(self.url, dados=self.dados_enviados)
+            self.resposta = CONSULTAS_TRANSACOES.consulta((self.loja_id, self.url), self._consulta_transacao)
+
+    def _consulta_transacao(self):
+        resposta = self.conexao.get(self.url, dados=self.dados_enviados)
+        _descarta_credenciais_recusadas(self, resposta)
+        evidencias.registra('retorno', self.loja_id, self.dados_enviados, resposta, referencia=self.dados['transacao'])
+        return resposta
 
     @property
     def deve_obter_informacoes_pagseguro(self):
@@ -215,64 +375,124 @@ class RegistraResultado(servicos.RegistraResultado):
     @property
     def url(self):
         if self.deve_obter_informacoes_pagseguro:
-            return 'https://ws.{}pagseguro.uol.com.br/v3/transactions/{}'.format(self.sandbox, self.dados['transacao'])
+            return url_transacao(self.sandbox, self.dados['transacao'])
         return ''
 
 
-class RegistraNotificacao(servicos.RegistraResultado):
+class RegistraNotificacao(ConexaoPersistente, servicos.RegistraResultado):
+    endpoint = 'notificacao'
+
     def __init__(self, loja_id, dados=None):
         super(RegistraNotificacao, self).__init__(loja_id, dados)
         self.conexao = self.obter_conexao(formato_envio=requisicao.Formato.querystring, formato_resposta=requisicao.Formato.xml)
         self.faz_http = True
+        self.pedidos_pagamento = {}
+        self.notificacao_repetida = False
+        self.usa_fila = True
+        self.notificacao_enfileirada = False
+        self.situacao_registrada = None
 
     def define_credenciais(self):
         self.conexao.credenciador = Credenciador(configuracao=self.configuracao)
 
+    @metricas.medido('notificacao.cria_pedido_pagamento')
+    def cria_pedido_pagamento(self, pedido_numero):
+        pedido_pagamento = self.cria_entidade_pagador('PedidoPagamento', loja_id=self.configuracao.loja_id, pedido_numero=pedido_numero, codigo_pagamento=self.configuracao.meio_pagamento.codigo)
+        pedido_pagamento.preencher_do_banco()
+        return pedido_pagamento
+
+    def _obtem_pedido_pagamento(self):
+        if self.pedido_numero in self.pedidos_pagamento:
+            return self.pedidos_pagamento[self.pedido_numero]
+        return self.cria_pedido_pagamento(self.pedido_numero)
+
     def _define_valor_e_situacao(self, transacao):
-        if 'grossAmount' in transacao:
-            self.dados_pagamento['valor_pago'] = transacao['grossAmount']
-        self.situacao_pedido = SituacoesDePagamento.do_tipo(transacao['status'])
+        if transacao.valor is not None:
+            self.dados_pagamento['valor_pago'] = transacao.valor
+        self.situacao_pedido = SituacoesDePagamento.do_tipo(transacao.situacao)
 
+    @metricas.medido('notificacao.monta_dados_pagamento')
     def monta_dados_pagamento(self):
+        if self.notificacao_repetida or self.notificacao_enfileirada:
+            return
         if self.deve_obter_informacoes_pagseguro and self.resposta.sucesso:
             try:
-                transacao = self.resposta.conteudo['transaction']
+                transacao = respostas.Transacao.do_xml(self.resposta.conteudo['transaction'])
             except KeyError:
                 raise self.RegistroDePagamentoInvalido(u'O PagSeguro não retornou os dados da transação. Os dados retornados foram: {}'.format(json.dumps(self.resposta.conteudo)))
-            self.pedido_numero = int(transacao["reference"])
-            pedido_pagamento = self.cria_entidade_pagador('PedidoPagamento', loja_id=self.configuracao.loja_id, pedido_numero=self.pedido_numero, codigo_pagamento=self.configuracao.meio_pagamento.codigo)
-            pedido_pagamento.preencher_do_banco()
+            SITUACOES_TRANSACOES.registra(self.loja_id, transacao)
+            self.pedido_numero = int(transacao.referencia)
+            if SITUACOES_DOS_PEDIDOS.superada(self.loja_id, self.pedido_numero, transacao.situacao):
+                self.resultado = {'resultado': 'OK', 'detalhes': [u'Situação {} superada por uma notificação mais recente do pedido'.format(transacao.situacao)]}
+                return
+            pedido_pagamento = self._obtem_pedido_pagamento()
             detalhes = []
-            if 'code' in transacao:
+            if transacao.codigo is not None:
                 if pedido_pagamento.transacao_id:
                     detalhes.append('Pedido tem transacao_id ({})'.format(pedido_pagamento.transacao_id))
-                    if transacao['code'] == pedido_pagamento.transacao_id:
-                        detalhes.append(u'transaction.code ({}) é igual ao pedido.transacao_id ({})'.format(transacao['code'], pedido_pagamento.transacao_id))
+                    if transacao.codigo == pedido_pagamento.transacao_id:
+                        detalhes.append(u'transaction.code ({}) é igual ao pedido.transacao_id ({})'.format(transacao.codigo, pedido_pagamento.transacao_id))
                         self._define_valor_e_situacao(transacao)
                     else:
-                        detalhes.append(u'transaction.code ({}) é diferente ao pedido.transacao_id ({})'.format(transacao['code'], pedido_pagamento.transacao_id))
+                        detalhes.append(u'transaction.code ({}) é diferente ao pedido.transacao_id ({})'.format(transacao.codigo, pedido_pagamento.transacao_id))
                 else:
                     detalhes.append(u'Pedido não tem transacao_id ({})'.format(pedido_pagamento.transacao_id))
-                    self.dados_pagamento['transacao_id'] = transacao['code']
+                    self.dados_pagamento['transacao_id'] = transacao.codigo
                     self._define_valor_e_situacao(transacao)
                 self.resultado = {'resultado': 'OK', 'detalhes': detalhes}
+                if self.situacao_pedido is not None:
+                    self.situacao_registrada = transacao.situacao
             else:
                 self.resultado = {'resultado': 'ERRO', 'detalhes': [u'PagSeguro não enviou transaction.code']}
         else:
             self.resultado = {'resultado': 'ERRO', 'detalhes': [u'Não foi recebida uma resposta válida do PagSeguro']}
 
+    def confirma_registro(self):
+        """
+        Marca a notificação como processada (NOTIFICACOES_PROCESSADAS) e guarda a situação do pedido
+        (SITUACOES_DOS_PEDIDOS). Deve ser chamado só depois que os dados de pagamento forem gravados: se a gravação
+        falhar, a repetição do PagSeguro ou da fila precisa consultar e registrar a notificação de novo.
+        """
+        if self.notificacao_repetida or self.notificacao_enfileirada or not self.resultado or self.resultado['resultado'] != 'OK':
+            return
+        if self.situacao_registrada is not None:
+            SITUACOES_DOS_PEDIDOS.registra(self.loja_id, self.pedido_numero, self.situacao_registrada)
+        NOTIFICACOES_PROCESSADAS.registra(self.loja_id, self.dados['notificationCode'], self.resultado)
+
     def _gera_dados_envio(self):
-        aplicacao = 'pagseguro-alternativo' if self.configuracao.aplicacao == 'pagseguro-alternativo' else 'pagseguro'
-        parametros = self.cria_entidade_pagador('ParametrosDeContrato', loja_id=self.loja_id).obter_para(aplicacao)
+        parametros = obtem_parametros_contrato(self, aplicacao_do_contrato(self.configuracao))
         return {
             'appKey': parametros['app_secret'],
             'appId': parametros['app_id'],
         }
 
+    @metricas.medido('notificacao.obtem_informacoes_pagamento')
     def obtem_informacoes_pagamento(self):
         if self.deve_obter_informacoes_pagseguro:
+            resultado = NOTIFICACOES_PROCESSADAS.consulta(self.loja_id, self.dados['notificationCode'])
+            if resultado is not None:
+                self.notificacao_repetida = True
+                self.resultado = resultado
+                return
+            if self.usa_fila and FILA_NOTIFICACOES is not None:
+                FILA_NOTIFICACOES.enfileira(self.loja_id, self.dados['notificationCode'])
+                self.notificacao_enfileirada = True
+                self.resultado = {'resultado': 'OK', 'detalhes': [u'Notificação enfileirada para processamento']}
+                return
             self.dados_enviados = self._gera_dados_envio()
-            self.resposta = self.conexao.get(self.url, dados=self.dados_enviados)
+            self.resposta = CONSULTAS_TRANSACOES.consulta((self.loja_id, self.url), self._consulta_notificacao)
+
+    def _consulta_notificacao(self):
+        resposta = self.conexao.get(self.url, dados=self.dados_enviados)
+        _descarta_credenciais_recusadas(self, resposta)
+        evidencias.registra('notificacao', self.loja_id, self.dados_enviados, resposta, referencia=self.dados['notificationCode'])
+        try:
+            codigo = resposta.conteudo['transaction']['code'] if getattr(resposta, 'sucesso', False) else None
+        except (KeyError, TypeError):
+            codigo = None
+        if codigo:
+            CONSULTAS_TRANSACOES.guarda((self.loja_id, url_transacao(self.sandbox, codigo)), resposta)
+        return resposta
 
     @property
     def deve_obter_informacoes_pagseguro(self):
@@ -285,10 +505,13 @@ class RegistraNotificacao(servicos.RegistraResultado):
         return ''
 
 
-class AtualizaTransacoes(servicos.AtualizaTransacoes):
+class AtualizaTransacoes(ConexaoPersistente, servicos.AtualizaTransacoes):
+    endpoint = 'busca'
+
     def __init__(self, loja_id, dados):
         super(AtualizaTransacoes, self).__init__(loja_id, dados)
         self.url = 'https://ws.{}pagseguro.uol.com.br/v3/transactions'.format(self.sandbox)
+        self.janela_atual = None
         self.conexao = self.obter_conexao(formato_envio=requisicao.Formato.querystring, formato_resposta=requisicao.Formato.xml)
 
     def define_credenciais(self):
@@ -297,8 +520,7 @@ class AtualizaTransacoes(servicos.AtualizaTransacoes):
     def _gera_dados_envio(self):
         initial_date = self.dados['data_inicial']
         final_date = self.dados.get('data_final')
-        aplicacao = 'pagseguro-alternativo' if self.configuracao.aplicacao == 'pagseguro-alternativo' else 'pagseguro'
-        parametros = self.cria_entidade_pagador('ParametrosDeContrato', loja_id=self.loja_id).obter_para(aplicacao)
+        parametros = obtem_parametros_contrato(self, aplicacao_do_contrato(self.configuracao))
         retorno = {
             'appKey': parametros['app_secret'],
             'appId': parametros['app_id'],
@@ -308,25 +530,129 @@ class AtualizaTransacoes(servicos.AtualizaTransacoes):
             retorno['finalDate'] = final_date
         return retorno
 
+    @metricas.medido('transacoes.consulta_transacoes')
     def consulta_transacoes(self):
         self.dados_enviados = self._gera_dados_envio()
         self.resposta = self.conexao.get(self.url, dados=self.dados_enviados)
+        _descarta_credenciais_recusadas(self, self.resposta)
 
+    @metricas.medido('transacoes.analisa_resultado_transacoes')
     def analisa_resultado_transacoes(self):
         if self.resposta.sucesso:
-            transacoes = self.resposta.conteudo['transactionSearchResult'].get('transactions', [])
-            if type(transacoes) is dict:
-                self.dados_pedido = {
-                    'situacao_pedido': SituacoesDePagamento.do_tipo(transacoes['transaction']['status']),
-                    'pedido_numero': transacoes['transaction']['reference']
-                }
+            resultado = self.resposta.conteudo['transactionSearchResult']
+            transacoes = respostas.PaginaDeBusca.do_xml(resultado).transacoes
+            for transacao in transacoes:
+                SITUACOES_TRANSACOES.registra(self.loja_id, transacao)
+            dados_pedido = [_dados_pedido(transacao) for transacao in transacoes]
+            if type(resultado.get('transactions')) is dict:
+                self.dados_pedido = dados_pedido[0]
             else:
-                self.dados_pedido = []
-                for transacao in transacoes:
-                    self.dados_pedido.append({
-                        'situacao_pedido': SituacoesDePagamento.do_tipo(transacao['transaction']['status']),
-                        'pedido_numero': transacao['transaction']['reference']
-                    })
+                self.dados_pedido = dados_pedido
         else:
             if 'errors' in self.resposta.conteudo:
-                self.erros = self.resposta.conteudo
\ No newline at end of file
+                self.erros = self.resposta.conteudo
+
+    def janelas_de_busca(self):
+        """
+        Divide o período pedido em janelas de até JANELA_MAXIMA_DIAS, o limite de intervalo da busca do PagSeguro.
+        Sem data_final, a última janela vai sem finalDate, como na busca simples.
+        """
+        inicio = _para_data(self.dados['data_inicial'])
+        final = self.dados.get('data_final')
+        fim = _para_data(final) if final else datetime.now()
+        janela = timedelta(days=JANELA_MAXIMA_DIAS)
+        while inicio + janela < fim:
+            yield inicio.strftime(FORMATO_DATA), (inicio + janela).strftime(FORMATO_DATA)
+            inicio += janela
+        yield inicio.strftime(FORMATO_DATA), fim.strftime(FORMATO_DATA) if final else None
+
+    @metricas.medido('transacoes.consulta_pagina')
+    def _consulta_pagina(self, dados_envio, pagina):
+        dados_envio = dict(dados_envio, page=pagina)
+        resposta = self.conexao.get(self.url, dados=dados_envio)
+        _descarta_credenciais_recusadas(self, resposta)
+        return resposta
+
+    def _paginas(self, pre_carrega):
+        dados_envio = self._gera_dados_envio()
+        dados_envio['maxPageResults'] = RESULTADOS_POR_PAGINA
+        for data_inicial, data_final in self.janelas_de_busca():
+            self.janela_atual = (data_inicial, data_final)
+            dados_envio['initialDate'] = data_inicial
+            if data_final:
+                dados_envio['finalDate'] = data_final
+            else:
+                dados_envio.pop('finalDate', None)
+            pagina = 1
+            proxima = None
+            while True:
+                resposta = proxima.resultado() if proxima else self._consulta_pagina(dados_envio, pagina)
+                proxima = None
+                if not resposta.sucesso:
+                    self.erros = resposta.conteudo or {'status_code': resposta.status_code}
+                    return
+                resultado = respostas.PaginaDeBusca.do_xml(resposta.conteudo.get('transactionSearchResult'))
+                if pre_carrega and pagina < resultado.total_paginas:
+                    proxima = _EmSegundoPlano(self._consulta_pagina, dict(dados_envio), pagina + 1)
+                yield resultado
+                if pagina >= resultado.total_paginas:
+                    break
+                pagina += 1
+
+    def itera_registros(self, pre_carrega=False):
+        """
+        Percorre todas as páginas e janelas da busca, gerando um respostas.Transacao por transação.
+        Com pre_carrega, a próxima página é buscada enquanto a atual é consumida.
+        Se o PagSeguro responder com erro, a iteração para e os erros ficam em self.erros (o conteúdo da resposta ou,
+        sem corpo, {'status_code'}).
+        """
+        for resultado in self._paginas(pre_carrega):
+            for transacao in resultado.transacoes:
+                SITUACOES_TRANSACOES.registra(self.loja_id, transacao)
+                yield transacao
+
+    def itera_transacoes(self, pre_carrega=False):
+        """
+        Como itera_registros, mas gerando um {'pedido_numero', 'situacao_pedido'} por transação.
+        """
+        for transacao in self.itera_registros(pre_carrega):
+            yield _dados_pedido(transacao)
+
+
+def _para_data(valor):
+    """
+    Aceita datetime, data e hora no FORMATO_DATA (segundos e fuso são ignorados) ou só a data (YYYY-MM-DD).
+    """
+    if isinstance(valor, datetime):
+        return valor
+    if len(valor) == 10:
+        return datetime.strptime(valor, FORMATO_DATA_SEM_HORA)
+    return datetime.strptime(valor[:16], FORMATO_DATA)
+
+
+def _dados_pedido(transacao):
+    return {
+        'situacao_pedido': SituacoesDePagamento.do_tipo(transacao.situacao),
+        'pedido_numero': transacao.referencia
+    }
+
+
+class _EmSegundoPlano(object):
+    def __init__(self, funcao, *args):
+        self._resultado = None
+        self._erro = None
+        self._thread = threading.Thread(target=self._executa, args=(funcao,) + args)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _executa(self, funcao, *args):
+        try:
+            self._resultado = funcao(*args)
+        except Exception as erro:
+            self._erro = erro
+
+    def resultado(self):
+        self._thread.join()
+        if self._erro:
+            raise self._erro
+        return self._resultado
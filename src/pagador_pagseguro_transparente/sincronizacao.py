@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from pagador_pagseguro_transparente import servicos
+
+SOBREPOSICAO_MINUTOS = 10
+DIAS_PRIMEIRA_SINCRONIZACAO = 30
+RETENCAO_SITUACOES = 180 * 24 * 60 * 60
+GRAVACOES_ENTRE_LIMPEZAS = 100
+MAXIMO_PARAMETROS = 500
+
+
+class MarcasDeSincronizacao(object):
+    """
+    Guarda num arquivo SQLite, por loja, até quando as transações já foram sincronizadas (a marca d'água, no
+    FORMATO_DATA da busca) e a última situação sincronizada de cada transação. As situações de uma página e o avanço
+    da marca são gravados na mesma transação do banco.
+    """
+    def __init__(self, caminho, retencao=RETENCAO_SITUACOES, relogio=time.time):
+        self.caminho = caminho
+        self.retencao = retencao
+        self.relogio = relogio
+        self._gravacoes = 0
+        self._trava = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, timeout=5, check_same_thread=False)
+        self._conexao.execute('PRAGMA journal_mode=WAL')
+        with self._conexao:
+            self._conexao.execute(
+                'CREATE TABLE IF NOT EXISTS marcas_sincronizacao (loja_id INTEGER PRIMARY KEY, marca TEXT NOT NULL)'
+            )
+            self._conexao.execute(
+                'CREATE TABLE IF NOT EXISTS situacoes_sincronizadas '
+                '(loja_id INTEGER NOT NULL, codigo TEXT NOT NULL, situacao TEXT, sincronizada_em REAL NOT NULL, '
+                'PRIMARY KEY (loja_id, codigo))'
+            )
+
+    def marca(self, loja_id):
+        with self._trava:
+            linha = self._conexao.execute('SELECT marca FROM marcas_sincronizacao WHERE loja_id = ?', (loja_id,)).fetchone()
+        return linha[0] if linha else None
+
+    def situacoes(self, loja_id, codigos):
+        """
+        Retorna {codigo: situacao} das transações da loja já sincronizadas.
+        """
+        codigos = list(codigos)
+        situacoes = {}
+        with self._trava:
+            for inicio in range(0, len(codigos), MAXIMO_PARAMETROS):
+                bloco = codigos[inicio:inicio + MAXIMO_PARAMETROS]
+                situacoes.update(self._conexao.execute(
+                    'SELECT codigo, situacao FROM situacoes_sincronizadas WHERE loja_id = ? AND codigo IN ({})'.format(', '.join('?' * len(bloco))),
+                    [loja_id] + bloco
+                ).fetchall())
+        return situacoes
+
+    def registra_pagina(self, loja_id, transacoes, marca=None):
+        """
+        Grava as situações das transações da página e, com marca, avança a marca d'água da loja (nunca para trás).
+        """
+        agora = self.relogio()
+        with self._trava, self._conexao:
+            self._conexao.executemany(
+                'INSERT OR REPLACE INTO situacoes_sincronizadas (loja_id, codigo, situacao, sincronizada_em) VALUES (?, ?, ?, ?)',
+                [(loja_id, transacao.codigo, transacao.situacao, agora) for transacao in transacoes if transacao.codigo is not None]
+            )
+            if marca:
+                self._conexao.execute('INSERT OR IGNORE INTO marcas_sincronizacao (loja_id, marca) VALUES (?, ?)', (loja_id, marca))
+                self._conexao.execute('UPDATE marcas_sincronizacao SET marca = ? WHERE loja_id = ? AND marca < ?', (marca, loja_id, marca))
+            self._gravacoes += 1
+            if self._gravacoes % GRAVACOES_ENTRE_LIMPEZAS == 0:
+                self._conexao.execute('DELETE FROM situacoes_sincronizadas WHERE sincronizada_em <= ?', (agora - self.retencao,))
+
+    def limpa(self, loja_id=None):
+        with self._trava, self._conexao:
+            if loja_id is None:
+                self._conexao.execute('DELETE FROM marcas_sincronizacao')
+                self._conexao.execute('DELETE FROM situacoes_sincronizadas')
+            else:
+                self._conexao.execute('DELETE FROM marcas_sincronizacao WHERE loja_id = ?', (loja_id,))
+                self._conexao.execute('DELETE FROM situacoes_sincronizadas WHERE loja_id = ?', (loja_id,))
+
+    def fecha(self):
+        self._conexao.close()
+
+
+class AtualizaTransacoesIncrementais(servicos.AtualizaTransacoes):
+    """
+    AtualizaTransacoes que busca a partir da marca d'água da loja (menos SOBREPOSICAO_MINUTOS) em vez de um
+    data_inicial fixo, e só entrega em itera_registros/itera_transacoes as transações cuja situação mudou desde a
+    última sincronização. Sem marca, usa o data_inicial dos dados ou os últimos DIAS_PRIMEIRA_SINCRONIZACAO dias.
+    Cada página é gravada em marcas depois de consumida; a marca avança para o fim da janela de busca quando a última
+    página dela é consumida, porque as páginas não vêm em ordem de evento e uma busca interrompida no meio da janela
+    a refaz inteira (as transações já gravadas são puladas).
+    """
+    def __init__(self, loja_id, dados, marcas, agora=None):
+        dados = dict(dados or {})
+        agora = agora or datetime.now()
+        marca = marcas.marca(loja_id)
+        if marca:
+            dados['data_inicial'] = (servicos._para_data(marca) - timedelta(minutes=SOBREPOSICAO_MINUTOS)).strftime(servicos.FORMATO_DATA)
+        elif not dados.get('data_inicial'):
+            dados['data_inicial'] = (agora - timedelta(days=DIAS_PRIMEIRA_SINCRONIZACAO)).strftime(servicos.FORMATO_DATA)
+        dados.setdefault('data_final', agora.strftime(servicos.FORMATO_DATA))
+        super(AtualizaTransacoesIncrementais, self).__init__(loja_id, dados)
+        self.marcas = marcas
+        self.puladas = 0
+
+    def itera_registros(self, pre_carrega=False):
+        for resultado in self._paginas(pre_carrega):
+            sincronizadas = self.marcas.situacoes(self.loja_id, [transacao.codigo for transacao in resultado.transacoes if transacao.codigo is not None])
+            for transacao in resultado.transacoes:
+                servicos.SITUACOES_TRANSACOES.registra(self.loja_id, transacao)
+                if transacao.codigo in sincronizadas and sincronizadas[transacao.codigo] == transacao.situacao:
+                    self.puladas += 1
+                    continue
+                yield transacao
+            fim_da_janela = self.janela_atual[1] if resultado.pagina >= resultado.total_paginas else None
+            self.marcas.registra_pagina(self.loja_id, resultado.transacoes, marca=fim_da_janela)
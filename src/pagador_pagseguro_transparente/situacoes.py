@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import json
+import sqlite3
+import threading
+import time
+
+from pagador_pagseguro_transparente import cache, respostas
+
+TAMANHO_MAXIMO = 100000
+GRAVACOES_ENTRE_LIMPEZAS = 1000
+JANELA_AGRUPAMENTO = 30
+
+# Por quantos segundos a situação vista numa notificação ou busca vale como resposta para o retorno do checkout,
+# pelo status do PagSeguro. Quanto mais provável a mudança, menor o tempo; status fora da política não são usados.
+POLITICA_FRESCOR = {
+    '1': 15,
+    '2': 60,
+    '3': 10 * 60,
+    '4': 10 * 60,
+    '5': 5 * 60,
+    '6': 60 * 60,
+    '7': 60 * 60,
+    '8': 60 * 60,
+}
+
+
+class BackendSQLite(object):
+    """
+    Guarda as situações das transações num arquivo SQLite, compartilhado entre os processos da máquina, para que o
+    retorno atendido por um processo veja as notificações recebidas por outro.
+    """
+    def __init__(self, caminho, relogio=time.time):
+        self.caminho = caminho
+        self.relogio = relogio
+        self._gravacoes = 0
+        self._trava = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, timeout=5, check_same_thread=False)
+        with self._conexao:
+            self._conexao.execute(
+                'CREATE TABLE IF NOT EXISTS situacoes_transacoes '
+                '(chave TEXT PRIMARY KEY, transacao TEXT NOT NULL, valido_ate REAL NOT NULL)'
+            )
+
+    def consulta(self, chave):
+        """
+        Retorna (transacao, valido_ate) se a entrada ainda estiver fresca.
+        """
+        with self._trava:
+            linha = self._conexao.execute(
+                'SELECT transacao, valido_ate FROM situacoes_transacoes WHERE chave = ? AND valido_ate > ?', (chave, self.relogio())
+            ).fetchone()
+        return (json.loads(linha[0]), linha[1]) if linha else None
+
+    def registra(self, chave, transacao, valido_ate):
+        with self._trava, self._conexao:
+            self._conexao.execute(
+                'INSERT OR REPLACE INTO situacoes_transacoes (chave, transacao, valido_ate) VALUES (?, ?, ?)',
+                (chave, json.dumps(transacao), valido_ate)
+            )
+            self._gravacoes += 1
+            if self._gravacoes % GRAVACOES_ENTRE_LIMPEZAS == 0:
+                self._conexao.execute('DELETE FROM situacoes_transacoes WHERE valido_ate <= ?', (self.relogio(),))
+
+    def limpa(self):
+        with self._trava, self._conexao:
+            self._conexao.execute('DELETE FROM situacoes_transacoes')
+
+    def fecha(self):
+        self._conexao.close()
+
+
+class SituacoesDeTransacoes(object):
+    """
+    Última situação vista de cada transação por (loja_id, código da transação), preenchida pelo RegistraNotificacao,
+    pelo AtualizaTransacoes e pelo próprio RegistraResultado. Cada entrada vale pelo tempo que a politica dá ao status
+    dela. Fica em memória com descarte do menos usado; com backend (BackendSQLite), é compartilhada entre processos.
+    """
+    def __init__(self, politica=None, tamanho_maximo=TAMANHO_MAXIMO, backend=None, relogio=time.time):
+        self.politica = POLITICA_FRESCOR if politica is None else politica
+        self.memoria = cache.CacheTTL(0, tamanho_maximo=tamanho_maximo, relogio=relogio)
+        self.backend = backend
+        self.relogio = relogio
+        self.acertos_backend = 0
+
+    @staticmethod
+    def _chave(loja_id, codigo):
+        return u'{}:{}'.format(loja_id, codigo)
+
+    def frescor(self, transacao):
+        return self.politica.get(transacao.situacao, 0)
+
+    def consulta(self, loja_id, codigo):
+        """
+        Retorna o respostas.Transacao registrado para a transação, ou None se não houver entrada fresca.
+        """
+        chave = self._chave(loja_id, codigo)
+        transacao = self.memoria.consulta(chave)
+        if transacao is None and self.backend is not None:
+            encontrada = self.backend.consulta(chave)
+            if encontrada is not None:
+                transacao, valido_ate = encontrada
+                self.acertos_backend += 1
+                self.memoria.define(chave, transacao, tempo_vida=valido_ate - self.relogio())
+        return respostas.Transacao.do_xml(transacao) if transacao is not None else None
+
+    def registra(self, loja_id, transacao):
+        frescor = self.frescor(transacao)
+        if transacao.codigo is None or frescor <= 0:
+            return
+        chave = self._chave(loja_id, transacao.codigo)
+        dados = transacao.to_dict()
+        self.memoria.define(chave, dados, tempo_vida=frescor)
+        if self.backend is not None:
+            self.backend.registra(chave, dados, self.relogio() + frescor)
+
+    def limpa(self):
+        self.memoria.limpa()
+        self.acertos_backend = 0
+        if self.backend is not None:
+            self.backend.limpa()
+
+    def estatisticas(self):
+        estatisticas = self.memoria.estatisticas()
+        estatisticas['acertos'] += self.acertos_backend
+        estatisticas['faltas'] -= self.acertos_backend
+        estatisticas['acertos_backend'] = self.acertos_backend
+        return estatisticas
+
+
+class SituacoesRecentesDosPedidos(object):
+    """
+    Junta as rajadas de notificações de um mesmo pedido (1 → 2 → 3 em poucos segundos): guarda, por
+    (loja_id, pedido_numero), a situação mais adiantada já processada nos últimos janela segundos, e superada() diz se
+    uma situação chegou atrasada e pode ser descartada sem gravar no pedido. ordem(situacao) dá a posição do status no
+    ciclo da transação.
+    """
+    def __init__(self, ordem, janela=JANELA_AGRUPAMENTO, tamanho_maximo=TAMANHO_MAXIMO, relogio=time.time):
+        self.ordem = ordem
+        self.memoria = cache.CacheTTL(janela, tamanho_maximo=tamanho_maximo, relogio=relogio)
+        self.descartadas = 0
+        self._trava = threading.Lock()
+
+    def superada(self, loja_id, pedido_numero, situacao):
+        registrada = self.memoria.consulta((loja_id, pedido_numero))
+        if registrada is not None and self.ordem(registrada) > self.ordem(situacao):
+            self.descartadas += 1
+            return True
+        return False
+
+    def registra(self, loja_id, pedido_numero, situacao):
+        chave = (loja_id, pedido_numero)
+        with self._trava:
+            registrada = self.memoria.consulta(chave)
+            if registrada is None or self.ordem(situacao) >= self.ordem(registrada):
+                self.memoria.define(chave, situacao)
+
+    def limpa(self):
+        self.memoria.limpa()
+        self.descartadas = 0
+
+    def estatisticas(self):
+        estatisticas = self.memoria.estatisticas()
+        estatisticas['descartadas'] = self.descartadas
+        return estatisticas
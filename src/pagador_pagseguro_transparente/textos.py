@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import re
+import threading
+from unicodedata import normalize
+
+from li_common.padroes.serializacao import Formatador
+
+TAMANHO_MEMO = 50000
+
+_NAO_ASCII = re.compile(u'[^\x00-\x7f]')
+_NAO_ASCII_BYTES = re.compile('[\x80-\xff]')
+
+
+class MemoLRU(object):
+    """
+    Memo aproximadamente LRU em duas gerações: as consultas não travam, e as entradas usadas desde a última troca
+    de geração sobrevivem a ela. Guarda no máximo tamanho_maximo entradas.
+    """
+    def __init__(self, tamanho_maximo=TAMANHO_MEMO):
+        self.tamanho_geracao = max(tamanho_maximo // 2, 1)
+        self._recentes = {}
+        self._antigas = {}
+        self._trava = threading.Lock()
+
+    def __len__(self):
+        return len(self._recentes) + len(self._antigas)
+
+    def consulta(self, chave):
+        valor = self._recentes.get(chave)
+        if valor is None:
+            valor = self._antigas.get(chave)
+            if valor is not None:
+                self.define(chave, valor)
+        return valor
+
+    def define(self, chave, valor):
+        with self._trava:
+            if len(self._recentes) >= self.tamanho_geracao:
+                self._antigas, self._recentes = self._recentes, {}
+            self._recentes[chave] = valor
+        return valor
+
+    def limpa(self):
+        with self._trava:
+            self._recentes = {}
+            self._antigas = {}
+
+
+MEMO = MemoLRU()
+
+
+def para_ascii(texto, limite=None):
+    """
+    Mesmo resultado do Formatador.trata_unicode_com_limite(texto, limite, ascii=True), mais rápido: texto que já é
+    ASCII só é cortado no limite, e a transliteração dos outros fica em MEMO por (texto, limite).
+    """
+    if isinstance(texto, str):
+        if _NAO_ASCII_BYTES.search(texto) is None:
+            return texto[:limite] if limite else texto
+        texto = texto.decode('utf-8')
+    elif isinstance(texto, unicode):
+        if _NAO_ASCII.search(texto) is None:
+            texto = str(texto)
+            return texto[:limite] if limite else texto
+    else:
+        return Formatador.trata_unicode_com_limite(texto, limite, ascii=True)
+    chave = (texto, limite)
+    resultado = MEMO.consulta(chave)
+    if resultado is None:
+        resultado = normalize('NFKD', texto).encode('ascii', 'ignore')
+        resultado = MEMO.define(chave, resultado[:limite] if limite else resultado)
+    return resultado
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Compara a latência (p50 e p99) das chamadas ao PagSeguro com e sem o pool de sessões keep-alive,
+usando um servidor HTTPS local que responde como o /v3/transactions.
+
+Precisa do openssl na linha de comando para gerar o certificado do servidor local.
+Uso: python -m tests.benchmarks.conexao
+"""
+import os
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from pagador_pagseguro_transparente import comunicacao
+
+CHAMADAS = 300
+RESPOSTA = '<?xml version="1.0" encoding="ISO-8859-1"?><transaction><code>9E884542-81B3-4419-9A75-BCC6FB495EF1</code><reference>1234</reference><status>3</status><grossAmount>49900.00</grossAmount></transaction>'
+
+
+class StubPagSeguro(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(RESPOSTA)))
+        self.end_headers()
+        self.wfile.write(RESPOSTA)
+
+    def log_message(self, *args):
+        pass
+
+
+class ServidorHTTPS(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+def gera_certificado(diretorio):
+    certificado = os.path.join(diretorio, 'localhost.pem')
+    subprocess.check_call([
+        'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=localhost',
+        '-addext', 'subjectAltName=DNS:localhost',
+        '-keyout', certificado, '-out', certificado
+    ], stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+    return certificado
+
+
+def inicia_servidor(certificado):
+    servidor = ServidorHTTPS(('localhost', 0), StubPagSeguro)
+    servidor.socket = ssl.wrap_socket(servidor.socket, certfile=certificado, server_side=True)
+    thread = threading.Thread(target=servidor.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return servidor
+
+
+def percentil(amostras, percentual):
+    ordenadas = sorted(amostras)
+    return ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * percentual / 100.0))]
+
+
+def mede(url, pool):
+    conexao = comunicacao.obtem_conexao(comunicacao.requisicao.Formato.querystring, comunicacao.requisicao.Formato.xml, pool=pool)
+    conexao.tenta_outra_vez = False
+    latencias = []
+    for _ in range(CHAMADAS):
+        inicio = time.time()
+        conexao.get(url, {'appId': 'app-id', 'appKey': 'app-key'})
+        latencias.append((time.time() - inicio) * 1000)
+    return percentil(latencias, 50), percentil(latencias, 99)
+
+
+def executa():
+    diretorio = tempfile.mkdtemp()
+    try:
+        certificado = gera_certificado(diretorio)
+        os.environ['REQUESTS_CA_BUNDLE'] = certificado
+        servidor = inicia_servidor(certificado)
+        url = 'https://localhost:{}/v3/transactions/9E884542-81B3-4419-9A75-BCC6FB495EF1'.format(servidor.server_address[1])
+        pool = comunicacao.PoolDeSessoes()
+        print('{:>10} | {:>10} | {:>10}'.format('', 'p50 (ms)', 'p99 (ms)'))
+        print('{:>10} | {:>10.2f} | {:>10.2f}'.format('sem pool', *mede(url, None)))
+        print('{:>10} | {:>10.2f} | {:>10.2f}'.format('com pool', *mede(url, pool)))
+        pool.fecha()
+        servidor.shutdown()
+    finally:
+        shutil.rmtree(diretorio)
+
+
+if __name__ == '__main__':
+    executa()
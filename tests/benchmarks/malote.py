@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Compara a codificação do corpo do checkout passando pelo dicionário (to_dict + urlencode, como o requests faz)
+com a codificação direta do Malote (to_form_urlencoded).
+Com tracemalloc (Python 3), as colunas de bytes são o pico de memória alocada por cada caminho. Sem ele (Python 2),
+não há como medir a alocação dos dois do mesmo jeito, e as colunas mostram só o tamanho do corpo gerado.
+
+Uso: python -m tests.benchmarks.malote
+"""
+import sys
+import timeit
+from decimal import Decimal
+from urllib import urlencode
+
+import tests  # noqa (configura as variáveis de ambiente do pagador)
+
+from pagador_pagseguro_transparente import entidades
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+TAMANHOS_CARRINHO = (1, 50, 500)
+REPETICOES = 200
+
+
+class Configuracao(object):
+    loja_id = 8
+
+
+class ItemSintetico(object):
+    def __init__(self, indice):
+        self.sku = 'PROD{:05d}'.format(indice)
+        self.nome = u'Produto de teste número {} com descrição longa'.format(indice)
+        self.quantidade = 1 + indice % 3
+        self.preco_venda = Decimal('19.90') + indice
+
+
+class PedidoSintetico(object):
+    def __init__(self, quantidade_itens):
+        self.numero = 1234
+        self.cliente_telefone = ('21', '999999999')
+        self.cliente_nome_ascii = 'Cliente Teste'
+        self.cliente = {'email': 'cliente+teste@email.com'}
+        self.forma_envio = 'sedex'
+        self.valor_envio = Decimal('14.00')
+        self.valor_desconto = Decimal('4.00')
+        self.endereco_entrega = {
+            'endereco': u'Rua São João', 'numero': '51', 'complemento': 'Bloco B', 'bairro': u'Botafogo',
+            'cep': '22290-000', 'cidade': 'Rio de Janeiro', 'estado': 'RJ'
+        }
+        self.itens = [ItemSintetico(indice) for indice in range(quantidade_itens)]
+
+
+def cria_malote(quantidade_itens):
+    malote = entidades.Malote(Configuracao())
+    malote.monta_conteudo(PedidoSintetico(quantidade_itens), {'app_id': 'app-id', 'app_secret': 'app-secret'}, {'next_url': 'url-next'})
+    return malote
+
+
+def via_dicionario(malote):
+    return urlencode(dict((chave, valor) for chave, valor in malote.to_dict().items() if valor is not None))
+
+
+def direto(malote):
+    return malote.to_form_urlencoded()
+
+
+def tempo_por_checkout(funcao, malote):
+    return min(timeit.repeat(lambda: funcao(malote), number=REPETICOES, repeat=3)) / REPETICOES
+
+
+def alocacao(funcao, malote):
+    """
+    Pico de memória alocada ao gerar o corpo, com tracemalloc; sem ele, o tamanho do corpo gerado.
+    """
+    if tracemalloc:
+        tracemalloc.start()
+        funcao(malote)
+        pico = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return pico
+    return sys.getsizeof(funcao(malote))
+
+
+def executa():
+    medida = 'pico' if tracemalloc else 'corpo'
+    print('{:>6} | {:>14} | {:>14} | {:>14} | {:>14}'.format(
+        'itens', 'dict (us)', 'direto (us)', 'dict {} (B)'.format(medida), 'direto {} (B)'.format(medida)
+    ))
+    for quantidade_itens in TAMANHOS_CARRINHO:
+        malote = cria_malote(quantidade_itens)
+        print('{:>6} | {:>14.1f} | {:>14.1f} | {:>14} | {:>14}'.format(
+            quantidade_itens,
+            tempo_por_checkout(via_dicionario, malote) * 1e6,
+            tempo_por_checkout(direto, malote) * 1e6,
+            alocacao(via_dicionario, malote),
+            alocacao(direto, malote),
+        ))
+
+
+if __name__ == '__main__':
+    executa()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Compara o leitor genérico de XML (Formatador.xml_para_dict) com o leitor incremental do PagSeguro
+(respostas.xml_para_dict) usando as respostas gravadas em tests/fixtures. A busca é ampliada até 1000 transações,
+o tamanho máximo de página.
+
+Uso: python -m tests.benchmarks.respostas
+"""
+import os
+import re
+import sys
+import timeit
+
+import tests  # noqa (configura as variáveis de ambiente do pagador)
+
+from li_common.padroes.serializacao import Formatador
+
+from pagador_pagseguro_transparente import respostas
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'fixtures')
+TRANSACOES_NA_BUSCA = 1000
+
+
+def fixture(nome):
+    with open(os.path.join(FIXTURES, nome)) as arquivo:
+        return arquivo.read()
+
+
+def busca_ampliada():
+    busca = fixture('busca.xml')
+    transacoes = re.findall(r'<transaction>.*?</transaction>', busca, re.S)
+    repetidas = ''.join(transacoes[indice % len(transacoes)] for indice in range(TRANSACOES_NA_BUSCA))
+    return re.sub(r'<transactions>.*</transactions>', '<transactions>{}</transactions>'.format(repetidas), busca, flags=re.S)
+
+
+def tamanho(valor):
+    if isinstance(valor, dict):
+        return sys.getsizeof(valor) + sum(tamanho(chave) + tamanho(item) for chave, item in valor.items())
+    if isinstance(valor, list):
+        return sys.getsizeof(valor) + sum(tamanho(item) for item in valor)
+    return sys.getsizeof(valor)
+
+
+def tempo(funcao, conteudo, repeticoes):
+    return min(timeit.repeat(lambda: funcao(conteudo), number=repeticoes, repeat=3)) / repeticoes
+
+
+def executa():
+    documentos = [
+        ('transacao', fixture('transacao.xml'), 2000),
+        ('busca 1000', busca_ampliada(), 5),
+        ('checkout', fixture('checkout.xml'), 2000),
+        ('erros', fixture('erros.xml'), 2000),
+    ]
+    print('{:>10} | {:>14} | {:>14} | {:>14} | {:>14}'.format('documento', 'generico (us)', 'pagseguro (us)', 'generico (B)', 'pagseguro (B)'))
+    for nome, conteudo, repeticoes in documentos:
+        print('{:>10} | {:>14.1f} | {:>14.1f} | {:>14} | {:>14}'.format(
+            nome,
+            tempo(Formatador.xml_para_dict, conteudo, repeticoes) * 1e6,
+            tempo(respostas.xml_para_dict, conteudo, repeticoes) * 1e6,
+            tamanho(Formatador.xml_para_dict(conteudo)),
+            tamanho(respostas.xml_para_dict(conteudo)),
+        ))
+
+
+if __name__ == '__main__':
+    executa()
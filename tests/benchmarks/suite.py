@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+Suite de benchmarks dos caminhos de checkout, retorno e notificação, sem acesso à rede: as respostas do PagSeguro
+vêm das gravações em tests/fixtures e os pedidos são sintéticos, de tamanhos diferentes.
+
+Cada caso roda num processo separado e mede operações por segundo, latência p50/p99 e pico de memória.
+Com --grava-baseline, o resultado é gravado como baseline (JSON); sem ele, a execução é comparada com o baseline e
+termina com erro se algum caso piorar mais que --limite. O baseline vale para a máquina em que foi gravado.
+
+Uso:
+    python -m tests.benchmarks.suite --grava-baseline
+    python -m tests.benchmarks.suite [--limite 0.25] [--casos malote]
+"""
+import argparse
+import gc
+import json
+import os
+import re
+import sys
+import timeit
+from contextlib import contextmanager
+
+import tests  # noqa (configura as variáveis de ambiente do pagador)
+
+from pagador_pagseguro_transparente import comunicacao, parcelamento, servicos
+from tests.benchmarks.malote import PedidoSintetico, cria_malote
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'fixtures')
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+LIMITE_REGRESSAO = 0.25
+MEMORIA_MINIMA_KB = 512
+TEMPO_POR_CASO = 1.0
+MINIMO_OPERACOES = 20
+MAXIMO_OPERACOES = 20000
+LOJA_ID = 8
+PARAMETROS = {'app_id': 'app-id', 'app_secret': 'app-secret'}
+
+
+def fixture(nome):
+    with open(os.path.join(FIXTURES, nome)) as arquivo:
+        return arquivo.read()
+
+
+def busca_com(quantidade):
+    busca = fixture('busca.xml')
+    transacoes = re.findall(r'<transaction>.*?</transaction>', busca, re.S)
+    repetidas = ''.join(transacoes[indice % len(transacoes)] for indice in range(quantidade))
+    return re.sub(r'<transactions>.*</transactions>', '<transactions>{}</transactions>'.format(repetidas), busca, flags=re.S)
+
+
+class Configuracao(object):
+    loja_id = LOJA_ID
+    aplicacao = 'pagseguro'
+    codigo_autorizacao = 'codigo-autorizacao'
+
+
+class RespostaGravada(object):
+    def __init__(self, conteudo, status_code=200):
+        self.content = conteudo
+        self.status_code = status_code
+
+
+class SessaoGravada(object):
+    def __init__(self, resposta):
+        self.resposta = resposta
+
+    def get(self, url, **kwargs):
+        return self.resposta
+
+    post = get
+
+
+class PoolGravado(object):
+    """
+    Pool de sessões que responde sempre a mesma gravação, no lugar do PagSeguro.
+    """
+    def __init__(self, conteudo, status_code=200):
+        self._sessao = SessaoGravada(RespostaGravada(conteudo, status_code))
+
+    @contextmanager
+    def sessao(self, url):
+        yield self._sessao
+
+
+def resposta_gravada(conteudo):
+    conexao = comunicacao.obtem_conexao(comunicacao.requisicao.Formato.querystring, comunicacao.requisicao.Formato.xml, pool=None, disjuntores=None)
+    return conexao._monta_resposta(RespostaGravada(conteudo))
+
+
+class PedidoPagamentoGravado(object):
+    transacao_id = None
+
+
+def prepara_malote_monta_conteudo(itens):
+    malote = cria_malote(itens)
+    pedido = PedidoSintetico(itens)
+    return lambda: malote.monta_conteudo(pedido, PARAMETROS, {'next_url': 'url-next'})
+
+
+def prepara_malote_to_dict(itens):
+    malote = cria_malote(itens)
+    return malote.to_dict
+
+
+def prepara_entrega(itens):
+    servicos.PARAMETROS_CONTRATO.define((LOJA_ID, 'pagseguro'), PARAMETROS)
+    pedido = PedidoSintetico(itens)
+    pool = PoolGravado(fixture('checkout.xml'))
+
+    def entrega():
+        entregador = servicos.EntregaPagamento(LOJA_ID, dados={'next_url': 'url-next'})
+        entregador.configuracao = Configuracao()
+        entregador.pedido = pedido
+        entregador.conexao.pool = pool
+        entregador.conexao.disjuntores = None
+        entregador.define_credenciais()
+        entregador.montar_malote()
+        entregador.envia_pagamento()
+        entregador.processa_dados_pagamento()
+        return entregador.resultado
+    return entrega
+
+
+def prepara_notificacao():
+    resposta = resposta_gravada(fixture('transacao.xml'))
+    pedidos_pagamento = {1234: PedidoPagamentoGravado()}
+
+    def notificacao():
+        registrador = servicos.RegistraNotificacao(LOJA_ID, dados={'notificationCode': 'codigo-notificacao'})
+        registrador.configuracao = Configuracao()
+        registrador.resposta = resposta
+        registrador.pedidos_pagamento = pedidos_pagamento
+        registrador.monta_dados_pagamento()
+        return registrador.resultado
+    return notificacao
+
+
+def prepara_busca(transacoes):
+    conteudo = busca_com(transacoes)
+    atualizador = servicos.AtualizaTransacoes(LOJA_ID, {'data_inicial': '2015-03-01T00:00'})
+
+    def busca():
+        atualizador.resposta = resposta_gravada(conteudo)
+        atualizador.analisa_resultado_transacoes()
+        return atualizador.dados_pedido
+    return busca
+
+
+def prepara_parcelamento(produtos):
+    calculadora = parcelamento.Parcelamento(maximo_parcelas=18, parcelas_sem_juros=3, valor_minimo_parcela='10.00')
+    precos = ['{}.{:02d}'.format(10 + indice * 7, indice % 100) for indice in range(produtos)]
+    return lambda: calculadora.tabela(precos)
+
+
+def prepara_xml_autorizacao():
+    redirect_url = 'http://localhost:5000/pagador/loja/8/meio-pagamento/pstransparente/instalar?next_url=url-next&fase_atual=2'
+    return lambda: servicos.xml_autorizacao(LOJA_ID, redirect_url)
+
+
+CASOS = [
+    ('malote.monta_conteudo[1]', lambda: prepara_malote_monta_conteudo(1)),
+    ('malote.monta_conteudo[50]', lambda: prepara_malote_monta_conteudo(50)),
+    ('malote.monta_conteudo[500]', lambda: prepara_malote_monta_conteudo(500)),
+    ('malote.to_dict[1]', lambda: prepara_malote_to_dict(1)),
+    ('malote.to_dict[50]', lambda: prepara_malote_to_dict(50)),
+    ('malote.to_dict[500]', lambda: prepara_malote_to_dict(500)),
+    ('entrega.ponta_a_ponta[1]', lambda: prepara_entrega(1)),
+    ('entrega.ponta_a_ponta[50]', lambda: prepara_entrega(50)),
+    ('notificacao.monta_dados_pagamento', prepara_notificacao),
+    ('transacoes.analisa_resultado[10]', lambda: prepara_busca(10)),
+    ('transacoes.analisa_resultado[1000]', lambda: prepara_busca(1000)),
+    ('parcelamento.tabela[500]', lambda: prepara_parcelamento(500)),
+    ('instalacao.xml_autorizacao', prepara_xml_autorizacao),
+]
+
+
+def percentil(amostras, percentual):
+    ordenadas = sorted(amostras)
+    return ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * percentual / 100.0))]
+
+
+def memoria_kb():
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def mede(preparo):
+    operacao = preparo()
+    operacao()
+    memoria_inicial = memoria_kb()
+    relogio = timeit.default_timer
+    latencias = []
+    gc.disable()
+    try:
+        inicio = relogio()
+        while len(latencias) < MAXIMO_OPERACOES and (len(latencias) < MINIMO_OPERACOES or relogio() - inicio < TEMPO_POR_CASO):
+            comeco = relogio()
+            operacao()
+            latencias.append(relogio() - comeco)
+        total = relogio() - inicio
+    finally:
+        gc.enable()
+    return {
+        'operacoes': len(latencias),
+        'ops_por_segundo': len(latencias) / total,
+        'p50_us': percentil(latencias, 50) * 1e6,
+        'p99_us': percentil(latencias, 99) * 1e6,
+        'memoria_pico_kb': memoria_kb() - memoria_inicial,
+    }
+
+
+def mede_em_processo_separado(preparo):
+    if not hasattr(os, 'fork'):
+        return mede(preparo)
+    leitura, escrita = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(leitura)
+        try:
+            resultado = json.dumps(mede(preparo))
+        except Exception as erro:
+            resultado = json.dumps({'erro': u'{}: {}'.format(erro.__class__.__name__, erro)})
+        with os.fdopen(escrita, 'w') as saida:
+            saida.write(resultado)
+        os._exit(0)
+    os.close(escrita)
+    with os.fdopen(leitura) as entrada:
+        resultado = json.loads(entrada.read() or '{"erro": "o processo do caso terminou sem resultado"}')
+    os.waitpid(pid, 0)
+    return resultado
+
+
+def regressoes(resultados, baseline, limite):
+    encontradas = []
+    for nome, resultado in sorted(resultados.items()):
+        anterior = baseline.get(nome)
+        if not anterior or 'erro' in resultado:
+            continue
+        if resultado['ops_por_segundo'] < anterior['ops_por_segundo'] * (1 - limite):
+            encontradas.append('{}: ops/s {:.1f} -> {:.1f}'.format(nome, anterior['ops_por_segundo'], resultado['ops_por_segundo']))
+        if resultado['p99_us'] > anterior['p99_us'] * (1 + limite):
+            encontradas.append('{}: p99 {:.1f}us -> {:.1f}us'.format(nome, anterior['p99_us'], resultado['p99_us']))
+        memoria = resultado['memoria_pico_kb']
+        if memoria > MEMORIA_MINIMA_KB and memoria > anterior['memoria_pico_kb'] * (1 + limite):
+            encontradas.append('{}: memoria {}KB -> {}KB'.format(nome, anterior['memoria_pico_kb'], memoria))
+    return encontradas
+
+
+def imprime(resultados):
+    print('{:<36} | {:>12} | {:>12} | {:>12} | {:>12}'.format('caso', 'ops/s', 'p50 (us)', 'p99 (us)', 'memoria (KB)'))
+    for nome, resultado in resultados:
+        if 'erro' in resultado:
+            print(u'{:<36} | {}'.format(nome, resultado['erro']))
+            continue
+        print('{:<36} | {:>12.1f} | {:>12.1f} | {:>12.1f} | {:>12}'.format(
+            nome, resultado['ops_por_segundo'], resultado['p50_us'], resultado['p99_us'], resultado['memoria_pico_kb']
+        ))
+
+
+def executa(argumentos=None):
+    parser = argparse.ArgumentParser(description=u'Benchmarks do pagador do PagSeguro Transparente')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--grava-baseline', action='store_true')
+    parser.add_argument('--limite', type=float, default=LIMITE_REGRESSAO)
+    parser.add_argument('--casos', default='', help=u'roda só os casos cujo nome contém este texto')
+    opcoes = parser.parse_args(argumentos)
+    resultados = [(nome, mede_em_processo_separado(preparo)) for nome, preparo in CASOS if opcoes.casos in nome]
+    imprime(resultados)
+    if opcoes.grava_baseline:
+        with open(opcoes.baseline, 'w') as arquivo:
+            json.dump(dict(resultados), arquivo, indent=2, sort_keys=True)
+        print(u'Baseline gravado em {}'.format(opcoes.baseline))
+        return 0
+    if not os.path.exists(opcoes.baseline):
+        print(u'Sem baseline em {}; rode com --grava-baseline para criar.'.format(opcoes.baseline))
+        return 0
+    with open(opcoes.baseline) as arquivo:
+        baseline = json.load(arquivo)
+    encontradas = regressoes(dict(resultados), baseline, opcoes.limite)
+    for regressao in encontradas:
+        print('REGRESSAO {}'.format(regressao))
+    falhas = [nome for nome, resultado in resultados if 'erro' in resultado]
+    return 1 if encontradas or falhas else 0
+
+
+if __name__ == '__main__':
+    sys.exit(executa())
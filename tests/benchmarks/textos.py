@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Compara a normalização dos textos do malote pelo Formatador.trata_unicode_com_limite com o textos.para_ascii,
+para textos já ASCII, textos acentuados repetidos (memo) e textos acentuados sempre novos.
+
+Uso: python -m tests.benchmarks.textos
+"""
+import timeit
+
+import tests  # noqa (configura as variáveis de ambiente do pagador)
+
+from li_common.padroes.serializacao import Formatador
+
+from pagador_pagseguro_transparente import textos
+
+REPETICOES = 20000
+
+CASOS = (
+    ('ascii (str)', lambda indice: 'Rio de Janeiro'),
+    ('ascii (unicode)', lambda indice: u'PROD00042'),
+    (u'acentuado repetido', lambda indice: u'Camiseta Básica de Algodão Orgânico - Tamanho M'),
+    (u'acentuado repetido (utf-8)', lambda indice: u'São João de Meriti'.encode('utf-8')),
+    (u'acentuado novo', lambda indice: u'Produto número {} com descrição'.format(indice)),
+)
+
+
+def tempo(funcao, gerador):
+    entradas = [gerador(indice) for indice in range(REPETICOES)]
+    textos.MEMO.limpa()
+    return min(timeit.repeat(lambda: [funcao(texto, 100) for texto in entradas], number=1, repeat=3)) / REPETICOES
+
+
+def atual(texto, limite):
+    return Formatador.trata_unicode_com_limite(texto, limite, ascii=True)
+
+
+def executa():
+    print('{:<28} | {:>12} | {:>12} | {:>8}'.format('texto', 'atual (us)', 'novo (us)', 'ganho'))
+    for nome, gerador in CASOS:
+        antes = tempo(atual, gerador)
+        depois = tempo(textos.para_ascii, gerador)
+        print(u'{:<28} | {:>12.2f} | {:>12.2f} | {:>7.1f}x'.format(nome, antes * 1e6, depois * 1e6, antes / depois))
+
+
+if __name__ == '__main__':
+    executa()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+import mock
+
+from pagador_pagseguro_transparente import assincrono, servicos
+
+ESPERA_PAGSEGURO = 0.2
+
+
+class StubPagSeguro(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(ESPERA_PAGSEGURO)
+        if self.path.startswith('/v3/transactions/notifications/'):
+            codigo = self.path.split('?')[0].rsplit('/', 1)[1]
+            corpo = '<transaction><code>{0}</code><reference>{1}</reference><status>3</status><grossAmount>10.00</grossAmount></transaction>'.format(codigo, codigo.split('-')[1])
+        else:
+            corpo = '<transactionSearchResult><transactions><transaction><reference>1</reference><status>3</status></transaction></transactions></transactionSearchResult>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+
+class ServidorStub(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 100
+
+
+class RegistraNotificacaoLocal(servicos.RegistraNotificacao):
+    url_local = None
+
+    @property
+    def url(self):
+        return '{}/v3/transactions/notifications/{}'.format(self.url_local, self.dados['notificationCode'])
+
+
+class ConsultaAssincrona(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.servidor = ServidorStub(('localhost', 0), StubPagSeguro)
+        cls.url = 'http://localhost:{}'.format(cls.servidor.server_address[1])
+        thread = threading.Thread(target=cls.servidor.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.shutdown()
+
+    def setUp(self):
+        servicos.PARAMETROS_CONTRATO.limpa()
+        servicos.NOTIFICACOES_PROCESSADAS.limpa()
+        self.parametros = mock.patch('pagador.entidades.ParametrosDeContrato')
+        self.parametros.start().return_value.obter_para.return_value = {'app_secret': 'app-secret', 'app_id': 'app-id'}
+
+    def tearDown(self):
+        self.parametros.stop()
+
+    def cria_notificacao(self, codigo):
+        registrador = RegistraNotificacaoLocal(8, dados={'notificationCode': codigo})
+        registrador.url_local = self.url
+        registrador.configuracao = mock.MagicMock(loja_id=8, aplicacao='pagseguro', codigo_autorizacao='autorizacao')
+        registrador.pedidos_pagamento = {int(codigo.split('-')[1]): mock.MagicMock(transacao_id=codigo)}
+        return registrador
+
+    def test_deve_consultar_notificacoes_em_paralelo(self):
+        registradores = [self.cria_notificacao('codigo-{}'.format(indice)) for indice in range(1, 21)]
+        inicio = time.time()
+        resultados = assincrono.consulta_todos(registradores, timeout=10)
+        (time.time() - inicio).should.be.lower_than(ESPERA_PAGSEGURO * 5)
+        [registrador.resultado['resultado'] for registrador in resultados].should.be.equal(['OK'] * 20)
+        resultados[4].situacao_pedido.should.be.equal(servicos.SituacoesDePagamento.do_tipo('3'))
+        resultados[4].pedido_numero.should.be.equal(5)
+
+    def test_deve_consultar_transacoes_e_analisar_resultado(self):
+        atualizador = servicos.AtualizaTransacoes(8, {'data_inicial': '2015-01-01T00:00'})
+        atualizador.configuracao = mock.MagicMock(aplicacao='pagseguro', codigo_autorizacao='autorizacao')
+        atualizador.url = '{}/v3/transactions'.format(self.url)
+        consulta = assincrono.consulta(atualizador)
+        consulta.aguarda(timeout=10).dados_pedido.should.be.equal({'situacao_pedido': servicos.SituacoesDePagamento.do_tipo('3'), 'pedido_numero': '1'})
+        consulta.pronta.should.be.truthy
+
+    def test_deve_analisar_resposta_uma_vez(self):
+        servico = mock.MagicMock(spec=servicos.AtualizaTransacoes)
+        consulta = assincrono.consulta(servico)
+        consulta.aguarda(timeout=10)
+        consulta.aguarda(timeout=10)
+        servico.consulta_transacoes.call_count.should.be.equal(1)
+        servico.analisa_resultado_transacoes.call_count.should.be.equal(1)
+
+    def test_deve_disparar_erro_da_consulta_ao_aguardar(self):
+        servico = mock.MagicMock(spec=servicos.RegistraResultado)
+        servico.obtem_informacoes_pagamento.side_effect = ValueError('falhou')
+        consulta = assincrono.consulta(servico)
+        consulta.aguarda.when.called_with(10).should.throw(ValueError, 'falhou')
+
+    def test_nao_deve_aceitar_servico_sem_consulta(self):
+        assincrono.consulta.when.called_with(mock.MagicMock(spec=servicos.EntregaPagamento)).should.throw(TypeError)
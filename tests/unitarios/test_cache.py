@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+
+import mock
+
+from pagador_pagseguro_transparente import cache
+
+
+class CacheTTL(unittest.TestCase):
+    def setUp(self):
+        self.agora = 1000.0
+        self.cache = cache.CacheTTL(10, tamanho_maximo=2, relogio=lambda: self.agora)
+
+    def test_deve_retornar_padrao_sem_entrada(self):
+        self.cache.consulta('chave', 'padrao').should.be.equal('padrao')
+
+    def test_deve_retornar_valor_definido(self):
+        self.cache.define('chave', 'valor')
+        self.cache.consulta('chave').should.be.equal('valor')
+
+    def test_deve_expirar_entrada_depois_do_tempo_de_vida(self):
+        self.cache.define('chave', 'valor')
+        self.agora += 10
+        self.cache.consulta('chave').should.be.none
+        len(self.cache).should.be.equal(0)
+
+    def test_deve_usar_tempo_de_vida_da_entrada(self):
+        self.cache.define('chave', 'valor', tempo_vida=60)
+        self.agora += 30
+        self.cache.consulta('chave').should.be.equal('valor')
+
+    def test_deve_descartar_menos_usado_ao_passar_do_tamanho(self):
+        self.cache.define('a', 1)
+        self.cache.define('b', 2)
+        self.cache.consulta('a')
+        self.cache.define('c', 3)
+        self.cache.consulta('b').should.be.none
+        self.cache.consulta('a').should.be.equal(1)
+        self.cache.consulta('c').should.be.equal(3)
+
+    def test_deve_carregar_apenas_na_falta(self):
+        carregador = mock.MagicMock(return_value='valor')
+        self.cache.obtem('chave', carregador).should.be.equal('valor')
+        self.cache.obtem('chave', carregador).should.be.equal('valor')
+        carregador.call_count.should.be.equal(1)
+
+    def test_deve_contar_acertos_e_faltas(self):
+        self.cache.obtem('chave', lambda: 'valor')
+        self.cache.obtem('chave', lambda: 'valor')
+        self.cache.estatisticas().should.be.equal({'acertos': 1, 'faltas': 1, 'itens': 1})
+
+    def test_deve_invalidar_chave(self):
+        self.cache.define('chave', 'valor')
+        self.cache.invalida('chave')
+        self.cache.consulta('chave').should.be.none
+
+    def test_deve_invalidar_por_condicao(self):
+        self.cache.define((1, 'a'), 'valor')
+        self.cache.define((2, 'a'), 'valor')
+        self.cache.invalida_onde(lambda chave: chave[0] == 1)
+        self.cache.consulta((1, 'a')).should.be.none
+        self.cache.consulta((2, 'a')).should.be.equal('valor')
+
+    def test_deve_limpar_entradas_e_contadores(self):
+        self.cache.obtem('chave', lambda: 'valor')
+        self.cache.limpa()
+        self.cache.estatisticas().should.be.equal({'acertos': 0, 'faltas': 0, 'itens': 0})
+
+
+class ChamadaUnica(unittest.TestCase):
+    def setUp(self):
+        self.chamadas = cache.ChamadaUnica()
+
+    def executa_em_paralelo(self, quantidade, funcao):
+        resultados = []
+        threads = [threading.Thread(target=lambda: resultados.append(self.chamadas.executa('chave', funcao))) for _ in range(quantidade)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return resultados
+
+    def test_deve_executar_uma_vez_para_chamadas_simultaneas(self):
+        funcao = mock.MagicMock(side_effect=lambda: time.sleep(0.1) or 'valor')
+        self.executa_em_paralelo(5, funcao).should.be.equal(['valor'] * 5)
+        funcao.call_count.should.be.equal(1)
+        self.chamadas.compartilhadas.should.be.equal(4)
+
+    def test_deve_executar_de_novo_depois_de_terminar(self):
+        funcao = mock.MagicMock(return_value='valor')
+        self.chamadas.executa('chave', funcao)
+        self.chamadas.executa('chave', funcao)
+        funcao.call_count.should.be.equal(2)
+
+    def test_deve_repassar_excecao_para_quem_esperava(self):
+        def falha():
+            time.sleep(0.1)
+            raise ValueError('erro')
+
+        erros = []
+
+        def chama():
+            try:
+                self.chamadas.executa('chave', falha)
+            except ValueError as erro:
+                erros.append(erro)
+
+        threads = [threading.Thread(target=chama) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        len(erros).should.be.equal(3)
+        len(set(id(erro) for erro in erros)).should.be.equal(1)
+        self.chamadas._em_andamento.should.be.empty
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+import unittest
+
+import mock
+
+from pagador_pagseguro_transparente import comunicacao
+
+
+class PoolFalso(object):
+    def __init__(self):
+        self.sessao_usada = mock.MagicMock()
+        self.urls = []
+
+    @contextmanager
+    def sessao(self, url):
+        self.urls.append(url)
+        yield self.sessao_usada
+
+
+class PagSeguroTransparenteConexao(unittest.TestCase):
+    def setUp(self):
+        comunicacao.resiliencia.DISJUNTORES.limpa()
+
+    def test_deve_obter_conexao_com_formatos(self):
+        conexao = comunicacao.obtem_conexao('application/x-www-form-urlencoded', 'application/xml')
+        conexao.should.be.a(comunicacao.Conexao)
+        conexao.formato_envio.should.be.equal('application/x-www-form-urlencoded')
+        conexao.formato_resposta.should.be.equal('application/xml')
+
+    def test_deve_usar_pool_do_processo_por_padrao(self):
+        comunicacao.obtem_conexao('application/x-www-form-urlencoded', 'application/xml').pool.should.be.equal(comunicacao.POOL)
+
+    @mock.patch('pagador_pagseguro_transparente.comunicacao.requisicao.Resposta')
+    def test_deve_enviar_corpo_ja_codificado_sem_recodificar(self, resposta_mock):
+        pool = PoolFalso()
+        conexao = comunicacao.obtem_conexao('application/x-www-form-urlencoded', 'application/xml', pool=pool)
+        conexao.post('http://url', 'appId=1&appKey=2').should.be.equal(resposta_mock.return_value)
+        pool.sessao_usada.post.assert_called_with('http://url', data='appId=1&appKey=2', headers=conexao.headers, timeout=comunicacao.requisicao.REQUEST_BASE_TIMEOUT)
+
+    @mock.patch('pagador_pagseguro_transparente.comunicacao.requisicao.Resposta', mock.MagicMock())
+    def test_deve_aceitar_corpo_iteravel(self):
+        pool = PoolFalso()
+        conexao = comunicacao.obtem_conexao('application/x-www-form-urlencoded', 'application/xml', pool=pool)
+        pedacos = iter(['appId=1', '&appKey=2'])
+        conexao.post('http://url', pedacos)
+        pool.sessao_usada.post.call_args[1]['data'].should.be.equal(pedacos)
+
+    @mock.patch('pagador_pagseguro_transparente.comunicacao.requisicao.Resposta', mock.MagicMock())
+    def test_deve_enviar_dicionario_como_formulario(self):
+        pool = PoolFalso()
+        conexao = comunicacao.obtem_conexao('application/x-www-form-urlencoded', 'application/xml', pool=pool)
+        conexao.post('http://url', {'appId': 1})
+        pool.sessao_usada.post.call_args[1]['data'].should.be.equal({'appId': 1})
+
+    @mock.patch('pagador_pagseguro_transparente.comunicacao.requisicao.Resposta', mock.MagicMock())
+    def test_deve_enviar_querystring_como_params(self):
+        pool = PoolFalso()
+        conexao = comunicacao.obtem_conexao('text/html', 'application/xml', pool=pool)
+        conexao.get('http://url', {'appId': 1})
+        pool.sessao_usada.get.call_args[1]['params'].should.be.equal({'appId': 1})
+
+    @mock.patch('pagador_pagseguro_transparente.comunicacao.requisicao.Resposta', mock.MagicMock())
+    def test_deve_enviar_xml_como_esta(self):
+        pool = PoolFalso()
+        conexao = comunicacao.obtem_conexao('application/xml', 'application/xml', pool=pool)
+        conexao.post('http://url', '<xml/>')
+        pool.sessao_usada.post.call_args[1]['data'].should.be.equal('<xml/>')
+
+    @mock.patch('pagador_pagseguro_transparente.comunicacao.requisicao.Resposta', mock.MagicMock())
+    def test_deve_adicionar_credenciais_na_url(self):
+        pool = PoolFalso()
+        conexao = comunicacao.obtem_conexao('application/x-www-form-urlencoded', 'application/xml', pool=pool)
+        conexao.credenciador = mock.MagicMock(tipo=comunicacao.requisicao.Credenciador.TipoAutenticacao.query_string)
+        conexao.credenciador.define_autenticacao.return_value = 'authorizationCode=codigo'
+        conexao.post('http://url', 'appId=1')
+        pool.urls.should.be.equal(['http://url?authorizationCode=codigo'])
+
+    @mock.patch('pagador_pagseguro_transparente.comunicacao.requisicao.Resposta', mock.MagicMock())
+    @mock.patch('pagador_pagseguro_transparente.comunicacao.requests')
+    def test_deve_chamar_requests_direto_sem_pool(self, requests_mock):
+        conexao = comunicacao.obtem_conexao('application/x-www-form-urlencoded', 'application/xml', pool=None)
+        conexao.post('http://url', 'appId=1')
+        requests_mock.post.assert_called_with('http://url', data='appId=1', headers=conexao.headers, timeout=comunicacao.requisicao.REQUEST_BASE_TIMEOUT)
+
+    def test_deve_ler_resposta_xml_com_leitor_do_pagseguro(self):
+        pool = PoolFalso()
+        pool.sessao_usada.get.return_value = mock.MagicMock(status_code=200, content='<transaction><code>C1</code><status>3</status><sender><name>X</name></sender></transaction>')
+        conexao = comunicacao.obtem_conexao('text/html', 'application/xml', pool=pool)
+        resposta = conexao.get('http://url', {'appId': 1})
+        resposta.sucesso.should.be.truthy
+        resposta.conteudo.should.be.equal({'transaction': {'code': 'C1', 'status': '3'}})
+        resposta.corpo.should.be.equal('<transaction><code>C1</code><status>3</status><sender><name>X</name></sender></transaction>')
+
+    def test_deve_ler_resposta_json_com_resposta_padrao(self):
+        pool = PoolFalso()
+        pool.sessao_usada.get.return_value = mock.MagicMock(status_code=200, content='{"id": 1}')
+        conexao = comunicacao.obtem_conexao('text/html', 'application/json', pool=pool)
+        conexao.get('http://url', {'appId': 1}).conteudo.should.be.equal({'id': 1})
+
+    def test_deve_usar_disjuntores_do_processo_por_padrao(self):
+        comunicacao.obtem_conexao('text/html', 'application/xml').disjuntores.should.be.equal(comunicacao.resiliencia.DISJUNTORES)
+
+    def test_nao_deve_chamar_pagseguro_com_disjuntor_aberto(self):
+        pool = PoolFalso()
+        disjuntores = mock.MagicMock()
+        disjuntores.do_host.return_value.permite.return_value = False
+        conexao = comunicacao.obtem_conexao('text/html', 'application/xml', pool=pool, disjuntores=disjuntores)
+        resposta = conexao.get('https://ws.pagseguro.uol.com.br/v3/transactions', {'appId': 1})
+        resposta.sucesso.should.be.falsy
+        resposta.erro_servidor.should.be.truthy
+        resposta.conteudo.should.be.equal({})
+        pool.urls.should.be.equal([])
+        disjuntores.do_host.assert_called_with('https://ws.pagseguro.uol.com.br/v3/transactions')
+
+    def test_nao_deve_repetir_com_disjuntor_aberto(self):
+        pool = PoolFalso()
+        disjuntores = mock.MagicMock()
+        disjuntores.do_host.return_value.permite.return_value = False
+        politica = comunicacao.resiliencia.PoliticaDeTentativas(dorme=mock.MagicMock())
+        conexao = comunicacao.obtem_conexao('text/html', 'application/xml', pool=pool, disjuntores=disjuntores, politica=politica)
+        conexao.post('https://ws.pagseguro.uol.com.br/v2/transactions', 'malote').status_code.should.be.equal(503)
+        disjuntores.do_host.return_value.permite.call_count.should.be.equal(1)
+        politica.dorme.called.should.be.falsy
+
+    def test_deve_registrar_resultado_da_chamada_no_disjuntor(self):
+        pool = PoolFalso()
+        pool.sessao_usada.get.return_value = mock.MagicMock(status_code=500, content='')
+        disjuntores = mock.MagicMock()
+        conexao = comunicacao.obtem_conexao('text/html', 'application/xml', pool=pool, disjuntores=disjuntores)
+        conexao.get('https://ws.pagseguro.uol.com.br/v3/transactions', {'appId': 1})
+        disjuntores.do_host.return_value.registra.call_args[0][0].should.be.falsy
+
+    def test_deve_registrar_erro_de_conexao_no_disjuntor(self):
+        pool = PoolFalso()
+        pool.sessao_usada.get.side_effect = ValueError('falhou')
+        disjuntores = mock.MagicMock()
+        conexao = comunicacao.obtem_conexao('text/html', 'application/xml', pool=pool, disjuntores=disjuntores)
+        conexao.tenta_outra_vez = False
+        conexao.get.when.called_with('https://ws.pagseguro.uol.com.br/v3/transactions', {'appId': 1}).should.throw(ValueError)
+        disjuntores.do_host.return_value.registra.call_args[0][0].should.be.falsy
+
+
+    def test_deve_repetir_com_politica_e_anotar_tentativas(self):
+        pool = PoolFalso()
+        pool.sessao_usada.get.side_effect = [mock.MagicMock(status_code=503, content=''), mock.MagicMock(status_code=200, content='<checkout><code>C</code></checkout>')]
+        politica = comunicacao.resiliencia.PoliticaDeTentativas(dorme=lambda segundos: None)
+        conexao = comunicacao.obtem_conexao('text/html', 'application/xml', pool=pool, disjuntores=None, politica=politica)
+        conexao.get('https://ws.pagseguro.uol.com.br/v3/transactions', {'appId': 1}).conteudo.should.be.equal({'checkout': {'code': 'C'}})
+        [(tentativa['tentativa'], tentativa['status_code']) for tentativa in conexao.tentativas].should.be.equal([(1, 503), (2, 200)])
+
+    @mock.patch('pagador_pagseguro_transparente.comunicacao.requisicao.Resposta', mock.MagicMock())
+    def test_deve_usar_repeticao_padrao_sem_politica(self):
+        pool = PoolFalso()
+        conexao = comunicacao.obtem_conexao('text/html', 'application/json', pool=pool, disjuntores=None)
+        conexao.get('https://ws.pagseguro.uol.com.br/v3/transactions', {'appId': 1})
+        conexao.tentativas.should.be.equal([])
+        pool.sessao_usada.get.call_count.should.be.equal(1)
+
+
+class PagSeguroTransparentePoolDeSessoes(unittest.TestCase):
+    def setUp(self):
+        self.agora = 1000.0
+        self.pool = comunicacao.PoolDeSessoes(maximo_por_host=2, tempo_maximo_ocioso=60, relogio=lambda: self.agora)
+        self.pool.cria_sessao = mock.MagicMock(side_effect=lambda: mock.MagicMock())
+
+    def test_nao_deve_guardar_cookies_na_sessao_compartilhada(self):
+        sessao = comunicacao.PoolDeSessoes().cria_sessao()
+        pedido = comunicacao.requests.cookies.MockRequest(comunicacao.requests.Request('GET', 'https://ws.pagseguro.uol.com.br/v3/transactions').prepare())
+        cookie = comunicacao.requests.cookies.create_cookie('AWSALB', 'loja-8', domain='ws.pagseguro.uol.com.br')
+        sessao.cookies.set_cookie_if_ok(cookie, pedido)
+        len(sessao.cookies).should.be.equal(0)
+
+    def test_deve_criar_sessao_quando_nao_tiver_ociosa(self):
+        self.pool.pega('ws.pagseguro.uol.com.br')
+        self.pool.cria_sessao.called.should.be.truthy
+        self.pool.estatisticas().should.be.equal({'criadas': 1, 'reaproveitadas': 0, 'ociosas': 0})
+
+    def test_deve_reaproveitar_sessao_devolvida_do_mesmo_host(self):
+        with self.pool.sessao('https://ws.pagseguro.uol.com.br/v2/transactions') as sessao:
+            pass
+        with self.pool.sessao('https://ws.pagseguro.uol.com.br/v3/transactions') as outra:
+            outra.should.be.equal(sessao)
+        self.pool.estatisticas().should.be.equal({'criadas': 1, 'reaproveitadas': 1, 'ociosas': 1})
+
+    def test_nao_deve_compartilhar_sessao_entre_hosts(self):
+        with self.pool.sessao('https://ws.pagseguro.uol.com.br/v2/transactions') as sessao:
+            pass
+        with self.pool.sessao('https://ws.sandbox.pagseguro.uol.com.br/v2/transactions') as outra:
+            outra.should_not.be.equal(sessao)
+
+    def test_deve_fechar_sessao_que_passar_do_limite_por_host(self):
+        sessoes = [self.pool.pega('host') for _ in range(3)]
+        for sessao in sessoes:
+            self.pool.devolve('host', sessao)
+        self.pool.estatisticas()['ociosas'].should.be.equal(2)
+        sessoes[2].close.called.should.be.truthy
+
+    def test_deve_fechar_sessoes_ociosas_demais(self):
+        sessao = self.pool.pega('host')
+        self.pool.devolve('host', sessao)
+        self.agora += 61
+        self.pool.pega('host').should_not.be.equal(sessao)
+        sessao.close.called.should.be.truthy
+
+    def test_deve_fechar_sessao_se_der_erro_no_uso(self):
+        try:
+            with self.pool.sessao('https://host/url') as sessao:
+                raise ValueError('erro')
+        except ValueError:
+            pass
+        sessao.close.called.should.be.truthy
+        self.pool.estatisticas()['ociosas'].should.be.equal(0)
+
+    def test_deve_fechar_todas_as_sessoes(self):
+        sessao = self.pool.pega('host')
+        self.pool.devolve('host', sessao)
+        self.pool.fecha()
+        sessao.close.called.should.be.truthy
+        self.pool.estatisticas()['ociosas'].should.be.equal(0)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+
+from pagador_pagseguro_transparente import conciliacao
+
+
+class LimitadorDeTaxa(unittest.TestCase):
+    def setUp(self):
+        self.agora = 100.0
+        self.esperas = []
+        self.limitador = conciliacao.LimitadorDeTaxa(2, relogio=lambda: self.agora, dorme=self.dorme)
+
+    def dorme(self, segundos):
+        self.esperas.append(segundos)
+        self.agora += segundos
+
+    def test_deve_liberar_rajada_sem_esperar(self):
+        self.limitador.aguarda()
+        self.limitador.aguarda()
+        self.esperas.should.be.equal([])
+
+    def test_deve_esperar_quando_acabar_as_fichas(self):
+        for _ in range(3):
+            self.limitador.aguarda()
+        self.esperas.should.be.equal([0.5])
+
+    def test_deve_segurar_todos_quando_penalizado(self):
+        self.limitador.penaliza(5)
+        self.limitador.aguarda()
+        self.esperas[0].should.be.equal(5)
+
+
+class LimiteDeHosts(unittest.TestCase):
+    def test_deve_limitar_requisicoes_simultaneas_por_host(self):
+        limite = conciliacao.LimiteDeHosts(2)
+        abertas = []
+        maximo = []
+        trava = threading.Lock()
+
+        def requisicao():
+            with limite.ocupa('https://ws.pagseguro.uol.com.br/v3/transactions'):
+                with trava:
+                    abertas.append(1)
+                    maximo.append(len(abertas))
+                time.sleep(0.02)
+                with trava:
+                    abertas.pop()
+
+        threads = [threading.Thread(target=requisicao) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        max(maximo).should.be.equal(2)
+
+    def test_nao_deve_dividir_limite_entre_hosts(self):
+        limite = conciliacao.LimiteDeHosts(1)
+        with limite.ocupa('https://ws.pagseguro.uol.com.br/v3/transactions'):
+            with limite.ocupa('https://ws.sandbox.pagseguro.uol.com.br/v3/transactions'):
+                pass
+
+
+class Checkpoint(unittest.TestCase):
+    def setUp(self):
+        self.diretorio = tempfile.mkdtemp()
+        self.caminho = os.path.join(self.diretorio, 'conciliacao.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.diretorio)
+
+    def test_deve_retomar_lojas_concluidas(self):
+        checkpoint = conciliacao.Checkpoint(self.caminho)
+        checkpoint.marca(8, transacoes=3, erro=None)
+        checkpoint.marca(9, transacoes=0, erro={'errors': {}})
+        retomado = conciliacao.Checkpoint(self.caminho)
+        retomado.concluida(8).should.be.truthy
+        retomado.concluida(9).should.be.falsy
+        retomado.concluida(10).should.be.falsy
+
+    def test_deve_ignorar_linha_incompleta(self):
+        with open(self.caminho, 'w') as arquivo:
+            arquivo.write('{"loja_id": 8, "erro": null}\n{"loja_id": 9, "er')
+        conciliacao.Checkpoint(self.caminho).concluida(8).should.be.truthy
+
+
+def cria_servico(transacoes=(), erros=None, erro_busca=None):
+    servico = mock.MagicMock(erros=erros)
+    if erro_busca:
+        servico.itera_transacoes.side_effect = erro_busca
+    else:
+        servico.itera_transacoes.return_value = iter(transacoes)
+    return servico
+
+
+class ConciliaTransacoes(unittest.TestCase):
+    def setUp(self):
+        self.servicos = {}
+        self.atualizados = []
+        self.conciliacao = conciliacao.ConciliaTransacoes('2015-01-01T00:00', '2015-02-10T00:00', concorrencia=3, requisicoes_por_segundo=1000, ao_atualizar=lambda loja_id, dados: self.atualizados.append((loja_id, dados)))
+        self.conciliacao.cria_servico = lambda loja_id: self.servicos[loja_id]
+
+    @mock.patch('pagador_pagseguro_transparente.conciliacao.servicos.AtualizaTransacoes.__init__', mock.MagicMock(return_value=None))
+    def test_deve_criar_servico_com_periodo(self):
+        concilia = conciliacao.ConciliaTransacoes('2015-01-01T00:00', '2015-02-10T00:00')
+        servico = concilia.cria_servico(8)
+        servico.should.be.a(conciliacao.servicos.AtualizaTransacoes)
+        servico.conciliacao.should.be.equal(concilia)
+        conciliacao.servicos.AtualizaTransacoes.__init__.assert_called_with(8, {'data_inicial': '2015-01-01T00:00', 'data_final': '2015-02-10T00:00'})
+
+    def test_deve_entregar_transacoes_de_todas_as_lojas(self):
+        self.servicos[8] = cria_servico([{'pedido_numero': '1'}, {'pedido_numero': '2'}])
+        self.servicos[9] = cria_servico([{'pedido_numero': '3'}])
+        estatisticas = self.conciliacao.executa([8, 9])
+        sorted(self.atualizados).should.be.equal([(8, {'pedido_numero': '1'}), (8, {'pedido_numero': '2'}), (9, {'pedido_numero': '3'})])
+        estatisticas['lojas'].should.be.equal(2)
+        estatisticas['transacoes'].should.be.equal(3)
+        self.servicos[8].define_credenciais.called.should.be.truthy
+
+    def test_deve_guardar_erros_sem_parar_as_outras_lojas(self):
+        self.servicos[8] = cria_servico(erro_busca=ValueError('falhou'))
+        self.servicos[9] = cria_servico([], erros={'errors': {'error': {'code': '53110'}}})
+        self.servicos[10] = cria_servico([{'pedido_numero': '3'}])
+        estatisticas = self.conciliacao.executa([8, 9, 10])
+        self.conciliacao.erros.should.be.equal({8: u'ValueError: falhou', 9: {'errors': {'error': {'code': '53110'}}}})
+        estatisticas['lojas_com_erro'].should.be.equal(2)
+        self.atualizados.should.be.equal([(10, {'pedido_numero': '3'})])
+
+    def test_deve_pular_lojas_do_checkpoint(self):
+        self.conciliacao.checkpoint = mock.MagicMock()
+        self.conciliacao.checkpoint.concluida.side_effect = lambda loja_id: loja_id == 8
+        self.servicos[9] = cria_servico([{'pedido_numero': '3'}])
+        estatisticas = self.conciliacao.executa([8, 9])
+        estatisticas['lojas_puladas'].should.be.equal(1)
+        self.conciliacao.checkpoint.marca.assert_called_once_with(9, transacoes=1, erro=None)
+
+    def test_deve_contar_paginas(self):
+        self.conciliacao.consulta_pagina('https://ws.pagseguro.uol.com.br/v3/transactions', lambda: mock.MagicMock(status_code=200))
+        self.conciliacao.estatisticas.como_dict()['paginas'].should.be.equal(1)
+
+    def test_deve_pedir_pagina_de_novo_quando_limite_excedido(self):
+        self.conciliacao.limitador = mock.MagicMock()
+        respostas = iter([mock.MagicMock(status_code=429), mock.MagicMock(status_code=200)])
+        resposta = self.conciliacao.consulta_pagina('https://ws.pagseguro.uol.com.br/v3/transactions', lambda: next(respostas))
+        resposta.status_code.should.be.equal(200)
+        self.conciliacao.limitador.penaliza.assert_called_once_with(conciliacao.ESPERA_LIMITE_EXCEDIDO)
+        self.conciliacao.estatisticas.como_dict()['limite_excedido'].should.be.equal(1)
+
+    def test_deve_desistir_depois_das_tentativas(self):
+        self.conciliacao.limitador = mock.MagicMock()
+        resposta = self.conciliacao.consulta_pagina('https://host/v3/transactions', lambda: mock.MagicMock(status_code=429))
+        resposta.status_code.should.be.equal(429)
+        self.conciliacao.limitador.penaliza.call_count.should.be.equal(conciliacao.TENTATIVAS_LIMITE_EXCEDIDO)
+
+    @mock.patch('pagador_pagseguro_transparente.conciliacao.servicos.AtualizaTransacoes._consulta_pagina')
+    @mock.patch('pagador_pagseguro_transparente.conciliacao.servicos.AtualizaTransacoes.__init__', mock.MagicMock(return_value=None))
+    def test_servico_deve_passar_pagina_pela_conciliacao(self, consulta_mock):
+        concilia = conciliacao.ConciliaTransacoes('2015-01-01T00:00')
+        servico = concilia.cria_servico(8)
+        servico.url = 'https://ws.pagseguro.uol.com.br/v3/transactions'
+        consulta_mock.return_value = mock.MagicMock(status_code=200)
+        servico._consulta_pagina({'appId': 'app-id'}, 2).should.be.equal(consulta_mock.return_value)
+        consulta_mock.assert_called_with({'appId': 'app-id'}, 2)
+        concilia.estatisticas.como_dict()['paginas'].should.be.equal(1)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+
+import mock
+
+from pagador_pagseguro_transparente import consultas
+
+
+class ConsultasCompartilhadas(unittest.TestCase):
+    def setUp(self):
+        self.agora = 1000.0
+        self.consultas = consultas.ConsultasCompartilhadas(tempo_vida=5, relogio=lambda: self.agora)
+
+    def test_deve_fazer_uma_requisicao_para_consultas_simultaneas(self):
+        resposta = mock.MagicMock(sucesso=True)
+        funcao = mock.MagicMock(side_effect=lambda: time.sleep(0.1) or resposta)
+        respostas = []
+        threads = [threading.Thread(target=lambda: respostas.append(self.consultas.consulta((8, 'url'), funcao))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        respostas.should.be.equal([resposta] * 5)
+        funcao.call_count.should.be.equal(1)
+        self.consultas.estatisticas()['compartilhadas'].should.be.equal(4)
+
+    def test_deve_guardar_resposta_com_sucesso_pelo_tempo_de_vida(self):
+        funcao = mock.MagicMock(return_value=mock.MagicMock(sucesso=True))
+        self.consultas.consulta((8, 'url'), funcao)
+        self.agora += 4
+        self.consultas.consulta((8, 'url'), funcao)
+        funcao.call_count.should.be.equal(1)
+        self.agora += 2
+        self.consultas.consulta((8, 'url'), funcao)
+        funcao.call_count.should.be.equal(2)
+        self.consultas.estatisticas()['consultas'].should.be.equal(2)
+
+    def test_nao_deve_guardar_resposta_sem_sucesso(self):
+        funcao = mock.MagicMock(return_value=mock.MagicMock(sucesso=False))
+        self.consultas.consulta((8, 'url'), funcao)
+        self.consultas.consulta((8, 'url'), funcao)
+        funcao.call_count.should.be.equal(2)
+
+    def test_deve_separar_por_chave(self):
+        funcao = mock.MagicMock(return_value=mock.MagicMock(sucesso=True))
+        self.consultas.consulta((8, 'url'), funcao)
+        self.consultas.consulta((9, 'url'), funcao)
+        funcao.call_count.should.be.equal(2)
+
+    def test_deve_usar_resposta_guardada_por_outra_consulta(self):
+        resposta = mock.MagicMock(sucesso=True)
+        self.consultas.guarda((8, 'url'), resposta)
+        funcao = mock.MagicMock()
+        self.consultas.consulta((8, 'url'), funcao).should.be(resposta)
+        funcao.called.should.be.falsy
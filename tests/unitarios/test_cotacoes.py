@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from decimal import Decimal
+from SocketServer import ThreadingMixIn
+from urlparse import parse_qs, urlparse
+
+import mock
+
+from pagador_pagseguro_transparente import comunicacao, cotacoes, resiliencia
+
+PARAMETROS = {'app_id': 'app-id', 'app_secret': 'app-secret'}
+
+
+class StubParcelamento(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    consultas = []
+    espera = 0
+
+    def do_GET(self):
+        time.sleep(self.espera)
+        url = urlparse(self.path)
+        parametros = dict((chave, valores[0]) for chave, valores in parse_qs(url.query).items())
+        StubParcelamento.consultas.append(parametros)
+        if url.path != '/v2/installments' or parametros['cardBrand'] == 'invalida':
+            status, corpo = 400, '<errors><error><code>53015</code><message>invalid card brand</message></error></errors>'
+        else:
+            valor = Decimal(parametros['amount'])
+            corpo = (
+                '<installments>'
+                '<installment><cardBrand>{0}</cardBrand><quantity>1</quantity><amount>{1}</amount><totalAmount>{1}</totalAmount><interestFree>true</interestFree></installment>'
+                '<installment><cardBrand>{0}</cardBrand><quantity>2</quantity><amount>{2}</amount><totalAmount>{3}</totalAmount><interestFree>false</interestFree></installment>'
+                '</installments>'
+            ).format(parametros['cardBrand'], valor, (valor * Decimal('0.515')).quantize(Decimal('0.01')), (valor * Decimal('1.03')).quantize(Decimal('0.01')))
+            status = 200
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+
+class ServidorStub(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class CotacoesDeParcelamento(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.servidor = ServidorStub(('localhost', 0), StubParcelamento)
+        cls.url = 'http://localhost:{}/v2/installments'.format(cls.servidor.server_address[1])
+        thread = threading.Thread(target=cls.servidor.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        comunicacao.POOL.fecha()
+        cls.servidor.shutdown()
+
+    def setUp(self):
+        resiliencia.DISJUNTORES.limpa()
+        StubParcelamento.consultas = []
+        StubParcelamento.espera = 0
+        self.agora = 1000.0
+        self.cotacoes = cotacoes.CotacoesDeParcelamento(tempo_vida=60, tamanho_maximo=3, url=self.url, relogio=lambda: self.agora)
+        self.configuracao = mock.MagicMock(loja_id=8, aplicacao='pagseguro', codigo_autorizacao='autorizacao', parcelas_sem_juros='3')
+
+    def test_deve_consultar_parcelamento_no_pagseguro(self):
+        parcelas = self.cotacoes.cotacao(self.configuracao, PARAMETROS, 'visa', Decimal('100.00'))
+        [(parcela.quantidade, parcela.valor, parcela.total, parcela.sem_juros) for parcela in parcelas].should.be.equal([
+            (1, Decimal('100.00'), Decimal('100.00'), True), (2, Decimal('51.50'), Decimal('103.00'), False)
+        ])
+        StubParcelamento.consultas.should.be.equal([{
+            'amount': '100.00', 'cardBrand': 'visa', 'maxInstallmentNoInterest': '3',
+            'appId': 'app-id', 'appKey': 'app-secret', 'authorizationCode': 'autorizacao'
+        }])
+
+    def test_nao_deve_enviar_parcelas_sem_juros_quando_nao_tem(self):
+        self.cotacoes.cotacao(self.configuracao, PARAMETROS, 'visa', '100', parcelas_sem_juros=1)
+        StubParcelamento.consultas[0].should_not.have.key('maxInstallmentNoInterest')
+
+    def test_deve_usar_cache_por_aplicacao_bandeira_valor_e_parcelas_sem_juros(self):
+        self.cotacoes.cotacao(self.configuracao, PARAMETROS, 'visa', Decimal('100.00'))
+        self.cotacoes.cotacao(self.configuracao, PARAMETROS, 'visa', '100.0')
+        len(StubParcelamento.consultas).should.be.equal(1)
+        self.cotacoes.cotacao(self.configuracao, PARAMETROS, 'mastercard', Decimal('100.00'))
+        self.cotacoes.cotacao(self.configuracao, PARAMETROS, 'visa', Decimal('100.00'), parcelas_sem_juros=2)
+        self.configuracao.aplicacao = 'pagseguro-alternativo'
+        self.cotacoes.cotacao(self.configuracao, PARAMETROS, 'visa', Decimal('100.00'))
+        len(StubParcelamento.consultas).should.be.equal(4)
+
+    def test_deve_consultar_de_novo_depois_do_tempo_de_vida(self):
+        self.cotacoes.cotacao(self.configuracao, PARAMETROS, 'visa', Decimal('100.00'))
+        self.agora += 61
+        self.cotacoes.cotacao(self.configuracao, PARAMETROS, 'visa', Decimal('100.00'))
+        len(StubParcelamento.consultas).should.be.equal(2)
+
+    def test_deve_descartar_cotacao_menos_usada(self):
+        for valor in ('10.00', '20.00', '30.00', '40.00'):
+            self.cotacoes.cotacao(self.configuracao, PARAMETROS, 'visa', valor)
+        self.cotacoes.cotacao(self.configuracao, PARAMETROS, 'visa', '10.00')
+        len(StubParcelamento.consultas).should.be.equal(5)
+        self.cotacoes.estatisticas()['itens'].should.be.equal(3)
+
+    def test_deve_juntar_consultas_simultaneas_da_mesma_cotacao(self):
+        StubParcelamento.espera = 0.2
+        resultados = []
+        threads = [
+            threading.Thread(target=lambda: resultados.append(self.cotacoes.cotacao(self.configuracao, PARAMETROS, 'visa', '100.00')))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        len(StubParcelamento.consultas).should.be.equal(1)
+        len(set(id(resultado) for resultado in resultados)).should.be.equal(1)
+        self.cotacoes.estatisticas()['compartilhadas'].should.be.equal(4)
+
+    def test_nao_deve_guardar_falha_em_cache(self):
+        self.cotacoes.cotacao.when.called_with(self.configuracao, PARAMETROS, 'invalida', '100.00').should.throw(cotacoes.CotacaoIndisponivel)
+        self.cotacoes.cotacao.when.called_with(self.configuracao, PARAMETROS, 'invalida', '100.00').should.throw(cotacoes.CotacaoIndisponivel)
+        len(StubParcelamento.consultas).should.be.equal(2)
+
+    def test_deve_aquecer_cache_com_valores_comuns_em_todas_as_bandeiras(self):
+        falhas = self.cotacoes.aquece(self.configuracao, PARAMETROS, valores=['49.90'], bandeiras=['visa', 'amex', 'invalida'])
+        falhas.keys().should.be.equal([('pagseguro', 'invalida', 4990, 3)])
+        self.cotacoes.cotacao(self.configuracao, PARAMETROS, 'amex', '49.90')
+        len(StubParcelamento.consultas).should.be.equal(3)
+
+    def test_deve_usar_bandeiras_aceitas_pela_configuracao(self):
+        cotacoes.BANDEIRAS.should.be.equal(('visa', 'mastercard', 'hipercard', 'amex'))
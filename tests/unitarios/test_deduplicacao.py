@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from pagador_pagseguro_transparente import deduplicacao
+
+RESULTADO = {'resultado': 'OK', 'detalhes': [u'Pedido não tem transacao_id (None)']}
+
+
+class BackendSQLite(unittest.TestCase):
+    def setUp(self):
+        self.agora = 1000.0
+        self.diretorio = tempfile.mkdtemp()
+        self.caminho = os.path.join(self.diretorio, 'notificacoes.db')
+        self.backend = deduplicacao.BackendSQLite(self.caminho, retencao=60, relogio=lambda: self.agora)
+
+    def tearDown(self):
+        self.backend.fecha()
+        shutil.rmtree(self.diretorio)
+
+    def test_deve_guardar_resultado(self):
+        self.backend.registra(u'8:codigo', RESULTADO)
+        self.backend.consulta(u'8:codigo').should.be.equal(RESULTADO)
+        self.backend.consulta(u'8:outro').should.be.none
+
+    def test_deve_compartilhar_entre_conexoes(self):
+        self.backend.registra(u'8:codigo', RESULTADO)
+        outro = deduplicacao.BackendSQLite(self.caminho, relogio=lambda: self.agora)
+        outro.consulta(u'8:codigo').should.be.equal(RESULTADO)
+        outro.fecha()
+
+    def test_deve_ignorar_registro_fora_da_retencao(self):
+        self.backend.registra(u'8:codigo', RESULTADO)
+        self.agora += 61
+        self.backend.consulta(u'8:codigo').should.be.none
+
+    def test_deve_apagar_expiradas(self):
+        self.backend.registra(u'8:velho', RESULTADO)
+        self.agora += 61
+        self.backend.registra(u'8:novo', RESULTADO)
+        self.backend.apaga_expiradas()
+        self.backend._conexao.execute('SELECT chave FROM notificacoes_processadas').fetchall().should.be.equal([(u'8:novo',)])
+
+
+class NotificacoesProcessadas(unittest.TestCase):
+    def setUp(self):
+        self.agora = 1000.0
+        self.backend = mock.MagicMock()
+        self.backend.consulta.return_value = None
+        self.notificacoes = deduplicacao.NotificacoesProcessadas(retencao=60, tamanho_maximo=2, backend=self.backend, relogio=lambda: self.agora)
+
+    def test_deve_lembrar_resultado_por_loja_e_codigo(self):
+        self.notificacoes.registra(8, 'codigo', RESULTADO)
+        self.notificacoes.consulta(8, 'codigo').should.be.equal(RESULTADO)
+        self.notificacoes.consulta(9, 'codigo').should.be.none
+        self.backend.registra.assert_called_with(u'8:codigo', RESULTADO)
+
+    def test_deve_esquecer_depois_da_retencao(self):
+        self.notificacoes.registra(8, 'codigo', RESULTADO)
+        self.agora += 61
+        self.notificacoes.consulta(8, 'codigo').should.be.none
+
+    def test_deve_descartar_menos_usado(self):
+        self.notificacoes.backend = None
+        for codigo in ('c1', 'c2', 'c3'):
+            self.notificacoes.registra(8, codigo, RESULTADO)
+        self.notificacoes.consulta(8, 'c1').should.be.none
+        self.notificacoes.consulta(8, 'c3').should.be.equal(RESULTADO)
+
+    def test_deve_buscar_no_backend_e_guardar_em_memoria(self):
+        self.backend.consulta.return_value = RESULTADO
+        self.notificacoes.consulta(8, 'codigo').should.be.equal(RESULTADO)
+        self.notificacoes.consulta(8, 'codigo').should.be.equal(RESULTADO)
+        self.backend.consulta.call_count.should.be.equal(1)
+
+    def test_deve_contar_acertos_e_faltas(self):
+        self.notificacoes.consulta(8, 'c1')
+        self.notificacoes.registra(8, 'c1', RESULTADO)
+        self.notificacoes.consulta(8, 'c1')
+        self.backend.consulta.return_value = RESULTADO
+        self.notificacoes.consulta(8, 'c2')
+        self.notificacoes.estatisticas().should.be.equal({'acertos': 2, 'faltas': 1, 'acertos_backend': 1, 'itens': 2})
+
+    def test_deve_funcionar_sem_backend(self):
+        notificacoes = deduplicacao.NotificacoesProcessadas()
+        notificacoes.registra(8, 'codigo', RESULTADO)
+        notificacoes.consulta(8, 'codigo').should.be.equal(RESULTADO)
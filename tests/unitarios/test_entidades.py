@@ -59,7 +59,7 @@ class PagSeguroTransparenteMontandoMalote(unittest.TestCase):
         entidades.TipoEnvio('outro').valor.should.be.equal(3)
 
     def test_malote_deve_ter_propriedades(self):
-        entidades.Malote('configuracao').to_dict().should.be.equal({'appId': None, 'appKey': None, 'currency': None, 'extraAmount': None, 'notificationURL': None, 'redirectURL': None, 'reference': None, 'senderAreaCode': None, 'senderEmail': None, 'senderName': None, 'senderPhone': None, 'shippingAddressCity': None, 'shippingAddressComplement': None, 'shippingAddressCountry': 'BRA', 'shippingAddressDistrict': None, 'shippingAddressNumber': None, 'shippingAddressPostalCode': None, 'shippingAddressState': None, 'shippingAddressStreet': None, 'shippingCost': None, 'shippingType': None})
+        entidades.Malote('configuracao').to_dict().should.be.equal({'billingAddressCity': None, 'billingAddressComplement': None, 'billingAddressCountry': 'BRA', 'billingAddressDistrict': None, 'billingAddressNumber': None, 'billingAddressPostalCode': None, 'billingAddressState': None, 'billingAddressStreet': None, 'creditCardHolderAreaCode': None, 'creditCardHolderBirthDate': None, 'creditCardHolderCPF': None, 'creditCardHolderName': None, 'creditCardHolderPhone': None, 'creditCardToken': None, 'installmentQuantity': 1, 'installmentValue': None, 'noInterestInstallmentQuantity': None, 'paymentMethod': 'creditCard', 'paymentMode': 'default', 'senderCNPJ': None, 'senderCPF': None, 'senderHash': None, 'appId': None, 'appKey': None, 'currency': 'BRL', 'extraAmount': None, 'notificationURL': None, 'redirectURL': None, 'reference': None, 'senderAreaCode': None, 'senderEmail': None, 'senderName': None, 'senderPhone': None, 'shippingAddressCity': None, 'shippingAddressComplement': None, 'shippingAddressCountry': 'BRA', 'shippingAddressDistrict': None, 'shippingAddressNumber': None, 'shippingAddressPostalCode': None, 'shippingAddressState': None, 'shippingAddressStreet': None, 'shippingCost': None, 'shippingType': None})
 
     def test_deve_montar_conteudo(self):
         malote = entidades.Malote(mock.MagicMock(loja_id=8))
@@ -83,7 +83,7 @@ class PagSeguroTransparenteMontandoMalote(unittest.TestCase):
         dados = {'next_url': 'url-next'}
         parametros = {'app_secret': 'app-secret', 'app_id': 'app-id'}
         malote.monta_conteudo(pedido, parametros, dados)
-        malote.to_dict().should.be.equal({'appId': 'app-id', 'appKey': 'app-secret', 'currency': 'BRL', 'extraAmount': '-4.00', 'itemAmount1': '40.00', 'itemAmount2': '50.00', 'itemDescription1': 'Produto 1', 'itemDescription2': 'Produto 2', 'itemId1': 'PROD01', 'itemId2': 'PROD02', 'itemQuantity1': 1, 'itemQuantity2': 1, 'notificationURL': 'http://localhost:5000/pagador/meio-pagamento/pstransparente/retorno/8/notificacao', 'redirectURL': 'http://localhost:5000/pagador/meio-pagamento/pstransparente/retorno/8/resultado?next_url=url-next&referencia=1234', 'reference': 1234, 'senderAreaCode': '21', 'senderEmail': 'cliente@email.com', 'senderName': 'Nome', 'senderPhone': '99999999', 'shippingAddressCity': 'Cidade', 'shippingAddressComplement': 'lt 51', 'shippingAddressCountry': 'BRA', 'shippingAddressDistrict': 'Bairro', 'shippingAddressNumber': '51', 'shippingAddressPostalCode': '12908-212', 'shippingAddressState': 'RJ', 'shippingAddressStreet': 'Rua entrega', 'shippingCost': '14.00', 'shippingType': 1})
+        malote.to_dict().should.be.equal({'billingAddressCity': None, 'billingAddressComplement': None, 'billingAddressCountry': 'BRA', 'billingAddressDistrict': None, 'billingAddressNumber': None, 'billingAddressPostalCode': None, 'billingAddressState': None, 'billingAddressStreet': None, 'creditCardHolderAreaCode': None, 'creditCardHolderBirthDate': None, 'creditCardHolderCPF': None, 'creditCardHolderName': None, 'creditCardHolderPhone': None, 'creditCardToken': None, 'installmentQuantity': 1, 'installmentValue': None, 'noInterestInstallmentQuantity': None, 'paymentMethod': 'creditCard', 'paymentMode': 'default', 'senderCNPJ': None, 'senderCPF': None, 'senderHash': None, 'appId': 'app-id', 'appKey': 'app-secret', 'currency': 'BRL', 'extraAmount': '-4.00', 'itemAmount1': '40.00', 'itemAmount2': '50.00', 'itemDescription1': 'Produto 1', 'itemDescription2': 'Produto 2', 'itemId1': 'PROD01', 'itemId2': 'PROD02', 'itemQuantity1': 1, 'itemQuantity2': 1, 'notificationURL': 'http://localhost:5000/pagador/meio-pagamento/pstransparente/retorno/8/notificacao', 'redirectURL': 'http://localhost:5000/pagador/meio-pagamento/pstransparente/retorno/8/resultado?next_url=url-next&referencia=1234', 'reference': 1234, 'senderAreaCode': '21', 'senderEmail': 'cliente@email.com', 'senderName': 'Nome', 'senderPhone': '99999999', 'shippingAddressCity': 'Cidade', 'shippingAddressComplement': 'lt 51', 'shippingAddressCountry': 'BRA', 'shippingAddressDistrict': 'Bairro', 'shippingAddressNumber': '51', 'shippingAddressPostalCode': '12908-212', 'shippingAddressState': 'RJ', 'shippingAddressStreet': 'Rua entrega', 'shippingCost': '14.00', 'shippingType': 1})
 
     def test_deve_montar_conteudo_se_produto_nao_tiver_nome(self):
         malote = entidades.Malote(mock.MagicMock(loja_id=8))
@@ -107,4 +107,41 @@ class PagSeguroTransparenteMontandoMalote(unittest.TestCase):
         dados = {'next_url': 'url-next'}
         parametros = {'app_secret': 'app-secret', 'app_id': 'app-id'}
         malote.monta_conteudo(pedido, parametros, dados)
-        malote.to_dict().should.be.equal({'appId': 'app-id', 'appKey': 'app-secret', 'currency': 'BRL', 'extraAmount': '-4.00', 'itemAmount1': '40.00', 'itemAmount2': '50.00', 'itemDescription1': 'PROD01', 'itemDescription2': 'Produto 2', 'itemId1': 'PROD01', 'itemId2': 'PROD02', 'itemQuantity1': 1, 'itemQuantity2': 1, 'notificationURL': 'http://localhost:5000/pagador/meio-pagamento/pstransparente/retorno/8/notificacao', 'redirectURL': 'http://localhost:5000/pagador/meio-pagamento/pstransparente/retorno/8/resultado?next_url=url-next&referencia=1234', 'reference': 1234, 'senderAreaCode': '21', 'senderEmail': 'cliente@email.com', 'senderName': 'Nome', 'senderPhone': '99999999', 'shippingAddressCity': 'Cidade', 'shippingAddressComplement': 'lt 51', 'shippingAddressCountry': 'BRA', 'shippingAddressDistrict': 'Bairro', 'shippingAddressNumber': '51', 'shippingAddressPostalCode': '12908-212', 'shippingAddressState': 'RJ', 'shippingAddressStreet': 'Rua entrega', 'shippingCost': '14.00', 'shippingType': 1})
+        malote.to_dict().should.be.equal({'billingAddressCity': None, 'billingAddressComplement': None, 'billingAddressCountry': 'BRA', 'billingAddressDistrict': None, 'billingAddressNumber': None, 'billingAddressPostalCode': None, 'billingAddressState': None, 'billingAddressStreet': None, 'creditCardHolderAreaCode': None, 'creditCardHolderBirthDate': None, 'creditCardHolderCPF': None, 'creditCardHolderName': None, 'creditCardHolderPhone': None, 'creditCardToken': None, 'installmentQuantity': 1, 'installmentValue': None, 'noInterestInstallmentQuantity': None, 'paymentMethod': 'creditCard', 'paymentMode': 'default', 'senderCNPJ': None, 'senderCPF': None, 'senderHash': None, 'appId': 'app-id', 'appKey': 'app-secret', 'currency': 'BRL', 'extraAmount': '-4.00', 'itemAmount1': '40.00', 'itemAmount2': '50.00', 'itemDescription1': 'PROD01', 'itemDescription2': 'Produto 2', 'itemId1': 'PROD01', 'itemId2': 'PROD02', 'itemQuantity1': 1, 'itemQuantity2': 1, 'notificationURL': 'http://localhost:5000/pagador/meio-pagamento/pstransparente/retorno/8/notificacao', 'redirectURL': 'http://localhost:5000/pagador/meio-pagamento/pstransparente/retorno/8/resultado?next_url=url-next&referencia=1234', 'reference': 1234, 'senderAreaCode': '21', 'senderEmail': 'cliente@email.com', 'senderName': 'Nome', 'senderPhone': '99999999', 'shippingAddressCity': 'Cidade', 'shippingAddressComplement': 'lt 51', 'shippingAddressCountry': 'BRA', 'shippingAddressDistrict': 'Bairro', 'shippingAddressNumber': '51', 'shippingAddressPostalCode': '12908-212', 'shippingAddressState': 'RJ', 'shippingAddressStreet': 'Rua entrega', 'shippingCost': '14.00', 'shippingType': 1})
+
+    def test_nao_deve_alterar_chaves_da_classe_ao_montar_itens(self):
+        chaves = dict(entidades.Malote._chaves_alternativas_para_serializacao)
+        malote = entidades.Malote(mock.MagicMock(loja_id=8))
+        malote._cria_item(mock.MagicMock(nome='Produto 1', sku='PROD01', quantidade=1, preco_venda=Decimal('40.00')))
+        entidades.Malote._chaves_alternativas_para_serializacao.should.be.equal(chaves)
+
+    def test_itens_devem_ser_por_instancia(self):
+        malote = entidades.Malote(mock.MagicMock(loja_id=8))
+        malote._cria_item(mock.MagicMock(nome='Produto 1', sku='PROD01', quantidade=1, preco_venda=Decimal('40.00')))
+        malote._cria_item(mock.MagicMock(nome='Produto 2', sku='PROD02', quantidade=2, preco_venda=Decimal('50.00')))
+        outro_malote = entidades.Malote(mock.MagicMock(loja_id=8))
+        outro_malote.to_dict().should_not.have.key('itemId1')
+        malote.to_dict().should.have.key('itemQuantity2').being.equal(2)
+
+    def test_deve_serializar_itens_com_indice(self):
+        malote = entidades.Malote(mock.MagicMock(loja_id=8))
+        malote._cria_item(mock.MagicMock(nome='Produto 1', sku='PROD01', quantidade=3, preco_venda=Decimal('40.00')))
+        list(malote.itens_serializados()).should.be.equal([('itemId1', 'PROD01'), ('itemDescription1', 'Produto 1'), ('itemAmount1', '40.00'), ('itemQuantity1', 3)])
+
+    def test_esquema_deve_ter_todas_as_chaves_da_classe(self):
+        dict(entidades.ESQUEMA_MALOTE).should.be.equal(entidades.Malote._chaves_alternativas_para_serializacao)
+
+    def test_deve_codificar_formulario_sem_campos_vazios(self):
+        malote = entidades.Malote(mock.MagicMock(loja_id=8))
+        malote.app_id = 'app-id'
+        malote.redirect_url = u'http://url/resultado?next_url=url-next&referencia=1234'
+        malote.sender_name = u'Jo\xe3o da Silva'
+        malote._cria_item(mock.MagicMock(nome='Produto 1', sku='PROD01', quantidade=1, preco_venda=Decimal('40.00')))
+        malote.to_form_urlencoded().should.be.equal('appId=app-id&billingAddressCountry=BRA&currency=BRL&installmentQuantity=1&paymentMethod=creditCard&paymentMode=default&redirectURL=http%3A%2F%2Furl%2Fresultado%3Fnext_url%3Durl-next%26referencia%3D1234&senderName=Jo%C3%A3o+da+Silva&shippingAddressCountry=BRA&itemId1=PROD01&itemDescription1=Produto+1&itemAmount1=40.00&itemQuantity1=1')
+
+    def test_deve_codificar_formulario_em_pedacos(self):
+        malote = entidades.Malote(mock.MagicMock(loja_id=8))
+        pedacos = list(malote.codifica_formulario())
+        pedacos[0].should.be.equal('billingAddressCountry=BRA')
+        pedacos[1].should.be.equal('&currency=BRL')
+        ''.join(pedacos).should.be.equal(malote.to_form_urlencoded())
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+import mock
+
+from pagador_pagseguro_transparente import evidencias
+
+
+def descompacta(corpo):
+    return json.loads(gzip.GzipFile(fileobj=StringIO(corpo)).read())['evidencias']
+
+
+class GravadorDeEvidencias(unittest.TestCase):
+    def setUp(self):
+        self.diretorio = tempfile.mkdtemp()
+        self.agora = 1000.0
+        self.enviados = []
+        self.disponivel = True
+
+    def tearDown(self):
+        shutil.rmtree(self.diretorio)
+
+    def envia(self, corpo):
+        if not self.disponivel:
+            return False
+        self.enviados.append(descompacta(corpo))
+        return True
+
+    def cria_gravador(self, **parametros):
+        parametros.setdefault('intervalo', 0.05)
+        return evidencias.GravadorDeEvidencias(
+            url='http://evidencias', diretorio_reserva=self.diretorio, envia=self.envia, relogio=lambda: self.agora, **parametros
+        )
+
+    def test_deve_enviar_evidencias_em_lote_ao_fechar(self):
+        gravador = self.cria_gravador(intervalo=5).inicia()
+        for indice in range(5):
+            gravador.registra({'tipo': 'checkout', 'loja_id': indice})
+        gravador.fecha()
+        len(self.enviados).should.be.equal(1)
+        [evidencia['loja_id'] for evidencia in self.enviados[0]].should.be.equal(range(5))
+        gravador.estatisticas()['enviadas'].should.be.equal(5)
+
+    def test_deve_limitar_tamanho_do_lote(self):
+        gravador = self.cria_gravador(tamanho_lote=2)
+        for indice in range(5):
+            gravador.registra({'loja_id': indice})
+        gravador.inicia().fecha()
+        [len(lote) for lote in self.enviados].should.be.equal([2, 2, 1])
+
+    def test_nao_deve_enviar_app_key(self):
+        gravador = self.cria_gravador()
+        gravador.registra({'dados_enviados': 'appId=1&appKey=segredo&reference=2'})
+        gravador.registra({'dados_enviados': {'appId': '1', 'appKey': 'segredo'}})
+        gravador.inicia().fecha()
+        [evidencia['dados_enviados'] for evidencia in self.enviados[0]].should.be.equal(['appId=1&appKey=***&reference=2', {'appId': '1'}])
+
+    def test_deve_enviar_a_resposta_completa_do_pagseguro(self):
+        gravador = self.cria_gravador()
+        gravador.registra({'dados_recebidos': {'transaction': {'code': 'C1'}}, 'corpo_recebido': '<transaction><code>C1</code><sender><name>X</name></sender></transaction>'})
+        gravador.inicia().fecha()
+        evidencia = self.enviados[0][0]
+        evidencia['dados_recebidos'].should.be.equal({'transaction': {'code': 'C1', 'sender': {'name': 'X'}}})
+        evidencia.should_not.have.key('corpo_recebido')
+
+    def test_deve_gravar_em_disco_se_o_servico_falhar_e_reenviar_depois(self):
+        self.disponivel = False
+        gravador = self.cria_gravador(pausa_apos_falha=30)
+        gravador.envia_lote([{'loja_id': 1}]).should.be.false
+        gravador.envia_lote([{'loja_id': 2}]).should.be.false
+        gravador.estatisticas()['arquivos_em_disco'].should.be.equal(2)
+        gravador.estatisticas()['falhas_envio'].should.be.equal(1)
+        self.disponivel = True
+        gravador.reenvia_do_disco().should.be.equal(0)
+        self.agora += 31
+        gravador.reenvia_do_disco().should.be.equal(2)
+        [lote[0]['loja_id'] for lote in self.enviados].should.be.equal([1, 2])
+        gravador.estatisticas()['arquivos_em_disco'].should.be.equal(0)
+
+    def test_deve_gravar_em_disco_se_o_envio_der_erro_de_conexao(self):
+        gravador = self.cria_gravador()
+        gravador.envia = mock.MagicMock(side_effect=evidencias.requests.Timeout)
+        gravador.envia_lote([{'loja_id': 1}])
+        gravador.estatisticas()['gravadas_em_disco'].should.be.equal(1)
+
+    def test_deve_descartar_com_a_fila_cheia_sem_gravar_em_disco(self):
+        gravador = self.cria_gravador(tamanho_fila=1)
+        gravador.registra({'loja_id': 1})
+        gravador.registra({'loja_id': 2})
+        gravador.estatisticas()['descartadas'].should.be.equal(1)
+        gravador.estatisticas()['arquivos_em_disco'].should.be.equal(0)
+        gravador.fecha()
+        gravador.estatisticas()['arquivos_em_disco'].should.be.equal(1)
+
+    def test_nao_deve_disparar_erro_se_nao_conseguir_gravar_em_disco(self):
+        gravador = self.cria_gravador(tamanho_fila=1)
+        gravador.diretorio_reserva = os.path.join(self.diretorio, 'arquivo', 'reserva')
+        open(os.path.join(self.diretorio, 'arquivo'), 'w').close()
+        gravador.registra({'loja_id': 1})
+        gravador.registra({'loja_id': 2})
+        gravador.fecha()
+        gravador.estatisticas()['gravadas_em_disco'].should.be.equal(0)
+
+    def test_deve_gravar_em_disco_so_para_o_dono(self):
+        self.disponivel = False
+        gravador = self.cria_gravador()
+        gravador.diretorio_reserva = os.path.join(self.diretorio, 'reserva')
+        gravador.envia_lote([{'loja_id': 1}])
+        (os.stat(gravador.diretorio_reserva).st_mode & 0777).should.be.equal(0700)
+        arquivo = os.path.join(gravador.diretorio_reserva, gravador._arquivos_reserva()[0])
+        (os.stat(arquivo).st_mode & 0777).should.be.equal(0600)
+
+    def test_deve_usar_configuracao_do_pagador(self):
+        with mock.patch.dict('os.environ', {'API_URL': 'http://api/', 'PAGADOR_EVIDENCIA_URL': 'evidencia', 'PAGADOR_EVIDENCIA_USA_AUTENTICACAO_HEADER': 'True', 'PAGADOR_EVIDENCIA_AUTENTICACAO': 'chave'}):
+            gravador = evidencias.GravadorDeEvidencias()
+        gravador.url.should.be.equal('http://api/evidencia')
+        gravador.cabecalhos.should.be.equal({'Content-Type': 'application/json', 'Content-Encoding': 'gzip', 'Authorization': 'chave'})
+
+
+class Registra(unittest.TestCase):
+    def tearDown(self):
+        evidencias.GRAVADOR = None
+
+    def test_nao_deve_fazer_nada_sem_gravador(self):
+        evidencias.GRAVADOR = None
+        evidencias.registra('checkout', 8, 'dados', mock.MagicMock())
+
+    def test_deve_registrar_troca_com_o_pagseguro(self):
+        evidencias.GRAVADOR = mock.MagicMock()
+        evidencias.registra('checkout', 8, 'dados', mock.MagicMock(status_code=200, conteudo={'checkout': {}}), referencia=1234)
+        evidencia = evidencias.GRAVADOR.registra.call_args[0][0]
+        evidencia.should.have.key('tipo').being.equal('checkout')
+        evidencia.should.have.key('loja_id').being.equal(8)
+        evidencia.should.have.key('referencia').being.equal(1234)
+        evidencia.should.have.key('status_code').being.equal(200)
+        evidencia.should.have.key('dados_recebidos').being.equal({'checkout': {}})
+
+    def test_deve_guardar_o_corpo_recebido(self):
+        evidencias.GRAVADOR = mock.MagicMock()
+        evidencias.registra('notificacao', 8, 'dados', mock.MagicMock(corpo='<transaction><code>C1</code></transaction>'))
+        evidencias.GRAVADOR.registra.call_args[0][0]['corpo_recebido'].should.be.equal('<transaction><code>C1</code></transaction>')
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from pagador_pagseguro_transparente import fila, servicos
+
+OK = {'resultado': 'OK', 'detalhes': []}
+
+
+class FilaDeNotificacoes(unittest.TestCase):
+    def setUp(self):
+        self.agora = 1000.0
+        self.diretorio = tempfile.mkdtemp()
+        self.caminho = os.path.join(self.diretorio, 'fila.db')
+        self.fila = fila.FilaDeNotificacoes(self.caminho, tempo_visibilidade=60, maximo_tentativas=3, atraso_nova_tentativa=10, relogio=lambda: self.agora)
+
+    def tearDown(self):
+        self.fila.fecha()
+        shutil.rmtree(self.diretorio)
+
+    def test_deve_usar_wal(self):
+        self.fila._conexao.execute('PRAGMA journal_mode').fetchone()[0].should.be.equal('wal')
+
+    def test_deve_entregar_na_ordem_de_chegada(self):
+        self.fila.enfileira(8, 'c1')
+        self.fila.enfileira(9, 'c2')
+        mensagens = self.fila.reserva(10)
+        [(mensagem.loja_id, mensagem.codigo, mensagem.tentativas) for mensagem in mensagens].should.be.equal([(8, 'c1', 1), (9, 'c2', 1)])
+
+    def test_nao_deve_duplicar_codigo_pendente(self):
+        self.fila.enfileira(8, 'c1').should.be.true
+        self.fila.enfileira(8, 'c1').should.be.false
+        self.fila.enfileira(9, 'c1').should.be.true
+        self.fila.estatisticas()['pendentes'].should.be.equal(2)
+
+    def test_deve_esconder_mensagem_reservada_ate_a_visibilidade_expirar(self):
+        self.fila.enfileira(8, 'c1')
+        self.fila.reserva().should.have.length_of(1)
+        self.fila.reserva().should.be.empty
+        self.fila.estatisticas()['em_processamento'].should.be.equal(1)
+        self.agora += 61
+        self.fila.reserva()[0].tentativas.should.be.equal(2)
+
+    def test_deve_tirar_da_fila_ao_confirmar(self):
+        self.fila.enfileira(8, 'c1')
+        self.fila.confirma(self.fila.reserva()[0])
+        self.agora += 61
+        self.fila.reserva().should.be.empty
+        self.fila.estatisticas().should.be.equal({'pendentes': 0, 'em_processamento': 0, 'mortas': 0})
+
+    def test_nao_deve_confirmar_reserva_expirada_que_outro_pegou(self):
+        self.fila.enfileira(8, 'c1')
+        primeira = self.fila.reserva()[0]
+        self.agora += 61
+        self.fila.reserva()
+        self.fila.confirma(primeira)
+        self.fila.estatisticas()['pendentes'].should.be.equal(1)
+
+    def test_deve_devolver_para_a_fila_com_atraso_ao_falhar(self):
+        self.fila.enfileira(8, 'c1')
+        self.fila.falha(self.fila.reserva()[0], u'timeout')
+        self.fila.reserva().should.be.empty
+        self.agora += 10
+        self.fila.falha(self.fila.reserva()[0], u'timeout')
+        self.agora += 19
+        self.fila.reserva().should.be.empty
+        self.agora += 1
+        self.fila.reserva()[0].tentativas.should.be.equal(3)
+
+    def test_deve_mandar_para_mortas_depois_das_tentativas(self):
+        self.fila.enfileira(8, 'c1')
+        for _ in range(3):
+            self.agora += 100
+            self.fila.falha(self.fila.reserva()[0], u'ERRO: sem resposta')
+        self.fila.mortas().should.be.equal([{'id': 1, 'loja_id': 8, 'codigo': 'c1', 'tentativas': 3, 'ultimo_erro': u'ERRO: sem resposta'}])
+        self.fila.mortas(loja_id=9).should.be.empty
+        self.fila.estatisticas()['pendentes'].should.be.equal(0)
+
+    def test_deve_mandar_para_mortas_reserva_expirada_na_ultima_tentativa(self):
+        self.fila.enfileira(8, 'c1')
+        for _ in range(3):
+            self.agora += 61
+            self.fila.reserva().should.have.length_of(1)
+        self.agora += 61
+        self.fila.reserva().should.be.empty
+        self.fila.estatisticas()['mortas'].should.be.equal(1)
+
+    def test_deve_reenfileirar_mortas(self):
+        self.fila.enfileira(8, 'c1')
+        for _ in range(3):
+            self.agora += 100
+            self.fila.falha(self.fila.reserva()[0])
+        self.fila.reenfileira_mortas().should.be.equal(1)
+        self.fila.mortas().should.be.empty
+        self.fila.reserva()[0].tentativas.should.be.equal(1)
+
+    def test_deve_esperar_o_agrupamento_antes_de_entregar(self):
+        self.fila.espera_agrupamento = 5
+        self.fila.enfileira(8, 'c1')
+        self.fila.reserva().should.be.empty
+        self.agora += 5
+        self.fila.reserva().should.have.length_of(1)
+
+    def test_deve_compartilhar_entre_conexoes(self):
+        self.fila.enfileira(8, 'c1')
+        outra = fila.FilaDeNotificacoes(self.caminho, relogio=lambda: self.agora)
+        outra.reserva()[0].codigo.should.be.equal('c1')
+        self.fila.reserva().should.be.empty
+        outra.fecha()
+
+
+class TrabalhadoresDaFila(unittest.TestCase):
+    def setUp(self):
+        self.agora = 1000.0
+        self.diretorio = tempfile.mkdtemp()
+        self.fila = fila.FilaDeNotificacoes(os.path.join(self.diretorio, 'fila.db'), maximo_tentativas=2, relogio=lambda: self.agora)
+        self.resultados = {}
+        self.lotes = []
+        self.ao_registrar = mock.MagicMock()
+        self.trabalhadores = fila.TrabalhadoresDaFila(self.fila, self.ao_registrar, trabalhadores=2, espera=0.01)
+        self.trabalhadores.cria_lote = self.cria_lote
+
+    def tearDown(self):
+        self.trabalhadores.para()
+        self.fila.fecha()
+        shutil.rmtree(self.diretorio)
+
+    def cria_lote(self, loja_id):
+        lote = mock.MagicMock()
+
+        def processa(codigos):
+            self.lotes.append((loja_id, codigos))
+            return dict((codigo, self.resultados.get(codigo, OK)) for codigo in codigos)
+        lote.processa.side_effect = processa
+        return lote
+
+    def test_deve_processar_as_notificacoes_de_cada_loja_num_lote(self):
+        for loja_id, codigo in [(8, 'c1'), (9, 'c2'), (8, 'c3')]:
+            self.fila.enfileira(loja_id, codigo)
+        self.trabalhadores.processa_pendentes().should.be.equal(3)
+        self.lotes.should.be.equal([(8, ['c1', 'c3']), (9, ['c2'])])
+        self.fila.estatisticas()['pendentes'].should.be.equal(0)
+
+    def test_deve_devolver_para_a_fila_resultado_com_erro(self):
+        self.fila.enfileira(8, 'c1')
+        self.resultados['c1'] = {'resultado': 'ERRO', 'detalhes': [u'Não foi recebida uma resposta válida do PagSeguro']}
+        self.trabalhadores.processa_pendentes()
+        self.agora += 1000
+        self.trabalhadores.processa_pendentes()
+        self.fila.mortas()[0]['ultimo_erro'].should.be.equal(u'Não foi recebida uma resposta válida do PagSeguro')
+
+    def test_deve_devolver_para_a_fila_se_o_lote_disparar_erro(self):
+        self.fila.enfileira(8, 'c1')
+        self.trabalhadores.cria_lote = mock.MagicMock(side_effect=ValueError('banco fora'))
+        self.trabalhadores.processa_pendentes()
+        self.fila.estatisticas()['pendentes'].should.be.equal(1)
+        self.fila.reserva().should.be.empty
+
+    def test_deve_consumir_a_fila_em_segundo_plano(self):
+        self.trabalhadores.inicia()
+        self.fila.enfileira(8, 'c1')
+        for _ in range(500):
+            if not self.fila.estatisticas()['pendentes']:
+                break
+            self.trabalhadores._parar.wait(0.01)
+        self.trabalhadores.para()
+        self.lotes.should.be.equal([(8, ['c1'])])
+
+    @mock.patch('pagador_pagseguro_transparente.notificacoes.servicos.RegistraNotificacao')
+    def test_deve_consultar_o_pagseguro_sem_enfileirar_de_novo(self, registra_mock):
+        lote = fila.TrabalhadoresDaFila(self.fila, self.ao_registrar).cria_lote(8)
+        lote.ao_registrar.should.be(self.ao_registrar)
+        lote.cria_registrador('c1').usa_fila.should.be.false
+
+    def test_nao_deve_criar_trabalhadores_sem_ao_registrar(self):
+        fila.TrabalhadoresDaFila.when.called_with(self.fila, None).should.throw(ValueError)
+
+
+class Recebimento(unittest.TestCase):
+    def tearDown(self):
+        fila.desliga_recebimento()
+
+    def test_deve_ligar_e_desligar_a_fila_no_registra_notificacao(self):
+        fila_mock = mock.MagicMock()
+        fila.liga_recebimento(fila_mock)
+        servicos.FILA_NOTIFICACOES.should.be(fila_mock)
+        fila.desliga_recebimento()
+        servicos.FILA_NOTIFICACOES.should.be.none
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import socket
+import unittest
+
+import mock
+
+from pagador_pagseguro_transparente import metricas
+
+
+class SinkFalso(object):
+    def __init__(self):
+        self.registros = []
+
+    def registra(self, nome, duracao):
+        self.registros.append((nome, duracao))
+
+
+class Fases(unittest.TestCase):
+    def setUp(self):
+        self.sink = SinkFalso()
+        metricas.limpa_sinks()
+
+    def tearDown(self):
+        metricas.limpa_sinks()
+
+    def test_nao_deve_medir_sem_sink(self):
+        metricas.ativa().should.be.falsy
+        with metricas.fase('entrega.envia_pagamento'):
+            pass
+        self.sink.registros.should.be.equal([])
+
+    def test_deve_enviar_duracao_da_fase_para_os_sinks(self):
+        metricas.adiciona_sink(self.sink)
+        with metricas.fase('entrega.envia_pagamento'):
+            pass
+        [nome for nome, _ in self.sink.registros].should.be.equal(['entrega.envia_pagamento'])
+        self.sink.registros[0][1].should.be.greater_than_or_equal_to(0)
+
+    def test_deve_medir_fase_que_dispara_excecao(self):
+        metricas.adiciona_sink(self.sink)
+
+        @metricas.medido('fase.com_erro')
+        def falha():
+            raise ValueError('falhou')
+
+        falha.when.called_with().should.throw(ValueError)
+        [nome for nome, _ in self.sink.registros].should.be.equal(['fase.com_erro'])
+
+    def test_decorator_deve_manter_retorno_e_nome(self):
+        @metricas.medido('fase.soma')
+        def soma(a, b=1):
+            return a + b
+
+        soma(1, b=2).should.be.equal(3)
+        soma.__name__.should.be.equal('soma')
+        metricas.adiciona_sink(self.sink)
+        soma(1).should.be.equal(2)
+        len(self.sink.registros).should.be.equal(1)
+
+    def test_deve_remover_sink(self):
+        metricas.adiciona_sink(self.sink)
+        metricas.remove_sink(self.sink)
+        metricas.ativa().should.be.falsy
+
+
+class Histogramas(unittest.TestCase):
+    def setUp(self):
+        self.histogramas = metricas.Histogramas(limites=(0.1, 1))
+
+    def test_deve_contar_por_balde(self):
+        for duracao in (0.05, 0.1, 0.5, 3):
+            self.histogramas.registra('entrega.envia_pagamento', duracao)
+        self.histogramas.resumo().should.be.equal({'entrega.envia_pagamento': {'contagem': 4, 'total': 3.65, 'baldes': [2, 1, 1]}})
+
+    def test_deve_exportar_no_formato_do_prometheus(self):
+        self.histogramas.registra('entrega.envia_pagamento', 0.05)
+        self.histogramas.registra('entrega.envia_pagamento', 0.5)
+        self.histogramas.exporta_prometheus().should.be.equal(
+            '# TYPE pagseguro_fase_duracao_segundos histogram\n'
+            'pagseguro_fase_duracao_segundos_bucket{fase="entrega.envia_pagamento",le="0.1"} 1\n'
+            'pagseguro_fase_duracao_segundos_bucket{fase="entrega.envia_pagamento",le="1"} 2\n'
+            'pagseguro_fase_duracao_segundos_bucket{fase="entrega.envia_pagamento",le="+Inf"} 2\n'
+            'pagseguro_fase_duracao_segundos_sum{fase="entrega.envia_pagamento"} 0.55\n'
+            'pagseguro_fase_duracao_segundos_count{fase="entrega.envia_pagamento"} 2\n'
+        )
+
+
+class Sinks(unittest.TestCase):
+    def test_deve_escrever_linha_de_log(self):
+        logger = mock.MagicMock()
+        metricas.SinkDeLog(logger=logger).registra('entrega.envia_pagamento', 0.0125)
+        logger.log.assert_called_with(20, 'fase=%s duracao_ms=%.2f', 'entrega.envia_pagamento', 12.5)
+
+    def test_deve_enviar_timer_para_statsd(self):
+        receptor = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receptor.bind(('127.0.0.1', 0))
+        receptor.settimeout(2)
+        sink = metricas.SinkStatsd(host='127.0.0.1', porta=receptor.getsockname()[1])
+        sink.registra('entrega.envia_pagamento', 0.0125)
+        receptor.recv(1024).should.be.equal('pagseguro.entrega.envia_pagamento:12.500|ms')
+        receptor.close()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import mock
+
+from pagador_pagseguro_transparente import notificacoes
+
+
+def cria_registrador(codigo, referencia=None, sucesso=True, erro_consulta=None, situacao=None):
+    registrador = mock.MagicMock(resultado={'resultado': 'OK', 'detalhes': [codigo]})
+    conteudo = {'transaction': {'reference': referencia, 'status': situacao}} if referencia else {}
+    registrador.resposta = mock.MagicMock(sucesso=sucesso, conteudo=conteudo)
+    if erro_consulta:
+        registrador.obtem_informacoes_pagamento.side_effect = erro_consulta
+    return registrador
+
+
+class RegistraNotificacoesEmLote(unittest.TestCase):
+    def setUp(self):
+        self.registradores = {}
+        self.lote = notificacoes.RegistraNotificacoesEmLote(8, mock.MagicMock(), concorrencia=2, tamanho_bloco=2)
+        self.lote.cria_registrador = lambda codigo: self.registradores[codigo]
+
+    @mock.patch('pagador_pagseguro_transparente.notificacoes.servicos.RegistraNotificacao')
+    def test_deve_criar_registrador_com_notification_code(self, registra_mock):
+        lote = notificacoes.RegistraNotificacoesEmLote(8, mock.MagicMock())
+        lote.cria_registrador('codigo-1').should.be.equal(registra_mock.return_value)
+        registra_mock.assert_called_with(8, dados={'notificationCode': 'codigo-1'})
+
+    def test_deve_retornar_um_resultado_por_codigo_na_ordem(self):
+        for codigo, referencia in [('c1', '10'), ('c2', '11'), ('c3', '12')]:
+            self.registradores[codigo] = cria_registrador(codigo, referencia)
+        resultados = self.lote.processa(['c1', 'c2', 'c3'])
+        resultados.keys().should.be.equal(['c1', 'c2', 'c3'])
+        resultados['c2'].should.be.equal({'resultado': 'OK', 'detalhes': ['c2']})
+
+    def test_deve_processar_codigo_repetido_uma_vez(self):
+        self.registradores['c1'] = cria_registrador('c1', '10')
+        self.lote.processa(['c1', 'c1']).keys().should.be.equal(['c1'])
+        self.registradores['c1'].obtem_informacoes_pagamento.call_count.should.be.equal(1)
+
+    def test_deve_definir_credenciais_antes_de_consultar(self):
+        self.registradores['c1'] = cria_registrador('c1', '10')
+        self.lote.processa(['c1'])
+        self.registradores['c1'].define_credenciais.called.should.be.truthy
+        self.registradores['c1'].monta_dados_pagamento.called.should.be.truthy
+
+    def test_deve_carregar_cada_pedido_uma_vez_por_bloco(self):
+        self.registradores['c1'] = cria_registrador('c1', '10')
+        self.registradores['c2'] = cria_registrador('c2', '10')
+        self.lote.processa(['c1', 'c2'])
+        carregados = self.registradores['c1'].cria_pedido_pagamento.call_count + self.registradores['c2'].cria_pedido_pagamento.call_count
+        carregados.should.be.equal(1)
+        self.registradores['c1'].pedidos_pagamento.should.have.key(10)
+        self.registradores['c2'].pedidos_pagamento.should.be.equal(self.registradores['c1'].pedidos_pagamento)
+
+    def test_nao_deve_carregar_pedido_sem_resposta_valida(self):
+        self.registradores['c1'] = cria_registrador('c1', '10', sucesso=False)
+        self.lote.processa(['c1'])
+        self.registradores['c1'].cria_pedido_pagamento.called.should.be.falsy
+
+    def test_deve_retornar_erro_da_consulta_sem_parar_o_lote(self):
+        self.registradores['c1'] = cria_registrador('c1', '10', erro_consulta=ValueError(u'não respondeu'))
+        self.registradores['c2'] = cria_registrador('c2', '11')
+        resultados = self.lote.processa(['c1', 'c2'])
+        resultados['c1'].should.be.equal({'resultado': 'ERRO', 'detalhes': [u'ValueError: não respondeu']})
+        resultados['c2']['resultado'].should.be.equal('OK')
+        self.registradores['c1'].monta_dados_pagamento.called.should.be.falsy
+
+    def test_deve_retornar_erro_ao_montar_dados(self):
+        self.registradores['c1'] = cria_registrador('c1', '10')
+        self.registradores['c1'].monta_dados_pagamento.side_effect = KeyError('transaction')
+        self.lote.processa(['c1'])['c1']['resultado'].should.be.equal('ERRO')
+
+    def test_deve_chamar_ao_registrar_para_cada_registrador(self):
+        registrados = []
+        self.lote.ao_registrar = registrados.append
+        self.registradores['c1'] = cria_registrador('c1', '10')
+        self.registradores['c2'] = cria_registrador('c2', '11')
+        self.lote.processa(['c1', 'c2'])
+        registrados.should.be.equal([self.registradores['c1'], self.registradores['c2']])
+
+    def test_deve_retornar_erro_sem_ao_registrar(self):
+        self.lote.ao_registrar = None
+        self.registradores['c1'] = cria_registrador('c1', '10')
+        self.lote.processa(['c1'])['c1']['resultado'].should.be.equal('ERRO')
+        self.registradores['c1'].monta_dados_pagamento.called.should.be.falsy
+        self.registradores['c1'].confirma_registro.called.should.be.falsy
+
+    def test_deve_confirmar_registro_depois_de_gravar(self):
+        self.lote.ao_registrar = lambda registrador: registrador.confirma_registro.called.should.be.falsy
+        self.registradores['c1'] = cria_registrador('c1', '10')
+        self.lote.processa(['c1'])
+        self.registradores['c1'].confirma_registro.called.should.be.truthy
+
+    def test_nao_deve_confirmar_registro_se_a_gravacao_falhar(self):
+        self.lote.ao_registrar = mock.MagicMock(side_effect=IOError('banco fora'))
+        self.registradores['c1'] = cria_registrador('c1', '10')
+        self.lote.processa(['c1'])['c1']['resultado'].should.be.equal('ERRO')
+        self.registradores['c1'].confirma_registro.called.should.be.falsy
+
+    def test_deve_registrar_primeiro_a_situacao_mais_adiantada_do_pedido(self):
+        registrados = []
+        self.lote.tamanho_bloco = 3
+        self.lote.ao_registrar = registrados.append
+        for codigo, situacao in [('c1', '1'), ('c2', '3'), ('c3', '2')]:
+            self.registradores[codigo] = cria_registrador(codigo, '10', situacao=situacao)
+        self.lote.processa(['c1', 'c2', 'c3']).keys().should.be.equal(['c1', 'c2', 'c3'])
+        registrados[0].should.be(self.registradores['c2'])
+
+    def test_nao_deve_carregar_pedido_para_situacao_superada_no_bloco(self):
+        self.registradores['c1'] = cria_registrador('c1', '10', situacao='1')
+        self.registradores['c2'] = cria_registrador('c2', '10', situacao='3')
+        self.lote.processa(['c1', 'c2'])
+        self.registradores['c1'].cria_pedido_pagamento.called.should.be.falsy
+        self.registradores['c2'].cria_pedido_pagamento.called.should.be.truthy
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import unittest
+from decimal import Decimal
+
+import mock
+
+from pagador_pagseguro_transparente import parcelamento
+
+
+class Configuracao(object):
+    maximo_parcelas = '6'
+    parcelas_sem_juros = '3'
+    valor_minimo_parcela = Decimal('10.00')
+
+
+class Centavos(unittest.TestCase):
+    def test_deve_converter_precos_para_centavos(self):
+        for preco, centavos in (('10', 1000), ('10.5', 1050), ('-1.25', -125), ('0.005', 1), (Decimal('1.234'), 123), (Decimal('7'), 700), (3, 300), (19.99, 1999), (0.125, 13), (2.675, 268)):
+            parcelamento._centavos(preco).should.be.equal(centavos)
+
+
+class Coeficiente(unittest.TestCase):
+    def test_deve_calcular_coeficiente_da_tabela_price(self):
+        parcelamento.coeficiente(2, Decimal('0.0199')).should.be.equal(5149740136)
+
+    def test_uma_parcela_com_juros_deve_ser_o_valor_mais_a_taxa(self):
+        parcelamento.coeficiente(1, Decimal('0.0199')).should.be.equal(10199000000)
+
+
+@mock.patch('pagador_pagseguro_transparente.parcelamento.np', None)
+class ParcelamentoSemNumpy(unittest.TestCase):
+    def test_deve_normalizar_configuracao(self):
+        calculadora = parcelamento.Parcelamento(maximo_parcelas='30', parcelas_sem_juros=None, valor_minimo_parcela=None)
+        calculadora.maximo_parcelas.should.be.equal(18)
+        calculadora.parcelas_sem_juros.should.be.equal(1)
+        calculadora.valor_minimo_parcela.should.be.equal(parcelamento.PARCELA_MINIMA)
+
+    def test_deve_ler_configuracao_da_loja(self):
+        calculadora = parcelamento.Parcelamento.da_configuracao(Configuracao())
+        calculadora.maximo_parcelas.should.be.equal(6)
+        calculadora.parcelas_sem_juros.should.be.equal(3)
+        calculadora.valor_minimo_parcela.should.be.equal(Decimal('10.00'))
+
+    def test_deve_arredondar_parcela_sem_juros_para_o_centavo_mais_proximo(self):
+        parcelas = parcelamento.Parcelamento(maximo_parcelas=3, parcelas_sem_juros=3).parcelas(Decimal('100.00'))
+        [parcela.valor for parcela in parcelas].should.be.equal([Decimal('100.00'), Decimal('50.00'), Decimal('33.33')])
+        [parcela.total for parcela in parcelas].should.be.equal([Decimal('100.00')] * 3)
+        all(parcela.sem_juros for parcela in parcelas).should.be.truthy
+
+    def test_deve_arredondar_meio_centavo_para_cima(self):
+        parcelas = parcelamento.Parcelamento(maximo_parcelas=2, parcelas_sem_juros=2).parcelas('100.01')
+        parcelas[1].valor.should.be.equal(Decimal('50.01'))
+
+    def test_deve_aplicar_juros_depois_das_parcelas_sem_juros(self):
+        parcelas = parcelamento.Parcelamento(maximo_parcelas=2, parcelas_sem_juros=1).parcelas(Decimal('100.00'))
+        parcelas[1].valor.should.be.equal(Decimal('51.50'))
+        parcelas[1].total.should.be.equal(Decimal('103.00'))
+        parcelas[1].sem_juros.should.be.falsy
+
+    def test_deve_descartar_parcelas_abaixo_do_valor_minimo(self):
+        parcelas = parcelamento.Parcelamento(maximo_parcelas=18, parcelas_sem_juros=18, valor_minimo_parcela='10.00').parcelas('35.00')
+        [parcela.quantidade for parcela in parcelas].should.be.equal([1, 2, 3])
+
+    def test_deve_oferecer_uma_parcela_mesmo_abaixo_do_minimo(self):
+        parcelas = parcelamento.Parcelamento(valor_minimo_parcela='10.00').parcelas('3.00')
+        [parcela.quantidade for parcela in parcelas].should.be.equal([1])
+
+    def test_deve_calcular_tabela_de_varios_precos(self):
+        tabela = parcelamento.Parcelamento(maximo_parcelas=6, parcelas_sem_juros=3).tabela(['10.00', '100.00', 1000])
+        len(tabela).should.be.equal(3)
+        tabela.maior_parcelamento(0).quantidade.should.be.equal(2)
+        tabela.maior_parcelamento(2).quantidade.should.be.equal(6)
+        tabela.maior_sem_juros(2).quantidade.should.be.equal(3)
+
+
+class ParcelamentoComNumpy(unittest.TestCase):
+    def setUp(self):
+        if parcelamento.np is None:
+            raise unittest.SkipTest('NumPy não instalado')
+
+    def test_deve_ter_mesmo_resultado_com_e_sem_numpy(self):
+        calculadora = parcelamento.Parcelamento(maximo_parcelas=18, parcelas_sem_juros=4, valor_minimo_parcela='7.50')
+        precos = ['{}.{:02d}'.format(reais, centavos) for reais in range(0, 2000, 37) for centavos in (0, 1, 49, 50, 99)]
+        vetorizada = calculadora.tabela(precos)
+        with mock.patch('pagador_pagseguro_transparente.parcelamento.np', None):
+            simples = calculadora.tabela(precos)
+        for indice in range(len(precos)):
+            [parcela.to_dict() for parcela in vetorizada.parcelas(indice)].should.be.equal([parcela.to_dict() for parcela in simples.parcelas(indice)])
+
+    def test_deve_aceitar_array_de_floats(self):
+        tabela = parcelamento.Parcelamento(maximo_parcelas=3, parcelas_sem_juros=3).tabela(parcelamento.np.array([19.99, 100.0]))
+        tabela.parcelas(0)[0].valor.should.be.equal(Decimal('19.99'))
+        tabela.parcelas(1)[2].valor.should.be.equal(Decimal('33.33'))
+
+    def test_deve_calcular_sem_numpy_precos_que_estouram_int64(self):
+        calculadora = parcelamento.Parcelamento(maximo_parcelas=2)
+        limite = calculadora.maximo_centavos_numpy
+        no_limite = calculadora.tabela([parcelamento._reais(limite)])
+        acima = calculadora.tabela([parcelamento._reais(limite), parcelamento._reais(limite + 1)])
+        isinstance(no_limite.valores, parcelamento.np.ndarray).should.be.truthy
+        isinstance(acima.valores, parcelamento.np.ndarray).should.be.falsy
+        with mock.patch('pagador_pagseguro_transparente.parcelamento.np', None):
+            simples = calculadora.tabela([parcelamento._reais(limite), parcelamento._reais(limite + 1)])
+        for indice in range(2):
+            [parcela.to_dict() for parcela in acima.parcelas(indice)].should.be.equal([parcela.to_dict() for parcela in simples.parcelas(indice)])
+        [parcela.to_dict() for parcela in no_limite.parcelas(0)].should.be.equal([parcela.to_dict() for parcela in simples.parcelas(0)])
+
+    def test_deve_arredondar_meio_centavo_do_array_como_sem_numpy(self):
+        precos = [0.125, 1.005, 2.675]
+        tabela = parcelamento.Parcelamento(maximo_parcelas=1).tabela(parcelamento.np.array(precos))
+        [int(centavos) for centavos in tabela.precos].should.be.equal([parcelamento._centavos(preco) for preco in precos])
+        tabela.parcelas(0)[0].valor.should.be.equal(Decimal('0.13'))
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import mock
+from requests.exceptions import ConnectionError, ConnectTimeout, ReadTimeout
+from requests.packages.urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+from pagador_pagseguro_transparente import resiliencia
+
+
+class Disjuntor(unittest.TestCase):
+    def setUp(self):
+        self.agora = 1000.0
+        self.disjuntor = resiliencia.Disjuntor(janela=10, minimo_chamadas=4, taxa_erros=0.5, latencia_lenta=5, taxa_lentas=0.75, tempo_aberto=30, relogio=lambda: self.agora)
+
+    def registra(self, *resultados):
+        for sucesso, duracao in resultados:
+            self.disjuntor.registra(sucesso, duracao)
+
+    def test_deve_comecar_fechado(self):
+        self.disjuntor.estado.should.be.equal(resiliencia.Disjuntor.FECHADO)
+        self.disjuntor.permite().should.be.truthy
+
+    def test_nao_deve_abrir_antes_do_minimo_de_chamadas(self):
+        self.registra((False, 0.1), (False, 0.1), (False, 0.1))
+        self.disjuntor.estado.should.be.equal(resiliencia.Disjuntor.FECHADO)
+
+    def test_deve_abrir_com_taxa_de_erros(self):
+        self.registra((True, 0.1), (False, 0.1), (True, 0.1), (False, 0.1))
+        self.disjuntor.estado.should.be.equal(resiliencia.Disjuntor.ABERTO)
+        self.disjuntor.permite().should.be.falsy
+
+    def test_deve_abrir_com_chamadas_lentas(self):
+        self.registra((True, 6), (True, 6), (True, 6), (True, 0.1))
+        self.disjuntor.estado.should.be.equal(resiliencia.Disjuntor.ABERTO)
+
+    def test_deve_ficar_meio_aberto_depois_do_tempo_aberto(self):
+        self.registra(*[(False, 0.1)] * 4)
+        self.agora += 30
+        self.disjuntor.estado.should.be.equal(resiliencia.Disjuntor.MEIO_ABERTO)
+        self.disjuntor.permite().should.be.truthy
+        self.disjuntor.permite().should.be.falsy
+
+    def test_deve_fechar_se_chamada_de_teste_der_certo(self):
+        self.registra(*[(False, 0.1)] * 4)
+        self.agora += 30
+        self.disjuntor.permite()
+        self.disjuntor.registra(True, 0.1)
+        self.disjuntor.estado.should.be.equal(resiliencia.Disjuntor.FECHADO)
+        self.registra((False, 0.1), (False, 0.1), (False, 0.1))
+        self.disjuntor.estado.should.be.equal(resiliencia.Disjuntor.FECHADO)
+
+    def test_deve_abrir_de_novo_se_chamada_de_teste_falhar(self):
+        self.registra(*[(False, 0.1)] * 4)
+        self.agora += 30
+        self.disjuntor.permite()
+        self.disjuntor.registra(False, 0.1)
+        self.disjuntor.estado.should.be.equal(resiliencia.Disjuntor.ABERTO)
+
+    def test_deve_ter_estatisticas(self):
+        self.registra(*[(False, 0.1)] * 4)
+        self.disjuntor.permite()
+        self.disjuntor.estatisticas().should.be.equal({'estado': 'aberto', 'chamadas': 4, 'erros': 4, 'lentas': 0, 'recusadas': 1, 'aberturas': 1})
+
+
+class Disjuntores(unittest.TestCase):
+    def test_deve_ter_um_disjuntor_por_host(self):
+        disjuntores = resiliencia.Disjuntores(minimo_chamadas=1)
+        producao = disjuntores.do_host('https://ws.pagseguro.uol.com.br/v2/transactions')
+        producao.should.be.equal(disjuntores.do_host('https://ws.pagseguro.uol.com.br/v3/transactions/notifications/x'))
+        producao.should_not.be.equal(disjuntores.do_host('https://ws.sandbox.pagseguro.uol.com.br/v2/transactions'))
+        producao.minimo_chamadas.should.be.equal(1)
+
+    def test_deve_ter_estatisticas_por_host(self):
+        disjuntores = resiliencia.Disjuntores()
+        disjuntores.do_host('https://ws.pagseguro.uol.com.br/v2/transactions').registra(True, 0.1)
+        disjuntores.estatisticas()['ws.pagseguro.uol.com.br']['chamadas'].should.be.equal(1)
+
+
+class CircuitoAberto(unittest.TestCase):
+    def test_deve_ter_resposta_de_servidor_indisponivel(self):
+        resposta = resiliencia.CircuitoAberto('ws.pagseguro.uol.com.br').resposta
+        resposta.sucesso.should.be.falsy
+        resposta.erro_servidor.should.be.truthy
+        resposta.conteudo.should.be.equal({})
+
+
+class PoliticaDeTentativas(unittest.TestCase):
+    def setUp(self):
+        self.agora = 1000.0
+        self.esperas = []
+        self.politica = resiliencia.PoliticaDeTentativas(tentativas=3, espera_inicial=1, multiplicador=2, espera_maxima=3, orcamento=10, relogio=lambda: self.agora, dorme=self.dorme, aleatorio=lambda: 1)
+
+    def dorme(self, segundos):
+        self.esperas.append(segundos)
+        self.agora += segundos
+
+    def chamadas(self, *resultados):
+        resultados = list(resultados)
+
+        def chamada():
+            self.agora += 0.5
+            resultado = resultados.pop(0)
+            if isinstance(resultado, Exception):
+                raise resultado
+            return mock.MagicMock(status_code=resultado)
+        return chamada
+
+    def test_deve_retornar_sem_repetir_quando_der_certo(self):
+        self.politica.executa(self.chamadas(200)).status_code.should.be.equal(200)
+        self.esperas.should.be.equal([])
+
+    def test_deve_repetir_erro_do_servidor_com_espera_exponencial(self):
+        self.politica.executa(self.chamadas(500, 503, 200)).status_code.should.be.equal(200)
+        self.esperas.should.be.equal([1, 2])
+
+    def test_nao_deve_repetir_erro_de_validacao(self):
+        self.politica.executa(self.chamadas(400, 200)).status_code.should.be.equal(400)
+        self.esperas.should.be.equal([])
+
+    def test_deve_retornar_ultima_resposta_depois_das_tentativas(self):
+        self.politica.executa(self.chamadas(500, 500, 500, 200)).status_code.should.be.equal(500)
+        len(self.esperas).should.be.equal(2)
+
+    def test_deve_repetir_erro_de_conexao_e_disparar_o_ultimo(self):
+        chamada = self.chamadas(ConnectionError('reset'), ConnectionError('reset'), ConnectionError('ultimo'))
+        self.politica.executa.when.called_with(chamada).should.throw(ConnectionError, 'ultimo')
+
+    def test_deve_repetir_so_erro_antes_do_envio(self):
+        self.politica.so_antes_do_envio = True
+        recusada = ConnectionError(MaxRetryError(None, '/v2/transactions', NewConnectionError(None, 'Connection refused')))
+        self.politica.executa(self.chamadas(recusada, ConnectTimeout('connect'), 200)).status_code.should.be.equal(200)
+        abortada = ConnectionError(ProtocolError('Connection aborted.'))
+        self.politica.executa.when.called_with(self.chamadas(abortada, 200)).should.throw(ConnectionError)
+        self.politica.executa.when.called_with(self.chamadas(ReadTimeout('read'), 200)).should.throw(ReadTimeout)
+
+    def test_nao_deve_repetir_outras_excecoes(self):
+        self.politica.executa.when.called_with(self.chamadas(ValueError('falhou'), 200)).should.throw(ValueError)
+
+    def test_deve_respeitar_orcamento_total(self):
+        self.politica.orcamento = 2
+        self.politica.executa(self.chamadas(500, 500, 200)).status_code.should.be.equal(500)
+        self.esperas.should.be.equal([1])
+
+    def test_deve_contar_a_partir_da_primeira_tentativa(self):
+        self.politica.executa(self.chamadas(500, 500), primeira_tentativa=2).status_code.should.be.equal(500)
+        self.esperas.should.be.equal([2])
+
+    def test_deve_limitar_espera_e_usar_jitter(self):
+        self.politica.aleatorio = lambda: 0.5
+        self.politica.espera(1).should.be.equal(0.5)
+        self.politica.espera(5).should.be.equal(1.5)
+
+    def test_deve_anotar_cada_tentativa(self):
+        registro = []
+        self.politica.executa(self.chamadas(ConnectionError('reset'), 200), registro=registro)
+        registro.should.be.equal([
+            {'tentativa': 1, 'duracao': 0.5, 'erro': 'ConnectionError'},
+            {'tentativa': 2, 'duracao': 0.5, 'status_code': 200},
+        ])
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import os
+import unittest
+
+from li_common.padroes.serializacao import Formatador
+
+from pagador_pagseguro_transparente import respostas
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'fixtures')
+
+
+def fixture(nome):
+    with open(os.path.join(FIXTURES, nome)) as arquivo:
+        return arquivo.read()
+
+
+class XmlParaDict(unittest.TestCase):
+    def test_deve_ler_so_campos_usados_da_transacao(self):
+        respostas.xml_para_dict(fixture('transacao.xml')).should.be.equal({'transaction': {
+            'date': '2015-03-10T14:12:33.000-03:00', 'code': '9E884542-81B3-4419-9A75-BCC6FB495EF1',
+            'reference': '1234', 'status': '3', 'grossAmount': '499.00'
+        }})
+
+    def test_nao_deve_pegar_code_de_elementos_internos(self):
+        respostas.xml_para_dict('<transaction><paymentMethod><code>101</code></paymentMethod><status>3</status></transaction>').should.be.equal({'transaction': {'status': '3'}})
+
+    def test_deve_manter_valores_do_leitor_generico(self):
+        for nome in ('transacao.xml', 'busca.xml', 'checkout.xml', 'erros.xml'):
+            conteudo = fixture(nome)
+            generico = Formatador.xml_para_dict(conteudo)
+            raiz = generico.keys()[0]
+            rapido = respostas.xml_para_dict(conteudo)[raiz]
+            if isinstance(rapido, dict):
+                for chave, valor in rapido.items():
+                    if chave != 'transactions':
+                        valor.should.be.equal(generico[raiz][chave])
+
+    def test_deve_ler_parcelas_do_parcelamento(self):
+        respostas.xml_para_dict(
+            '<installments><installment><cardBrand>visa</cardBrand><quantity>1</quantity><amount>10.00</amount>'
+            '<totalAmount>10.00</totalAmount><interestFree>true</interestFree></installment></installments>'
+        ).should.be.equal({'installments': {'installment': {
+            'cardBrand': 'visa', 'quantity': '1', 'amount': '10.00', 'totalAmount': '10.00', 'interestFree': 'true'
+        }}})
+
+    def test_deve_ler_pagina_da_busca_com_lista_de_transacoes(self):
+        resultado = respostas.xml_para_dict(fixture('busca.xml'))['transactionSearchResult']
+        resultado['totalPages'].should.be.equal('3')
+        resultado['transactions'].should.be.equal([
+            {'transaction': {'date': '2015-03-10T14:12:33.000-03:00', 'reference': '1234', 'code': '9E884542-81B3-4419-9A75-BCC6FB495EF1', 'status': '3', 'grossAmount': '499.00'}},
+            {'transaction': {'date': '2015-03-10T15:40:02.000-03:00', 'reference': '1235', 'code': '2FB07A22-68FF-4F83-A356-7B18B2EC6D0D', 'status': '7', 'grossAmount': '89.90'}},
+        ])
+
+    def test_deve_ler_busca_com_uma_transacao_como_dicionario(self):
+        conteudo = '<transactionSearchResult><transactions><transaction><reference>1</reference><status>3</status></transaction></transactions></transactionSearchResult>'
+        respostas.xml_para_dict(conteudo).should.be.equal(Formatador.xml_para_dict(conteudo))
+
+    def test_deve_ler_busca_sem_transacoes(self):
+        conteudo = '<transactionSearchResult><resultsInThisPage>0</resultsInThisPage><transactions/></transactionSearchResult>'
+        respostas.xml_para_dict(conteudo).should.be.equal(Formatador.xml_para_dict(conteudo))
+
+    def test_deve_ler_erros_no_formato_do_leitor_generico(self):
+        respostas.xml_para_dict(fixture('erros.xml')).should.be.equal(Formatador.xml_para_dict(fixture('erros.xml')))
+        conteudo = '<errors><error><code>53110</code><message>invalid</message></error></errors>'
+        respostas.xml_para_dict(conteudo).should.be.equal({'errors': {'error': {'code': '53110', 'message': 'invalid'}}})
+
+    def test_deve_ler_checkout(self):
+        respostas.xml_para_dict(fixture('checkout.xml')).should.be.equal({'checkout': {'code': '8CF4BE7DCECEF0F004A6DFA0A8243412', 'date': '2015-03-10T14:10:00.000-03:00'}})
+
+    def test_deve_usar_leitor_generico_para_outros_documentos(self):
+        conteudo = '<authorizationRequest><code>CODIGO</code><date>2015</date></authorizationRequest>'
+        respostas.xml_para_dict(conteudo).should.be.equal({'authorizationRequest': {'code': 'CODIGO', 'date': '2015'}})
+
+    def test_deve_retornar_vazio_se_nao_for_xml(self):
+        respostas.xml_para_dict('Unauthorized').should.be.equal({})
+        respostas.xml_para_dict('').should.be.equal({})
+        respostas.xml_para_dict(None).should.be.equal({})
+
+
+class Transacao(unittest.TestCase):
+    def test_deve_criar_do_xml(self):
+        transacao = respostas.Transacao.do_xml({'code': 'C1', 'reference': '10', 'status': '3', 'grossAmount': '10.00', 'date': '2015'})
+        (transacao.codigo, transacao.referencia, transacao.situacao, transacao.valor, transacao.data).should.be.equal(('C1', '10', '3', '10.00', '2015'))
+
+    def test_deve_deixar_campo_ausente_como_none(self):
+        respostas.Transacao.do_xml({'status': '3'}).codigo.should.be.none
+
+    def test_deve_converter_para_dicionario_do_pagseguro(self):
+        respostas.Transacao(codigo='C1', referencia='10', situacao='3').to_dict().should.be.equal({'code': 'C1', 'reference': '10', 'status': '3'})
+
+    def test_nao_deve_ter_dicionario_por_instancia(self):
+        respostas.Transacao().should_not.have.property('__dict__')
+        respostas.PaginaDeBusca().should_not.have.property('__dict__')
+
+
+class PaginaDeBusca(unittest.TestCase):
+    def test_deve_criar_pagina_com_transacoes(self):
+        pagina = respostas.PaginaDeBusca.do_xml(respostas.xml_para_dict(fixture('busca.xml'))['transactionSearchResult'])
+        (pagina.pagina, pagina.total_paginas, pagina.resultados).should.be.equal((1, 3, 2))
+        [transacao.referencia for transacao in pagina.transacoes].should.be.equal(['1234', '1235'])
+
+    def test_deve_aceitar_uma_transacao(self):
+        pagina = respostas.PaginaDeBusca.do_xml({'transactions': {'transaction': {'reference': '1', 'status': '3'}}})
+        [transacao.referencia for transacao in pagina.transacoes].should.be.equal(['1'])
+
+    def test_deve_aceitar_pagina_vazia(self):
+        pagina = respostas.PaginaDeBusca.do_xml({'totalPages': '0', 'transactions': None})
+        pagina.transacoes.should.be.equal([])
+        pagina.total_paginas.should.be.equal(0)
+        respostas.PaginaDeBusca.do_xml(None).total_paginas.should.be.equal(1)
@@ -1,13 +1,21 @@
 # -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
 from decimal import Decimal
+import time
 import unittest
 
 import mock
+from requests.exceptions import ConnectionError, ConnectTimeout
+from requests.packages.urllib3.exceptions import ProtocolError
 
 from pagador_pagseguro_transparente import servicos
 
 
 class PagSeguroTransparenteInstalacaoMeioPagamento(unittest.TestCase):
+
+    def setUp(self):
+        servicos.PARAMETROS_CONTRATO.limpa()
+
     @mock.patch('pagador.entidades.ParametrosDeContrato')
     def test_deve_instanciar_com_loja_id(self, parametros_mock):
         instalador = servicos.InstalaMeioDePagamento(8, {'dados': 1})
@@ -179,6 +187,126 @@ class PagSeguroTransparenteInstalacaoMeioPagamento(unittest.TestCase):
         instalador.conexao.get.return_value = reposta
         instalador.obter_dados.when.called_with().should.throw(instalador.InstalacaoNaoFinalizada, u'Erro ao entrar em contato com o PagSeguro. Código: pagseguro status_code - Resposta: pagseguro conteudo')
 
+    @mock.patch('pagador.entidades.ParametrosDeContrato')
+    def test_deve_ler_parametros_atualizados_ignorando_o_cache(self, parametros_mock):
+        parametros_mock.return_value.obter_para.return_value = {'app_secret': '1', 'app_id': '2'}
+        servicos.InstalaMeioDePagamento(8, {'dados': 1})
+        parametros_mock.return_value.obter_para.return_value = {'app_secret': '3', 'app_id': '2'}
+        instalador = servicos.InstalaMeioDePagamento(8, {'dados': 1})
+        parametros_mock.return_value.obter_para.call_count.should.be.equal(2)
+        instalador.app_key.should.be.equal('3')
+        servicos.PARAMETROS_CONTRATO.consulta((8, 'pagseguro')).should.be.equal({'app_secret': '3', 'app_id': '2'})
+
+    def test_xml_autorizacao_deve_ser_igual_ao_do_formatador(self):
+        from li_common.padroes.serializacao import Formatador
+        redirect = 'http://localhost/instalar?next_url=url-next&fase_atual=2'
+        servicos.xml_autorizacao(8, redirect).should.be.equal(Formatador.dict_para_xml({
+            'authorizationRequest': {
+                'reference': 8,
+                'permissions': [{'code': permissao} for permissao in servicos.PERMISSOES_AUTORIZACAO],
+                'redirectURL': '<![CDATA[{}]]>'.format(redirect),
+            }
+        }))
+
+    def test_xml_autorizacao_deve_escapar_referencia_e_url(self):
+        xml = servicos.xml_autorizacao('<8&>', 'http://localhost/?x=]]><a>')
+        xml.should.contain(u'<reference>&lt;8&amp;&gt;</reference>')
+        xml.should.contain(u'<![CDATA[http://localhost/?x=]]]]><![CDATA[><a>]]>')
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.InstalaMeioDePagamento.montar_url_autorizacao', autospec=True)
+    @mock.patch('pagador.entidades.ParametrosDeContrato')
+    def test_deve_montar_urls_autorizacao_de_varias_lojas(self, parametros_mock, montar_mock):
+        parametros_mock.return_value.obter_para.return_value = {'app_secret': '1', 'app_id': '2'}
+
+        def montar(instalador):
+            if instalador.loja_id == 3:
+                raise instalador.InstalacaoNaoFinalizada(u'Erro no PagSeguro')
+            instalador.dados.should.be.equal({'next_url': 'url-next'})
+            return 'url-{}'.format(instalador.loja_id)
+        montar_mock.side_effect = montar
+        urls, erros = servicos.monta_urls_autorizacao(range(1, 6), {'next_url': 'url-next'}, concorrencia=3)
+        urls.should.be.equal({1: 'url-1', 2: 'url-2', 4: 'url-4', 5: 'url-5'})
+        erros.keys().should.be.equal([3])
+        erros[3].should.contain(u'Erro no PagSeguro')
+
+
+class PagSeguroTransparenteParametrosDeContrato(unittest.TestCase):
+    def setUp(self):
+        servicos.PARAMETROS_CONTRATO.limpa()
+
+    def test_deve_definir_aplicacao_padrao(self):
+        servicos.aplicacao_do_contrato(mock.MagicMock(aplicacao='pagseguro_399')).should.be.equal('pagseguro')
+
+    def test_deve_definir_aplicacao_alternativa(self):
+        servicos.aplicacao_do_contrato(mock.MagicMock(aplicacao='pagseguro-alternativo')).should.be.equal('pagseguro-alternativo')
+
+    def test_deve_obter_parametros_uma_vez_por_loja_e_aplicacao(self):
+        servico = mock.MagicMock(loja_id=8)
+        servico.cria_entidade_pagador.return_value.obter_para.return_value = {'app_secret': '1', 'app_id': '2'}
+        servicos.obtem_parametros_contrato(servico, 'pagseguro')
+        servicos.obtem_parametros_contrato(servico, 'pagseguro').should.be.equal({'app_secret': '1', 'app_id': '2'})
+        servicos.obtem_parametros_contrato(servico, 'pagseguro-alternativo')
+        servico.cria_entidade_pagador.assert_called_with('ParametrosDeContrato', loja_id=8)
+        servico.cria_entidade_pagador.return_value.obter_para.call_count.should.be.equal(2)
+        servicos.PARAMETROS_CONTRATO.estatisticas().should.be.equal({'acertos': 1, 'faltas': 2, 'itens': 2})
+
+    def test_deve_invalidar_parametros_da_loja(self):
+        servico = mock.MagicMock(loja_id=8)
+        servicos.obtem_parametros_contrato(servico, 'pagseguro')
+        servicos.obtem_parametros_contrato(servico, 'pagseguro-alternativo')
+        servicos.obtem_parametros_contrato(mock.MagicMock(loja_id=9), 'pagseguro')
+        servicos.invalida_parametros_contrato(8)
+        len(servicos.PARAMETROS_CONTRATO).should.be.equal(1)
+
+    def test_deve_invalidar_parametros_da_aplicacao(self):
+        servico = mock.MagicMock(loja_id=8)
+        servicos.obtem_parametros_contrato(servico, 'pagseguro')
+        servicos.obtem_parametros_contrato(servico, 'pagseguro-alternativo')
+        servicos.invalida_parametros_contrato(8, 'pagseguro')
+        servicos.obtem_parametros_contrato(servico, 'pagseguro')
+        servico.cria_entidade_pagador.return_value.obter_para.call_count.should.be.equal(3)
+
+    def test_deve_descartar_parametros_quando_o_pagseguro_recusa_as_credenciais(self):
+        servico = mock.MagicMock(loja_id=8, configuracao=mock.MagicMock(aplicacao='pagseguro'))
+        for status_code in (401, 403):
+            servicos.obtem_parametros_contrato(servico, 'pagseguro')
+            servicos._descarta_credenciais_recusadas(servico, mock.MagicMock(status_code=status_code))
+            len(servicos.PARAMETROS_CONTRATO).should.be.equal(0)
+
+    def test_deve_manter_parametros_em_outras_respostas(self):
+        servico = mock.MagicMock(loja_id=8, configuracao=mock.MagicMock(aplicacao='pagseguro'))
+        servicos.obtem_parametros_contrato(servico, 'pagseguro')
+        for status_code in (200, 400, 500):
+            servicos._descarta_credenciais_recusadas(servico, mock.MagicMock(status_code=status_code))
+        len(servicos.PARAMETROS_CONTRATO).should.be.equal(1)
+
+
+class PagSeguroTransparenteConexaoPersistente(unittest.TestCase):
+    def test_servicos_devem_usar_conexao_persistente(self):
+        for servico in (servicos.InstalaMeioDePagamento, servicos.EntregaPagamento, servicos.RegistraResultado, servicos.RegistraNotificacao, servicos.AtualizaTransacoes):
+            issubclass(servico, servicos.ConexaoPersistente).should.be.truthy
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.comunicacao.obtem_conexao')
+    def test_deve_obter_conexao_do_pool(self, obtem_mock):
+        obtem_mock.return_value = 'conexao'
+        servicos.ConexaoPersistente().obter_conexao(formato_envio='text/html', formato_resposta='application/xml').should.be.equal('conexao')
+        obtem_mock.assert_called_with('text/html', 'application/xml', politica=None)
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.comunicacao.obtem_conexao')
+    def test_deve_usar_politica_de_tentativas_do_endpoint(self, obtem_mock):
+        for servico, endpoint in ((servicos.EntregaPagamento, 'checkout'), (servicos.RegistraResultado, 'retorno'), (servicos.RegistraNotificacao, 'notificacao'), (servicos.AtualizaTransacoes, 'busca')):
+            servico.endpoint.should.be.equal(endpoint)
+            servico.__new__(servico).obter_conexao('text/html', 'application/xml')
+            obtem_mock.assert_called_with('text/html', 'application/xml', politica=servicos.POLITICAS_DE_TENTATIVAS[endpoint])
+
+    def test_nao_deve_repetir_checkout_com_erro_que_pode_ter_sido_processado(self):
+        politica = servicos.POLITICAS_DE_TENTATIVAS['checkout']
+        politica.deve_repetir(mock.MagicMock(status_code=500)).should.be.falsy
+        politica.deve_repetir(mock.MagicMock(status_code=504)).should.be.falsy
+        politica.deve_repetir(mock.MagicMock(status_code=503)).should.be.truthy
+        politica.deve_repetir_erro(ConnectionError(ProtocolError('Connection aborted.'))).should.be.falsy
+        politica.deve_repetir_erro(ConnectTimeout()).should.be.truthy
+
 
 class PagSeguroTransparenteDesinstalacaoMeioPagamento(unittest.TestCase):
     @mock.patch('pagador.entidades.ParametrosDeContrato', mock.MagicMock())
@@ -236,6 +364,26 @@ class PagSeguroTransparenteSituacoesPagamento(unittest.TestCase):
     def test_deve_retornar_none_para_desconhecido(self):
         servicos.SituacoesDePagamento.do_tipo('zas').should.be.none
 
+    def test_deve_ordenar_situacoes_pelo_ciclo_da_transacao(self):
+        ordem = servicos.SituacoesDePagamento.ordem
+        (ordem('1') < ordem('2') < ordem('3') < ordem('6')).should.be.truthy
+        ordem('7').should.be.equal(ordem('6'))
+        ordem('8').should.be.equal(ordem('6'))
+
+    def test_deve_permitir_que_a_disputa_volte_para_paga(self):
+        servicos.SituacoesDePagamento.ordem('5').should.be.equal(servicos.SituacoesDePagamento.ordem('3'))
+        pedidos = servicos.situacoes.SituacoesRecentesDosPedidos(servicos.SituacoesDePagamento.ordem)
+        pedidos.registra(8, 2222, '5')
+        pedidos.superada(8, 2222, '3').should.be.false
+        pedidos.superada(8, 2222, '2').should.be.true
+
+    def test_deve_ordenar_disponivel_como_pago(self):
+        servicos.SituacoesDePagamento.ordem('4').should.be.equal(servicos.SituacoesDePagamento.ordem('3'))
+
+    def test_deve_ordenar_desconhecido_antes_de_todos(self):
+        servicos.SituacoesDePagamento.ordem('zas').should.be.equal(-1)
+        servicos.SituacoesDePagamento.ordem(None).should.be.equal(-1)
+
 
 class PagSeguroTransparenteEntregaPagamento(unittest.TestCase):
     @mock.patch('pagador_pagseguro_transparente.servicos.EntregaPagamento.obter_conexao', mock.MagicMock())
@@ -271,6 +419,13 @@ class PagSeguroTransparenteEntregaPagamento(unittest.TestCase):
         entregador.conexao.should.be.equal('conexao')
         obter_mock.assert_called_with(formato_envio='application/x-www-form-urlencoded', formato_resposta='application/xml')
 
+    @mock.patch('pagador_pagseguro_transparente.servicos.comunicacao.obtem_conexao')
+    def test_deve_obter_conexao_do_pagseguro(self, obtem_mock):
+        obtem_mock.return_value = 'conexao'
+        entregador = servicos.EntregaPagamento(1234)
+        entregador.conexao.should.be.equal('conexao')
+        obtem_mock.assert_called_with('application/x-www-form-urlencoded', 'application/xml', politica=servicos.POLITICAS_DE_TENTATIVAS['checkout'])
+
     @mock.patch('pagador_pagseguro_transparente.servicos.EntregaPagamento.obter_conexao', mock.MagicMock())
     @mock.patch('pagador_pagseguro_transparente.servicos.Credenciador')
     def test_deve_definir_credenciais(self, credenciador_mock):
@@ -285,21 +440,56 @@ class PagSeguroTransparenteEntregaPagamento(unittest.TestCase):
     def test_deve_enviar_pagamento(self):
         entregador = servicos.EntregaPagamento(1234)
         entregador.malote = mock.MagicMock()
-        entregador.malote.to_dict.return_value = 'malote-como-dicionario'
+        entregador.malote.to_form_urlencoded.return_value = 'malote-codificado'
         entregador.conexao = mock.MagicMock()
         entregador.conexao.post.return_value = 'resposta'
         entregador.envia_pagamento()
-        entregador.dados_enviados.should.be.equal('malote-como-dicionario')
+        entregador.dados_enviados.should.be.equal('malote-codificado')
         entregador.resposta.should.be.equal('resposta')
 
     @mock.patch('pagador_pagseguro_transparente.servicos.EntregaPagamento.obter_conexao', mock.MagicMock())
     def test_deve_usar_post_ao_enviar_pagamento(self):
         entregador = servicos.EntregaPagamento(1234)
         entregador.malote = mock.MagicMock()
-        entregador.malote.to_dict.return_value = 'malote-como-dicionario'
+        entregador.malote.to_form_urlencoded.return_value = 'malote-codificado'
+        entregador.conexao = mock.MagicMock()
+        entregador.envia_pagamento()
+        entregador.conexao.post.assert_called_with(entregador.url, 'malote-codificado')
+        entregador.conexao.primeira_tentativa.should.be.equal(1)
+        entregador.malote.to_dict.called.should.be.falsy
+
+    @mock.patch('pagador_pagseguro_transparente.servicos._descarta_credenciais_recusadas')
+    def test_deve_conferir_credenciais_recusadas_ao_enviar_pagamento(self, descarta_mock):
+        entregador = servicos.EntregaPagamento(1234)
+        entregador.malote = mock.MagicMock()
         entregador.conexao = mock.MagicMock()
         entregador.envia_pagamento()
-        entregador.conexao.post.assert_called_with(entregador.url, 'malote-como-dicionario')
+        descarta_mock.assert_called_with(entregador, entregador.conexao.post.return_value)
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.EntregaPagamento.obter_conexao', mock.MagicMock())
+    def test_deve_responder_servidor_indisponivel_com_disjuntor_aberto(self):
+        entregador = servicos.EntregaPagamento(1234)
+        entregador.malote = mock.MagicMock()
+        entregador.conexao = mock.MagicMock()
+        entregador.conexao.post.return_value = servicos.resiliencia.RespostaIndisponivel()
+        entregador.envia_pagamento()
+        entregador.processa_dados_pagamento()
+        entregador.resultado.should.be.equal({'mensagem': u'O servidor do PagSeguro está indisponível nesse momento.', 'status_code': 503})
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.EntregaPagamento.obter_conexao', mock.MagicMock())
+    def test_deve_medir_fases_do_envio(self):
+        histogramas = servicos.metricas.Histogramas()
+        servicos.metricas.adiciona_sink(histogramas)
+        try:
+            entregador = servicos.EntregaPagamento(1234)
+            entregador.malote = mock.MagicMock()
+            entregador.conexao = mock.MagicMock()
+            entregador._processa_resposta = mock.MagicMock()
+            entregador.envia_pagamento()
+            entregador.processa_dados_pagamento()
+        finally:
+            servicos.metricas.remove_sink(histogramas)
+        sorted(histogramas.resumo().keys()).should.be.equal(['entrega.envia_pagamento', 'entrega.processa_dados_pagamento'])
 
     @mock.patch('pagador_pagseguro_transparente.servicos.EntregaPagamento.obter_conexao', mock.MagicMock())
     def test_deve_processar_dados_de_pagamento(self):
@@ -402,6 +592,11 @@ class PagSeguroTransparenteEntregaPagamento(unittest.TestCase):
 
 class PagSeguroTransparenteRegistraResultado(unittest.TestCase):
 
+    def setUp(self):
+        servicos.PARAMETROS_CONTRATO.limpa()
+        servicos.CONSULTAS_TRANSACOES.limpa()
+        servicos.SITUACOES_TRANSACOES.limpa()
+
     @mock.patch('pagador_pagseguro_transparente.servicos.RegistraResultado.obter_conexao', mock.MagicMock())
     def test_deve_dizer_que_faz_http(self):
         registrador = servicos.RegistraResultado(1234, dados={})
@@ -556,6 +751,26 @@ class PagSeguroTransparenteRegistraResultado(unittest.TestCase):
         gera_mock.called.should.be.truthy
         conexao_mock.return_value.get.assert_called_with('https://ws.sandbox.pagseguro.uol.com.br/v3/transactions/transacao-id', dados='dados_envio')
 
+    @mock.patch('pagador_pagseguro_transparente.servicos.RegistraResultado.obter_conexao')
+    @mock.patch('pagador_pagseguro_transparente.servicos.RegistraResultado._gera_dados_envio')
+    def test_deve_usar_situacao_local_fresca_sem_consultar(self, gera_mock, conexao_mock):
+        servicos.SITUACOES_TRANSACOES.registra(1234, servicos.respostas.Transacao(codigo='transacao-id', referencia='2222', situacao='3', valor='10.00'))
+        registrador = servicos.RegistraResultado(1234, dados={'transacao': 'transacao-id', 'referencia': 2222})
+        registrador.obtem_informacoes_pagamento()
+        registrador.monta_dados_pagamento()
+        gera_mock.called.should.be.falsy
+        conexao_mock.return_value.get.called.should.be.falsy
+        registrador.resultado.should.be.equal('sucesso')
+        registrador.situacao_pedido.should.be.equal(servicos.SituacoesDePagamento.do_tipo('3'))
+        registrador.dados_pagamento.should.be.equal({'identificador_id': 'transacao-id', 'transacao_id': 'transacao-id', 'valor_pago': '10.00'})
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.RegistraResultado.obter_conexao', mock.MagicMock())
+    def test_deve_registrar_situacao_consultada(self):
+        registrador = servicos.RegistraResultado(1234, dados={'transacao': 'transacao-id', 'referencia': 2222})
+        registrador.resposta = mock.MagicMock(sucesso=True, conteudo={'transaction': {'code': 'transacao-id', 'status': '3'}})
+        registrador.monta_dados_pagamento()
+        servicos.SITUACOES_TRANSACOES.consulta(1234, 'transacao-id').situacao.should.be.equal('3')
+
     @mock.patch('pagador_pagseguro_transparente.servicos.RegistraResultado.obter_conexao', mock.MagicMock())
     @mock.patch('pagador_pagseguro_transparente.servicos.RegistraResultado.cria_entidade_pagador')
     def test_deve_gerar_dados_envio(self, pagador_mock):
@@ -603,6 +818,13 @@ class PagSeguroTransparenteRegistraResultado(unittest.TestCase):
 
 class PagSeguroTransparenteRegistraNotificacao(unittest.TestCase):
 
+    def setUp(self):
+        servicos.PARAMETROS_CONTRATO.limpa()
+        servicos.NOTIFICACOES_PROCESSADAS.limpa()
+        servicos.CONSULTAS_TRANSACOES.limpa()
+        servicos.SITUACOES_TRANSACOES.limpa()
+        servicos.SITUACOES_DOS_PEDIDOS.limpa()
+
     @mock.patch('pagador_pagseguro_transparente.servicos.RegistraNotificacao.obter_conexao', mock.MagicMock())
     def test_deve_dizer_que_faz_http(self):
         registrador = servicos.RegistraNotificacao(1234, dados={})
@@ -653,6 +875,27 @@ class PagSeguroTransparenteRegistraNotificacao(unittest.TestCase):
         registrador.conexao.credenciador.should.be.equal('credenciador')
         credenciador_mock.assert_called_with(configuracao='configuracao')
 
+    @mock.patch('pagador_pagseguro_transparente.servicos.RegistraNotificacao.obter_conexao', mock.MagicMock())
+    @mock.patch('pagador.entidades.PedidoPagamento')
+    def test_deve_usar_pedido_pagamento_ja_carregado(self, pedido_pagamento_mock):
+        registrador = servicos.RegistraNotificacao(1234, dados={'notificationCode': 'notification-code'})
+        registrador.resposta = mock.MagicMock(sucesso=True, conteudo={'transaction': {'reference': '2222', 'code': 'code-id', 'status': '3'}})
+        registrador.configuracao = mock.MagicMock(loja_id=1234)
+        registrador.pedidos_pagamento = {2222: mock.MagicMock(transacao_id='code-id')}
+        registrador.monta_dados_pagamento()
+        pedido_pagamento_mock.called.should.be.falsy
+        registrador.resultado['resultado'].should.be.equal('OK')
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.RegistraNotificacao.obter_conexao', mock.MagicMock())
+    @mock.patch('pagador.entidades.PedidoPagamento')
+    def test_deve_criar_pedido_pagamento_preenchido_do_banco(self, pedido_pagamento_mock):
+        registrador = servicos.RegistraNotificacao(1234, dados={'notificationCode': 'notification-code'})
+        registrador.configuracao = mock.MagicMock(loja_id=1234)
+        registrador.configuracao.meio_pagamento.codigo = 'pstransparente'
+        registrador.cria_pedido_pagamento(2222).should.be.equal(pedido_pagamento_mock.return_value)
+        pedido_pagamento_mock.assert_called_with(loja_id=1234, pedido_numero=2222, codigo_pagamento='pstransparente')
+        pedido_pagamento_mock.return_value.preencher_do_banco.called.should.be.truthy
+
     @mock.patch('pagador_pagseguro_transparente.servicos.RegistraNotificacao.obter_conexao', mock.MagicMock())
     @mock.patch('pagador.entidades.PedidoPagamento')
     def test_deve_montar_dados_de_pagamento_qdo_sucesso(self, pedido_pagamento_mock):
@@ -812,6 +1055,113 @@ class PagSeguroTransparenteRegistraNotificacao(unittest.TestCase):
         gera_mock.called.should.be.truthy
         conexao_mock.return_value.get.assert_called_with('https://ws.sandbox.pagseguro.uol.com.br/v3/transactions/notifications/notification-code', dados='dados_envio')
 
+    @mock.patch('pagador_pagseguro_transparente.servicos.RegistraNotificacao.obter_conexao', mock.MagicMock())
+    @mock.patch('pagador.entidades.PedidoPagamento')
+    def test_deve_descartar_situacao_superada_do_pedido(self, pedido_pagamento_mock):
+        servicos.SITUACOES_DOS_PEDIDOS.registra(1234, 2222, '3')
+        registrador = servicos.RegistraNotificacao(1234, dados={'notificationCode': 'notification-code'})
+        registrador.resposta = mock.MagicMock(sucesso=True, conteudo={'transaction': {'reference': 2222, 'code': 'code-id', 'status': '2'}})
+        registrador.monta_dados_pagamento()
+        registrador.resultado['resultado'].should.be.equal('OK')
+        registrador.situacao_pedido.should.be.none
+        pedido_pagamento_mock.called.should.be.falsy
+        registrador.confirma_registro()
+        servicos.NOTIFICACOES_PROCESSADAS.consulta(1234, 'notification-code').should.be.equal(registrador.resultado)
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.RegistraNotificacao.obter_conexao', mock.MagicMock())
+    @mock.patch('pagador.entidades.PedidoPagamento')
+    def test_deve_guardar_situacao_registrada_do_pedido(self, pedido_pagamento_mock):
+        registrador = servicos.RegistraNotificacao(1234, dados={'notificationCode': 'notification-code'})
+        registrador.resposta = mock.MagicMock(sucesso=True, conteudo={'transaction': {'reference': 2222, 'code': 'code-id', 'status': '3'}})
+        registrador.configuracao = mock.MagicMock(loja_id=1234)
+        pedido_pagamento_mock.return_value = mock.MagicMock(transacao_id=None)
+        registrador.monta_dados_pagamento()
+        servicos.SITUACOES_DOS_PEDIDOS.superada(1234, 2222, '1').should.be.false
+        registrador.confirma_registro()
+        servicos.SITUACOES_DOS_PEDIDOS.superada(1234, 2222, '1').should.be.true
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.RegistraNotificacao.obter_conexao', mock.MagicMock())
+    @mock.patch('pagador.entidades.PedidoPagamento')
+    def test_deve_registrar_notificacao_processada(self, pedido_pagamento_mock):
+        registrador = servicos.RegistraNotificacao(1234, dados={'notificationCode': 'notification-code'})
+        registrador.resposta = mock.MagicMock(sucesso=True, conteudo={'transaction': {'reference': 2222, 'code': 'code-id', 'status': '3'}})
+        registrador.configuracao = mock.MagicMock(loja_id=1234)
+        pedido_pagamento_mock.return_value = mock.MagicMock(transacao_id=None)
+        registrador.monta_dados_pagamento()
+        servicos.NOTIFICACOES_PROCESSADAS.consulta(1234, 'notification-code').should.be.none
+        registrador.confirma_registro()
+        servicos.NOTIFICACOES_PROCESSADAS.consulta(1234, 'notification-code').should.be.equal(registrador.resultado)
+        servicos.SITUACOES_TRANSACOES.consulta(1234, 'code-id').situacao.should.be.equal('3')
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.RegistraNotificacao.obter_conexao', mock.MagicMock())
+    def test_nao_deve_registrar_notificacao_com_erro(self):
+        registrador = servicos.RegistraNotificacao(1234, dados={'notificationCode': 'notification-code'})
+        registrador.resposta = mock.MagicMock(sucesso=False)
+        registrador.monta_dados_pagamento()
+        registrador.confirma_registro()
+        servicos.NOTIFICACOES_PROCESSADAS.consulta(1234, 'notification-code').should.be.none
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.RegistraNotificacao.obter_conexao')
+    @mock.patch('pagador_pagseguro_transparente.servicos.RegistraNotificacao._gera_dados_envio')
+    def test_deve_responder_notificacao_repetida_sem_consultar(self, gera_mock, conexao_mock):
+        resultado = {'resultado': 'OK', 'detalhes': [u'Pedido não tem transacao_id (None)']}
+        servicos.NOTIFICACOES_PROCESSADAS.registra(1234, 'notification-code', resultado)
+        registrador = servicos.RegistraNotificacao(1234, dados={'notificationCode': 'notification-code'})
+        registrador.obtem_informacoes_pagamento()
+        registrador.monta_dados_pagamento()
+        registrador.notificacao_repetida.should.be.truthy
+        registrador.resultado.should.be.equal(resultado)
+        registrador.situacao_pedido.should.be.none
+        gera_mock.called.should.be.falsy
+        conexao_mock.return_value.get.called.should.be.falsy
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.RegistraNotificacao.obter_conexao')
+    @mock.patch('pagador_pagseguro_transparente.servicos.RegistraNotificacao._gera_dados_envio', mock.MagicMock())
+    def test_deve_reaproveitar_consulta_recente_da_notificacao(self, conexao_mock):
+        conexao_mock.return_value.get.return_value = mock.MagicMock(sucesso=True, conteudo={'transaction': {'code': 'transacao-id'}})
+        servicos.RegistraNotificacao(1234, dados={'notificationCode': 'notification-code'}).obtem_informacoes_pagamento()
+        registrador = servicos.RegistraNotificacao(1234, dados={'notificationCode': 'notification-code'})
+        registrador.obtem_informacoes_pagamento()
+        registrador.resposta.should.be.equal(conexao_mock.return_value.get.return_value)
+        conexao_mock.return_value.get.call_count.should.be.equal(1)
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.RegistraResultado.obter_conexao')
+    @mock.patch('pagador_pagseguro_transparente.servicos.RegistraResultado._gera_dados_envio', mock.MagicMock())
+    @mock.patch('pagador_pagseguro_transparente.servicos.RegistraNotificacao.obter_conexao')
+    @mock.patch('pagador_pagseguro_transparente.servicos.RegistraNotificacao._gera_dados_envio', mock.MagicMock())
+    def test_deve_compartilhar_transacao_consultada_com_o_retorno(self, notificacao_mock, resultado_mock):
+        resposta = mock.MagicMock(sucesso=True, conteudo={'transaction': {'code': 'transacao-id'}})
+        notificacao_mock.return_value.get.return_value = resposta
+        servicos.RegistraNotificacao(1234, dados={'notificationCode': 'notification-code'}).obtem_informacoes_pagamento()
+        registrador = servicos.RegistraResultado(1234, dados={'transacao': 'transacao-id', 'referencia': 2222})
+        registrador.obtem_informacoes_pagamento()
+        registrador.resposta.should.be(resposta)
+        resultado_mock.return_value.get.called.should.be.falsy
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.FILA_NOTIFICACOES')
+    @mock.patch('pagador_pagseguro_transparente.servicos.RegistraNotificacao.obter_conexao')
+    @mock.patch('pagador_pagseguro_transparente.servicos.RegistraNotificacao._gera_dados_envio')
+    def test_deve_enfileirar_notificacao_sem_consultar(self, gera_mock, conexao_mock, fila_mock):
+        registrador = servicos.RegistraNotificacao(1234, dados={'notificationCode': 'notification-code'})
+        registrador.obtem_informacoes_pagamento()
+        registrador.monta_dados_pagamento()
+        fila_mock.enfileira.assert_called_with(1234, 'notification-code')
+        registrador.notificacao_enfileirada.should.be.truthy
+        registrador.resultado['resultado'].should.be.equal('OK')
+        registrador.situacao_pedido.should.be.none
+        gera_mock.called.should.be.falsy
+        conexao_mock.return_value.get.called.should.be.falsy
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.FILA_NOTIFICACOES')
+    @mock.patch('pagador_pagseguro_transparente.servicos.RegistraNotificacao.obter_conexao')
+    @mock.patch('pagador_pagseguro_transparente.servicos.RegistraNotificacao._gera_dados_envio', mock.MagicMock())
+    def test_nao_deve_enfileirar_notificacao_consumida_da_fila(self, conexao_mock, fila_mock):
+        registrador = servicos.RegistraNotificacao(1234, dados={'notificationCode': 'notification-code'})
+        registrador.usa_fila = False
+        registrador.obtem_informacoes_pagamento()
+        fila_mock.enfileira.called.should.be.falsy
+        conexao_mock.return_value.get.called.should.be.truthy
+
     @mock.patch('pagador_pagseguro_transparente.servicos.RegistraNotificacao.obter_conexao', mock.MagicMock())
     @mock.patch('pagador_pagseguro_transparente.servicos.RegistraNotificacao.cria_entidade_pagador')
     def test_deve_gerar_dados_envio(self, pagador_mock):
@@ -855,3 +1205,128 @@ class PagSeguroTransparenteRegistraNotificacao(unittest.TestCase):
         pagador_mock.side_effect = parametros_mock
         registrador.obtem_informacoes_pagamento()
         parametros_mock.return_value.obter_para.assert_called_with('pagseguro-alternativo')
+
+
+def pagina_de_busca(pagina, total_paginas, referencias):
+    transacoes = [{'transaction': {'reference': referencia, 'status': '3'}} for referencia in referencias]
+    return mock.MagicMock(sucesso=True, conteudo={'transactionSearchResult': {
+        'currentPage': str(pagina), 'totalPages': str(total_paginas), 'resultsInThisPage': str(len(referencias)),
+        'transactions': transacoes[0] if len(transacoes) == 1 else transacoes
+    }})
+
+
+class PagSeguroTransparenteAtualizaTransacoes(unittest.TestCase):
+    def setUp(self):
+        servicos.PARAMETROS_CONTRATO.limpa()
+        servicos.SITUACOES_TRANSACOES.limpa()
+
+    def cria_atualizador(self, dados):
+        atualizador = servicos.AtualizaTransacoes(1234, dados)
+        atualizador.configuracao = mock.MagicMock(aplicacao='pagseguro')
+        atualizador._gera_dados_envio = mock.MagicMock(return_value={'appKey': 'app-secret', 'appId': 'app-id', 'initialDate': dados['data_inicial']})
+        atualizador.conexao = mock.MagicMock()
+        return atualizador
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.AtualizaTransacoes.obter_conexao', mock.MagicMock())
+    def test_deve_analisar_resultado_com_uma_transacao(self):
+        atualizador = self.cria_atualizador({'data_inicial': '2015-01-01T00:00'})
+        atualizador.resposta = pagina_de_busca(1, 1, ['10'])
+        atualizador.analisa_resultado_transacoes()
+        atualizador.dados_pedido.should.be.equal({'situacao_pedido': servicos.SituacoesDePagamento.do_tipo('3'), 'pedido_numero': '10'})
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.AtualizaTransacoes.obter_conexao', mock.MagicMock())
+    def test_deve_analisar_resultado_com_varias_transacoes(self):
+        atualizador = self.cria_atualizador({'data_inicial': '2015-01-01T00:00'})
+        atualizador.resposta = pagina_de_busca(1, 1, ['10', '11'])
+        atualizador.analisa_resultado_transacoes()
+        [dados['pedido_numero'] for dados in atualizador.dados_pedido].should.be.equal(['10', '11'])
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.AtualizaTransacoes.obter_conexao', mock.MagicMock())
+    def test_deve_registrar_situacoes_vistas_na_busca(self):
+        atualizador = self.cria_atualizador({'data_inicial': '2015-01-01T00:00'})
+        atualizador.resposta = pagina_de_busca(1, 1, ['10'])
+        atualizador.resposta.conteudo['transactionSearchResult']['transactions']['transaction']['code'] = 'transacao-id'
+        atualizador.analisa_resultado_transacoes()
+        servicos.SITUACOES_TRANSACOES.consulta(1234, 'transacao-id').referencia.should.be.equal('10')
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.AtualizaTransacoes.obter_conexao', mock.MagicMock())
+    def test_deve_ter_uma_janela_sem_data_final_se_periodo_curto(self):
+        atualizador = self.cria_atualizador({'data_inicial': (datetime.now() - timedelta(days=2)).strftime('%Y-%m-%dT%H:%M')})
+        janelas = list(atualizador.janelas_de_busca())
+        len(janelas).should.be.equal(1)
+        janelas[0][1].should.be.none
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.AtualizaTransacoes.obter_conexao', mock.MagicMock())
+    def test_deve_dividir_periodo_em_janelas_de_30_dias(self):
+        atualizador = self.cria_atualizador({'data_inicial': '2015-01-01T00:00', 'data_final': '2015-03-15T12:00'})
+        list(atualizador.janelas_de_busca()).should.be.equal([
+            ('2015-01-01T00:00', '2015-01-31T00:00'),
+            ('2015-01-31T00:00', '2015-03-02T00:00'),
+            ('2015-03-02T00:00', '2015-03-15T12:00'),
+        ])
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.AtualizaTransacoes.obter_conexao', mock.MagicMock())
+    def test_deve_aceitar_datas_sem_hora(self):
+        atualizador = self.cria_atualizador({'data_inicial': '2015-01-01', 'data_final': '2015-01-10'})
+        list(atualizador.janelas_de_busca()).should.be.equal([('2015-01-01T00:00', '2015-01-10T00:00')])
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.AtualizaTransacoes.obter_conexao', mock.MagicMock())
+    def test_deve_percorrer_todas_as_paginas(self):
+        atualizador = self.cria_atualizador({'data_inicial': '2015-01-01T00:00', 'data_final': '2015-01-10T00:00'})
+        atualizador.conexao.get.side_effect = [pagina_de_busca(1, 3, ['10', '11']), pagina_de_busca(2, 3, ['12']), pagina_de_busca(3, 3, ['13', '14'])]
+        [dados['pedido_numero'] for dados in atualizador.itera_transacoes()].should.be.equal(['10', '11', '12', '13', '14'])
+        [chamada[1]['dados']['page'] for chamada in atualizador.conexao.get.call_args_list].should.be.equal([1, 2, 3])
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.AtualizaTransacoes.obter_conexao', mock.MagicMock())
+    def test_deve_gerar_registros_das_transacoes(self):
+        atualizador = self.cria_atualizador({'data_inicial': '2015-01-01T00:00', 'data_final': '2015-01-10T00:00'})
+        atualizador.conexao.get.return_value = pagina_de_busca(1, 1, ['10', '11'])
+        registros = list(atualizador.itera_registros())
+        [registro.referencia for registro in registros].should.be.equal(['10', '11'])
+        registros[0].should.be.a(servicos.respostas.Transacao)
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.AtualizaTransacoes.obter_conexao', mock.MagicMock())
+    def test_deve_enviar_periodo_e_tamanho_da_pagina(self):
+        atualizador = self.cria_atualizador({'data_inicial': '2015-01-01T00:00', 'data_final': '2015-01-10T00:00'})
+        atualizador.conexao.get.return_value = pagina_de_busca(1, 1, ['10'])
+        list(atualizador.itera_transacoes())
+        atualizador.conexao.get.assert_called_with(atualizador.url, dados={'appKey': 'app-secret', 'appId': 'app-id', 'initialDate': '2015-01-01T00:00', 'finalDate': '2015-01-10T00:00', 'maxPageResults': 1000, 'page': 1})
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.AtualizaTransacoes.obter_conexao', mock.MagicMock())
+    def test_deve_buscar_cada_janela(self):
+        atualizador = self.cria_atualizador({'data_inicial': '2015-01-01T00:00', 'data_final': '2015-02-10T00:00'})
+        atualizador.conexao.get.side_effect = [pagina_de_busca(1, 1, ['10']), pagina_de_busca(1, 1, ['11'])]
+        [dados['pedido_numero'] for dados in atualizador.itera_transacoes()].should.be.equal(['10', '11'])
+        [chamada[1]['dados']['initialDate'] for chamada in atualizador.conexao.get.call_args_list].should.be.equal(['2015-01-01T00:00', '2015-01-31T00:00'])
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.AtualizaTransacoes.obter_conexao', mock.MagicMock())
+    def test_deve_aceitar_pagina_sem_transacoes(self):
+        atualizador = self.cria_atualizador({'data_inicial': '2015-01-01T00:00', 'data_final': '2015-01-10T00:00'})
+        atualizador.conexao.get.return_value = mock.MagicMock(sucesso=True, conteudo={'transactionSearchResult': {'resultsInThisPage': '0', 'totalPages': '0'}})
+        list(atualizador.itera_transacoes()).should.be.equal([])
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.AtualizaTransacoes.obter_conexao', mock.MagicMock())
+    def test_deve_parar_e_guardar_erros(self):
+        atualizador = self.cria_atualizador({'data_inicial': '2015-01-01T00:00', 'data_final': '2015-01-10T00:00'})
+        erro = mock.MagicMock(sucesso=False, conteudo={'errors': {'error': {'code': '53110'}}})
+        atualizador.conexao.get.side_effect = [pagina_de_busca(1, 2, ['10']), erro]
+        [dados['pedido_numero'] for dados in atualizador.itera_transacoes()].should.be.equal(['10'])
+        atualizador.erros.should.be.equal({'errors': {'error': {'code': '53110'}}})
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.AtualizaTransacoes.obter_conexao', mock.MagicMock())
+    def test_deve_guardar_status_code_de_erro_sem_corpo(self):
+        atualizador = self.cria_atualizador({'data_inicial': '2015-01-01T00:00', 'data_final': '2015-01-10T00:00'})
+        atualizador.conexao.get.side_effect = [pagina_de_busca(1, 2, ['10']), mock.MagicMock(sucesso=False, status_code=429, conteudo={})]
+        [dados['pedido_numero'] for dados in atualizador.itera_transacoes()].should.be.equal(['10'])
+        atualizador.erros.should.be.equal({'status_code': 429})
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.AtualizaTransacoes.obter_conexao', mock.MagicMock())
+    def test_deve_pre_carregar_proxima_pagina(self):
+        atualizador = self.cria_atualizador({'data_inicial': '2015-01-01T00:00', 'data_final': '2015-01-10T00:00'})
+        atualizador.conexao.get.side_effect = [pagina_de_busca(1, 2, ['10']), pagina_de_busca(2, 2, ['11'])]
+        transacoes = atualizador.itera_transacoes(pre_carrega=True)
+        next(transacoes)['pedido_numero'].should.be.equal('10')
+        time.sleep(0.05)
+        atualizador.conexao.get.call_count.should.be.equal(2)
+        next(transacoes)['pedido_numero'].should.be.equal('11')
+        list(transacoes).should.be.equal([])
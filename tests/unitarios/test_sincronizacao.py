@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import mock
+
+from pagador_pagseguro_transparente import respostas, servicos, sincronizacao
+
+AGORA = datetime(2015, 1, 10, 12, 0)
+
+
+def pagina_de_busca(pagina, total_paginas, transacoes):
+    transacoes = [{'transaction': {'code': codigo, 'reference': codigo[1:], 'status': situacao}} for codigo, situacao in transacoes]
+    return mock.MagicMock(sucesso=True, conteudo={'transactionSearchResult': {
+        'currentPage': str(pagina), 'totalPages': str(total_paginas), 'resultsInThisPage': str(len(transacoes)),
+        'transactions': transacoes[0] if len(transacoes) == 1 else transacoes
+    }})
+
+
+class MarcasDeSincronizacao(unittest.TestCase):
+    def setUp(self):
+        self.diretorio = tempfile.mkdtemp()
+        self.caminho = os.path.join(self.diretorio, 'marcas.db')
+        self.marcas = sincronizacao.MarcasDeSincronizacao(self.caminho)
+
+    def tearDown(self):
+        self.marcas.fecha()
+        shutil.rmtree(self.diretorio)
+
+    def test_deve_guardar_situacoes_e_marca_da_loja(self):
+        self.marcas.registra_pagina(8, [respostas.Transacao(codigo='C1', situacao='3'), respostas.Transacao(situacao='1')], marca='2015-01-10T12:00')
+        self.marcas.marca(8).should.be.equal('2015-01-10T12:00')
+        self.marcas.marca(9).should.be.none
+        self.marcas.situacoes(8, ['C1', 'C2']).should.be.equal({'C1': '3'})
+        self.marcas.situacoes(9, ['C1']).should.be.equal({})
+
+    def test_nao_deve_voltar_a_marca(self):
+        self.marcas.registra_pagina(8, [], marca='2015-01-10T12:00')
+        self.marcas.registra_pagina(8, [], marca='2015-01-09T12:00')
+        self.marcas.marca(8).should.be.equal('2015-01-10T12:00')
+
+    def test_deve_consultar_muitos_codigos(self):
+        self.marcas.registra_pagina(8, [respostas.Transacao(codigo='C{}'.format(indice), situacao='3') for indice in range(1200)])
+        len(self.marcas.situacoes(8, ['C{}'.format(indice) for indice in range(1200)])).should.be.equal(1200)
+
+    def test_deve_compartilhar_entre_conexoes(self):
+        self.marcas.registra_pagina(8, [], marca='2015-01-10T12:00')
+        outras = sincronizacao.MarcasDeSincronizacao(self.caminho)
+        outras.marca(8).should.be.equal('2015-01-10T12:00')
+        outras.fecha()
+
+    def test_deve_limpar_a_loja(self):
+        self.marcas.registra_pagina(8, [respostas.Transacao(codigo='C1', situacao='3')], marca='2015-01-10T12:00')
+        self.marcas.registra_pagina(9, [], marca='2015-01-10T12:00')
+        self.marcas.limpa(8)
+        self.marcas.marca(8).should.be.none
+        self.marcas.situacoes(8, ['C1']).should.be.equal({})
+        self.marcas.marca(9).should_not.be.none
+
+
+class AtualizaTransacoesIncrementais(unittest.TestCase):
+    def setUp(self):
+        servicos.PARAMETROS_CONTRATO.limpa()
+        servicos.SITUACOES_TRANSACOES.limpa()
+        self.diretorio = tempfile.mkdtemp()
+        self.marcas = sincronizacao.MarcasDeSincronizacao(os.path.join(self.diretorio, 'marcas.db'))
+
+    def tearDown(self):
+        self.marcas.fecha()
+        shutil.rmtree(self.diretorio)
+
+    @mock.patch('pagador_pagseguro_transparente.servicos.AtualizaTransacoes.obter_conexao', mock.MagicMock())
+    def cria_atualizador(self, dados=None):
+        atualizador = sincronizacao.AtualizaTransacoesIncrementais(8, dados or {}, self.marcas, agora=AGORA)
+        atualizador._gera_dados_envio = mock.MagicMock(return_value={'appKey': 'app-secret', 'appId': 'app-id'})
+        atualizador.conexao = mock.MagicMock()
+        return atualizador
+
+    def datas_buscadas(self, atualizador):
+        return [(chamada[1]['dados']['initialDate'], chamada[1]['dados']['finalDate']) for chamada in atualizador.conexao.get.call_args_list]
+
+    def test_deve_buscar_os_ultimos_dias_na_primeira_sincronizacao(self):
+        atualizador = self.cria_atualizador()
+        atualizador.dados['data_inicial'].should.be.equal('2014-12-11T12:00')
+        atualizador.dados['data_final'].should.be.equal('2015-01-10T12:00')
+
+    def test_deve_usar_data_inicial_dos_dados_sem_marca(self):
+        self.cria_atualizador({'data_inicial': '2015-01-05T00:00'}).dados['data_inicial'].should.be.equal('2015-01-05T00:00')
+
+    def test_deve_buscar_a_partir_da_marca_com_sobreposicao(self):
+        self.marcas.registra_pagina(8, [], marca='2015-01-10T10:00')
+        atualizador = self.cria_atualizador({'data_inicial': '2015-01-01T00:00'})
+        atualizador.conexao.get.return_value = pagina_de_busca(1, 1, [])
+        list(atualizador.itera_transacoes())
+        self.datas_buscadas(atualizador).should.be.equal([('2015-01-10T09:50', '2015-01-10T12:00')])
+
+    def test_deve_avancar_a_marca_ao_fim_da_busca(self):
+        atualizador = self.cria_atualizador({'data_inicial': '2015-01-09T00:00'})
+        atualizador.conexao.get.return_value = pagina_de_busca(1, 1, [('C10', '3')])
+        list(atualizador.itera_transacoes())
+        self.marcas.marca(8).should.be.equal('2015-01-10T12:00')
+
+    def test_deve_pular_transacoes_com_a_mesma_situacao(self):
+        self.marcas.registra_pagina(8, [respostas.Transacao(codigo='C10', situacao='3'), respostas.Transacao(codigo='C11', situacao='1')])
+        atualizador = self.cria_atualizador({'data_inicial': '2015-01-09T00:00'})
+        atualizador.conexao.get.return_value = pagina_de_busca(1, 1, [('C10', '3'), ('C11', '3'), ('C12', '1')])
+        [dados['pedido_numero'] for dados in atualizador.itera_transacoes()].should.be.equal(['11', '12'])
+        atualizador.puladas.should.be.equal(1)
+        self.marcas.situacoes(8, ['C11', 'C12']).should.be.equal({'C11': '3', 'C12': '1'})
+
+    def test_deve_gravar_cada_pagina_depois_de_consumida(self):
+        atualizador = self.cria_atualizador({'data_inicial': '2015-01-09T00:00'})
+        atualizador.conexao.get.side_effect = [pagina_de_busca(1, 2, [('C10', '3')]), pagina_de_busca(2, 2, [('C11', '3')])]
+        transacoes = atualizador.itera_transacoes()
+        next(transacoes)
+        self.marcas.situacoes(8, ['C10']).should.be.equal({})
+        next(transacoes)
+        self.marcas.situacoes(8, ['C10']).should.be.equal({'C10': '3'})
+        self.marcas.marca(8).should.be.none
+        list(transacoes)
+        self.marcas.marca(8).should.be.equal('2015-01-10T12:00')
+
+    def test_deve_avancar_a_marca_por_janela(self):
+        atualizador = self.cria_atualizador({'data_inicial': '2014-11-01T00:00'})
+        atualizador.conexao.get.side_effect = [pagina_de_busca(1, 1, [('C10', '3')]), mock.MagicMock(sucesso=False, conteudo={'errors': {}})]
+        list(atualizador.itera_transacoes())
+        self.marcas.marca(8).should.be.equal('2014-12-01T00:00')
+        atualizador.erros.should.be.equal({'errors': {}})
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from pagador_pagseguro_transparente import respostas, situacoes
+
+
+def transacao(situacao, codigo='transacao-id'):
+    return respostas.Transacao(codigo=codigo, referencia='2222', situacao=situacao, valor='10.00')
+
+
+class SituacoesDeTransacoes(unittest.TestCase):
+    def setUp(self):
+        self.agora = 1000.0
+        self.situacoes = situacoes.SituacoesDeTransacoes(politica={'1': 15, '3': 600}, relogio=lambda: self.agora)
+
+    def test_deve_devolver_transacao_registrada(self):
+        self.situacoes.registra(8, transacao('3'))
+        encontrada = self.situacoes.consulta(8, 'transacao-id')
+        (encontrada.codigo, encontrada.referencia, encontrada.situacao, encontrada.valor).should.be.equal(('transacao-id', '2222', '3', '10.00'))
+        self.situacoes.consulta(9, 'transacao-id').should.be.none
+
+    def test_deve_valer_pelo_frescor_do_status(self):
+        self.situacoes.registra(8, transacao('1', 'aguardando'))
+        self.situacoes.registra(8, transacao('3', 'paga'))
+        self.agora += 16
+        self.situacoes.consulta(8, 'aguardando').should.be.none
+        self.situacoes.consulta(8, 'paga').should_not.be.none
+
+    def test_nao_deve_registrar_status_fora_da_politica_ou_sem_codigo(self):
+        self.situacoes.registra(8, transacao('7'))
+        self.situacoes.registra(8, transacao('3', None))
+        len(self.situacoes.memoria).should.be.equal(0)
+
+    def test_deve_substituir_pela_ultima_situacao_vista(self):
+        self.situacoes.registra(8, transacao('3'))
+        self.situacoes.registra(8, transacao('1'))
+        self.situacoes.consulta(8, 'transacao-id').situacao.should.be.equal('1')
+        self.agora += 16
+        self.situacoes.consulta(8, 'transacao-id').should.be.none
+
+
+class BackendSQLite(unittest.TestCase):
+    def setUp(self):
+        self.agora = 1000.0
+        self.diretorio = tempfile.mkdtemp()
+        self.caminho = os.path.join(self.diretorio, 'situacoes.db')
+        self.backend = situacoes.BackendSQLite(self.caminho, relogio=lambda: self.agora)
+
+    def tearDown(self):
+        self.backend.fecha()
+        shutil.rmtree(self.diretorio)
+
+    def cria_situacoes(self, backend):
+        return situacoes.SituacoesDeTransacoes(backend=backend, relogio=lambda: self.agora)
+
+    def test_deve_compartilhar_entre_processos(self):
+        self.cria_situacoes(self.backend).registra(8, transacao('3'))
+        outro_backend = situacoes.BackendSQLite(self.caminho, relogio=lambda: self.agora)
+        outras = self.cria_situacoes(outro_backend)
+        outras.consulta(8, 'transacao-id').situacao.should.be.equal('3')
+        outras.estatisticas()['acertos_backend'].should.be.equal(1)
+        outro_backend.fecha()
+
+    def test_deve_manter_a_validade_ao_trazer_para_a_memoria(self):
+        self.cria_situacoes(self.backend).registra(8, transacao('1'))
+        outras = self.cria_situacoes(self.backend)
+        self.agora += 10
+        outras.consulta(8, 'transacao-id').should_not.be.none
+        self.agora += 6
+        outras.consulta(8, 'transacao-id').should.be.none
+
+    def test_deve_ignorar_entrada_vencida(self):
+        self.backend.registra(u'8:transacao-id', transacao('3').to_dict(), self.agora + 5)
+        self.agora += 5
+        self.backend.consulta(u'8:transacao-id').should.be.none
+
+
+class SituacoesRecentesDosPedidos(unittest.TestCase):
+    def setUp(self):
+        self.agora = 1000.0
+        self.pedidos = situacoes.SituacoesRecentesDosPedidos(ordem=int, janela=30, relogio=lambda: self.agora)
+
+    def test_deve_dizer_que_situacao_anterior_foi_superada(self):
+        self.pedidos.registra(8, 2222, '3')
+        self.pedidos.superada(8, 2222, '1').should.be.true
+        self.pedidos.superada(8, 2222, '3').should.be.false
+        self.pedidos.superada(8, 2222, '7').should.be.false
+        self.pedidos.superada(8, 3333, '1').should.be.false
+        self.pedidos.estatisticas()['descartadas'].should.be.equal(1)
+
+    def test_deve_manter_a_situacao_mais_adiantada(self):
+        self.pedidos.registra(8, 2222, '3')
+        self.pedidos.registra(8, 2222, '2')
+        self.pedidos.superada(8, 2222, '2').should.be.true
+
+    def test_deve_esquecer_depois_da_janela(self):
+        self.pedidos.registra(8, 2222, '3')
+        self.agora += 31
+        self.pedidos.superada(8, 2222, '1').should.be.false
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from li_common.padroes.serializacao import Formatador
+
+from pagador_pagseguro_transparente import textos
+
+
+class ParaAscii(unittest.TestCase):
+    def setUp(self):
+        textos.MEMO.limpa()
+
+    def test_deve_ter_mesmo_resultado_do_formatador(self):
+        for texto in (u'Rua São João', u'Ação – “aspas” …', u'Çañón ﬁ ½', u'中文', u'', u'Camiseta Básica'.encode('utf-8'), 'Rio de Janeiro', None):
+            for limite in (None, 0, 5, 100):
+                resultado = textos.para_ascii(texto, limite)
+                resultado.should.be.equal(Formatador.trata_unicode_com_limite(texto, limite, ascii=True))
+                resultado.should.be.a(str)
+
+    def test_deve_devolver_texto_ascii_sem_transliterar(self):
+        texto = 'Rio de Janeiro'
+        textos.para_ascii(texto).should.be(texto)
+        textos.para_ascii(texto, 3).should.be.equal('Rio')
+        len(textos.MEMO).should.be.equal(0)
+
+    def test_deve_guardar_transliteracao_por_texto_e_limite(self):
+        textos.para_ascii(u'São Paulo', 3).should.be.equal('Sao')
+        textos.para_ascii(u'São Paulo', 100).should.be.equal('Sao Paulo')
+        textos.MEMO.consulta((u'São Paulo', 3)).should.be.equal('Sao')
+        len(textos.MEMO).should.be.equal(2)
+
+    def test_deve_disparar_erro_do_formatador_para_tipos_nao_texto(self):
+        textos.para_ascii.when.called_with(123, 10).should.throw(AttributeError)
+
+
+class MemoLRU(unittest.TestCase):
+    def test_deve_manter_entradas_usadas_na_troca_de_geracao(self):
+        memo = textos.MemoLRU(tamanho_maximo=4)
+        memo.define('a', 1)
+        memo.define('b', 2)
+        memo.define('c', 3)
+        memo.consulta('a').should.be.equal(1)
+        memo.define('d', 4)
+        memo.define('e', 5)
+        memo.consulta('a').should.be.equal(1)
+        memo.consulta('b').should.be.none
+        len(memo).should.be.lower_than_or_equal_to(4)
+
+    def test_deve_limpar(self):
+        memo = textos.MemoLRU()
+        memo.define('a', 1)
+        memo.limpa()
+        memo.consulta('a').should.be.none